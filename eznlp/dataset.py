@@ -1,16 +1,148 @@
 # -*- coding: utf-8 -*-
 from typing import List, Any
+import os
+import copy
+import json
+import pickle
+import hashlib
+import shutil
+import uuid
+import logging
+import math
 import random
 import torch
 
 from .nn.functional import seq_lens2mask
 from .wrapper import Batch
+from .config import Config
 from .model.model import ModelConfigBase
 from .plm import PreTrainingConfig
 
+logger = logging.getLogger(__name__)
+
+
+def _update_fingerprint(hasher, obj):
+    """Update `hasher` with a stable representation of `obj`, which covers the settings relevant to 
+    `exemplify` (e.g., configurations, vocabularies and tokenizers), but skips the model weights. 
+    """
+    if isinstance(obj, torch.nn.Module):
+        hasher.update(type(obj).__qualname__.encode())
+    elif isinstance(obj, torch.Tensor):
+        hasher.update(f"Tensor{tuple(obj.size())}".encode())
+        hasher.update(obj.detach().cpu().numpy().tobytes())
+    elif isinstance(obj, Config):
+        hasher.update(type(obj).__qualname__.encode())
+        _update_fingerprint(hasher, vars(obj))
+    elif isinstance(obj, (set, frozenset)):
+        # The iteration order of sets is unstable across runs
+        _update_fingerprint(hasher, sorted(obj, key=repr))
+    elif isinstance(obj, (list, tuple)):
+        hasher.update(f"{type(obj).__name__}[{len(obj)}]".encode())
+        for x in obj:
+            _update_fingerprint(hasher, x)
+    elif isinstance(obj, dict):
+        hasher.update(f"dict[{len(obj)}]".encode())
+        for k, v in obj.items():
+            _update_fingerprint(hasher, k)
+            _update_fingerprint(hasher, v)
+    elif callable(obj) and hasattr(obj, '__qualname__'):
+        # Functions, methods and classes, whose `repr` contains the memory address
+        hasher.update(f"{getattr(obj, '__module__', None)}.{obj.__qualname__}".encode())
+    elif hasattr(obj, '__dict__') and type(obj).__repr__ is object.__repr__:
+        # The default `repr` contains the memory address, which is unstable
+        hasher.update(type(obj).__qualname__.encode())
+        _update_fingerprint(hasher, vars(obj))
+    elif type(obj).__repr__ is object.__repr__:
+        hasher.update(type(obj).__qualname__.encode())
+    else:
+        hasher.update(repr(obj).encode())
+
+
+
+class ExampleCache(object):
+    """An on-disk cache of preprocessed examples, stored as shards of `torch.save` files plus an index. 
+    The shards are memory-mapped when loaded, if supported by the installed PyTorch. 
+    
+    Parameters
+    ----------
+    cache_dir: str
+        The directory of cache; a sub-directory named by `fingerprint` is used. 
+    fingerprint: str
+        A stable hash of the configurations and data. 
+    """
+    def __init__(self, cache_dir: str, fingerprint: str, shard_size: int=1024):
+        self.cache_path = os.path.join(cache_dir, fingerprint)
+        self.shard_size = shard_size
+        self._shard_idx, self._shard = None, None
+        
+    @property
+    def _index_path(self):
+        return os.path.join(self.cache_path, "index.json")
+        
+    def _shard_path(self, shard_idx: int, cache_path: str=None):
+        return os.path.join(self.cache_path if cache_path is None else cache_path, f"shard-{shard_idx:05d}.pt")
+        
+    @property
+    def exists(self):
+        return os.path.exists(self._index_path)
+        
+    def build(self, examples):
+        """Write the cache into a temporary directory, and rename it as `cache_path` at last. Hence, concurrent 
+        builders (e.g., `DataLoader` workers or distributed processes) never read or overwrite a partial cache. 
+        """
+        tmp_path = f"{self.cache_path}.tmp-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        os.makedirs(tmp_path)
+        num_examples, shard = 0, []
+        for example in examples:
+            shard.append(example)
+            num_examples += 1
+            if len(shard) == self.shard_size:
+                torch.save(shard, self._shard_path((num_examples-1) // self.shard_size, cache_path=tmp_path))
+                shard = []
+        if len(shard) > 0:
+            torch.save(shard, self._shard_path((num_examples-1) // self.shard_size, cache_path=tmp_path))
+        
+        with open(os.path.join(tmp_path, "index.json"), 'w') as f:
+            json.dump({'num_examples': num_examples, 'shard_size': self.shard_size}, f)
+        
+        try:
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            # The same cache has been completed by another builder
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not self.exists:
+                raise
+        
+    def load(self):
+        with open(self._index_path) as f:
+            index = json.load(f)
+        self.num_examples, self.shard_size = index['num_examples'], index['shard_size']
+        
+    def _load_shard(self, shard_idx: int):
+        try:
+            return torch.load(self._shard_path(shard_idx), mmap=True, weights_only=False)
+        except TypeError:
+            # Earlier PyTorch without `mmap` or `weights_only`
+            return torch.load(self._shard_path(shard_idx))
+        
+    def __len__(self):
+        return self.num_examples
+        
+    def __getitem__(self, i: int):
+        shard_idx = i // self.shard_size
+        if shard_idx != self._shard_idx:
+            self._shard_idx, self._shard = shard_idx, self._load_shard(shard_idx)
+        # Return a deep copy, so that the cached example (e.g., the target objects, which may be moved 
+        # to device or assigned predictions) is never modified in place
+        return copy.deepcopy(self._shard[i % self.shard_size])
+        
+    def __getstate__(self):
+        # Shards are re-loaded in each process (e.g., `DataLoader` workers)
+        return {**self.__dict__, '_shard_idx': None, '_shard': None}
+
 
 class Dataset(torch.utils.data.Dataset):
-    def __init__(self, data: List[dict], config: ModelConfigBase, training: bool=True):
+    def __init__(self, data: List[dict], config: ModelConfigBase, training: bool=True, cache_dir: str=None):
         """
         Parameters
         ----------
@@ -21,11 +153,19 @@ class Dataset(torch.utils.data.Dataset):
                   (2) each `chunk` follows the format of (chunk_type, chunk_start, chunk_end). 
                   (3) each `relation` follows the format of (relation_type, head_chunk, tail_chunk), 
                       i.e., (relation_type, (head_type, head_start, head_end), (tail_type, tail_start, tail_end)). 
+        cache_dir : str, optional
+            If specified, the preprocessed examples are cached on disk (built at the end of `build_vocabs_and_dims`, 
+            or by `build_cache` for the datasets sharing built configurations), and re-used across epochs and 
+            runs with the same configurations and data. 
+            In training, the sub-configs in `config._stochastic_names` (e.g., with negative sampling) are 
+            still exemplified on the fly. 
         """
         super().__init__()
         self.data = data
         self.config = config
         self.training = training
+        self.cache_dir = cache_dir
+        self._cache = None
         
     def __len__(self):
         return len(self.data)
@@ -70,11 +210,20 @@ class Dataset(torch.utils.data.Dataset):
         
     def build_vocabs_and_dims(self, *others):
         self.config.build_vocabs_and_dims(self.data, *others)
+        # Build the cache eagerly in the main process, instead of in `DataLoader` workers
+        if self.cache_dir is not None and len(self) > 0:
+            self.build_cache()
+        
+    @property
+    def seq_lens(self):
+        """The sequence length of each example, e.g., for `LengthBucketBatchSampler`. 
+        """
+        return [len(self.data[i]['tokens']) for i in range(len(self))]
         
     def _get_entry(self, i):
         return self.data[i]
         
-    def __getitem__(self, i):
+    def _exemplify(self, i):
         entry = self._get_entry(i)
         example = {}
         if 'tokens' in self.data[0]:
@@ -84,6 +233,46 @@ class Dataset(torch.utils.data.Dataset):
         return example
         
         
+    @property
+    def fingerprint(self):
+        hasher = hashlib.sha1()
+        _update_fingerprint(hasher, (type(self).__qualname__, self.training, len(self)))
+        _update_fingerprint(hasher, self.config)
+        hasher.update(pickle.dumps(self.data, protocol=4))
+        return hasher.hexdigest()
+        
+    def build_cache(self, cache_dir: str=None, shard_size: int=1024):
+        """Build (or load, if existing) the on-disk cache of preprocessed examples. 
+        """
+        if cache_dir is not None:
+            self.cache_dir = cache_dir
+        assert self.cache_dir is not None
+        
+        self._cache = ExampleCache(self.cache_dir, self.fingerprint, shard_size=shard_size)
+        if not self._cache.exists:
+            logger.info(f"Building dataset cache at {self._cache.cache_path}")
+            self._cache.build(self._exemplify(i) for i in range(len(self)))
+        self._cache.load()
+        assert len(self._cache) == len(self)
+        
+        
+    def __getitem__(self, i):
+        if self.cache_dir is None or len(self) == 0:
+            return self._exemplify(i)
+        
+        if self._cache is None:
+            self.build_cache()
+        
+        example = self._cache[i]
+        if self.training:
+            # Training-time randomness (e.g., negative sampling) remains on the fly
+            entry = self._get_entry(i)
+            for name in self.config._stochastic_names:
+                if getattr(self.config, name) is not None:
+                    example.update(getattr(self.config, name).exemplify(entry, training=True))
+        return example
+        
+        
     def collate(self, batch_examples: List[dict]):
         batch = {}
         if 'tokens' in self.data[0]:
@@ -121,6 +310,13 @@ class GenerationDataset(Dataset):
         else:
             return len(self.data)
         
+    @property
+    def seq_lens(self):
+        if self.training:
+            return [len(self.data[src_idx]['tokens']) for src_idx, _ in self._indexing]
+        else:
+            return super().seq_lens
+        
     def _get_entry(self, i):
         if self.training:
             src_idx, trg_idx = self._indexing[i]
@@ -133,6 +329,81 @@ class GenerationDataset(Dataset):
 
 
 
+class LengthBucketBatchSampler(torch.utils.data.Sampler):
+    """A batch sampler grouping examples of similar lengths, which reduces the padded tokens in batches. 
+    
+    The (optionally shuffled) indices are split into buckets of `bucket_size` examples; the examples 
+    are sorted by length within each bucket, and then sliced into batches. The batch order is shuffled 
+    if `shuffle` is True. 
+    
+    Parameters
+    ----------
+    seq_lens: List[int]
+        The sequence length of each example, e.g., `Dataset.seq_lens`. 
+    batch_size: int
+        The maximum number of examples in a batch. 
+    max_tokens: int
+        The maximum number of (padded) tokens in a batch, i.e., `num_examples * max_seq_len`. 
+        An example longer than `max_tokens` forms a batch by itself. 
+    bucket_size: int
+        The number of examples in a bucket. If None, all examples are in one bucket (i.e., sorted globally). 
+    """
+    def __init__(self, seq_lens: List[int], batch_size: int=None, max_tokens: int=None, shuffle: bool=False, bucket_size: int=None):
+        if batch_size is None and max_tokens is None:
+            raise ValueError("At least one of `batch_size` and `max_tokens` should be specified")
+        self.seq_lens = seq_lens
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        self.bucket_size = bucket_size if bucket_size is not None else len(seq_lens)
+        
+        
+    def _build_batches(self):
+        indices = list(range(len(self.seq_lens)))
+        if self.shuffle:
+            random.shuffle(indices)
+        
+        batches = []
+        for bucket_start in range(0, len(indices), max(self.bucket_size, 1)):
+            bucket = sorted(indices[bucket_start:bucket_start+self.bucket_size], key=lambda i: self.seq_lens[i])
+            
+            batch, batch_max_len = [], 0
+            for i in bucket:
+                curr_max_len = max(batch_max_len, self.seq_lens[i])
+                if len(batch) > 0 and ((self.batch_size is not None and len(batch) + 1 > self.batch_size) or 
+                                       (self.max_tokens is not None and (len(batch) + 1) * curr_max_len > self.max_tokens)):
+                    batches.append(batch)
+                    batch, curr_max_len = [], self.seq_lens[i]
+                batch.append(i)
+                batch_max_len = curr_max_len
+            if len(batch) > 0:
+                batches.append(batch)
+        
+        if self.shuffle:
+            random.shuffle(batches)
+        return batches
+        
+        
+    def __len__(self):
+        # NOTE: The random state should not be consumed here, since the random state at the epoch start 
+        # may be restored to replay the batches (e.g., in `Trainer.train_steps` when resuming). 
+        if self.max_tokens is None:
+            # The number of batches in each bucket is determined by the bucket size
+            num_examples, bucket_size = len(self.seq_lens), max(self.bucket_size, 1)
+            return sum(math.ceil(min(bucket_size, num_examples-bucket_start) / self.batch_size) for bucket_start in range(0, num_examples, bucket_size))
+        else:
+            # The number of batches depends on the lengths in each bucket; restore the random state after building
+            random_state = random.getstate()
+            try:
+                return len(self._build_batches())
+            finally:
+                random.setstate(random_state)
+        
+    def __iter__(self):
+        yield from self._build_batches()
+
+
+
 class PreTrainingDataset(torch.utils.data.Dataset):
     """Dataset for Pre-training. 
     """
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 from typing import List
+from collections import OrderedDict
+import weakref
 import logging
 import re
 import tqdm
@@ -9,7 +11,7 @@ import torch
 import transformers
 
 from ..utils import find_ascending
-from ..token import TokenSequence
+from ..token import TokenSequence, ColumnarTokenSequence
 from ..nn.modules import SequenceGroupAggregating, ScalarMix
 from ..nn.functional import seq_lens2mask
 from ..config import Config
@@ -133,6 +135,14 @@ class BertLikeConfig(Config):
         return example
         
         
+    def build_sub_tokens_cache(self, *partitions):
+        """Batch-tokenize the distinct words in `partitions` into the word -> sub-tokens cache. 
+        """
+        if self.from_tokenized and (not self.from_subtokenized):
+            for data in partitions:
+                _prefetch_sub_tokens(data, self.tokenizer)
+        
+        
     def exemplify(self, tokens: TokenSequence):
         tokenized_raw_text = tokens.raw_text
         
@@ -290,8 +300,11 @@ def truecase_for_bert_like(data: list, verbose=True):
         new_tokenized_raw_text = _truecase(tokenized_raw_text)
         if new_tokenized_raw_text != tokenized_raw_text:
             # Directly modify the `raw_text` attribute for each token; `text` attribute remains unchanged
-            for tok, new_raw_text in zip(entry['tokens'].token_list, new_tokenized_raw_text):
-                tok.raw_text = new_raw_text
+            if isinstance(tokens, ColumnarTokenSequence):
+                tokens.reset_raw_text(new_tokenized_raw_text)
+            else:
+                for tok, new_raw_text in zip(entry['tokens'].token_list, new_tokenized_raw_text):
+                    tok.raw_text = new_raw_text
             num_truecased += 1
     
     logger.info(f"Truecased sequences: {num_truecased} ({num_truecased/len(data)*100:.2f}%)")
@@ -299,10 +312,56 @@ def truecase_for_bert_like(data: list, verbose=True):
 
 
 
+# Word -> sub-tokens LRU caches, one for each tokenizer, shared across `BertLikeConfig` and the preprocessing functions
+SUB_TOKENS_CACHE_SIZE = 2**18
+_sub_tokens_caches = weakref.WeakKeyDictionary()
+
+def _tokenize_words(words: List[str], tokenizer: transformers.PreTrainedTokenizer, batch_size: int=10000):
+    """Tokenize each word into sub-tokens, with a word -> sub-tokens LRU cache. 
+    
+    The uncached words are tokenized in batches if `tokenizer` is a fast tokenizer. Note that each word is 
+    encoded as a separate sequence, which is equivalent to `tokenizer.tokenize(word)`; while `is_split_into_words` 
+    may prepend spaces to words (e.g., for RoBERTa), and yield different sub-tokens. 
+    """
+    if tokenizer not in _sub_tokens_caches:
+        _sub_tokens_caches[tokenizer] = OrderedDict()
+    cache = _sub_tokens_caches[tokenizer]
+    
+    uncached = list(dict.fromkeys(word for word in words if word not in cache))
+    if getattr(tokenizer, 'is_fast', False) and len(uncached) > 1:
+        for k in range(0, len(uncached), batch_size):
+            batch_words = uncached[k:k+batch_size]
+            encoded = tokenizer(batch_words, add_special_tokens=False)
+            for i, word in enumerate(batch_words):
+                cache[word] = tuple(encoded.tokens(i))
+    else:
+        for word in uncached:
+            cache[word] = tuple(tokenizer.tokenize(word))
+    
+    nested_sub_tokens = []
+    for word in words:
+        cache.move_to_end(word)
+        nested_sub_tokens.append(cache[word])
+    
+    while len(cache) > SUB_TOKENS_CACHE_SIZE:
+        cache.popitem(last=False)
+    return nested_sub_tokens
+
+
+def _prefetch_sub_tokens(data: list, tokenizer: transformers.PreTrainedTokenizer, tokens_keys: List[str]=None):
+    """Tokenize the distinct words in `data` in batches, to warm up the word -> sub-tokens cache. 
+    """
+    if tokens_keys is None:
+        tokens_keys = ['tokens', 'paired_tokens']
+    words = list(dict.fromkeys(word for entry in data for key in tokens_keys if key in entry for word in entry[key].raw_text))
+    # Only prefetch as many words as the cache holds
+    _tokenize_words(words[:SUB_TOKENS_CACHE_SIZE], tokenizer)
+
+
 def _tokenized2nested(tokenized_raw_text: List[str], tokenizer: transformers.PreTrainedTokenizer, max_num_from_word: int=5):
     nested_sub_tokens = []
-    for word in tokenized_raw_text:
-        sub_tokens = tokenizer.tokenize(word)
+    for sub_tokens in _tokenize_words(tokenized_raw_text, tokenizer):
+        sub_tokens = list(sub_tokens)
         if len(sub_tokens) == 0:
             # The tokenizer returns an empty list if the input is a space-like string
             sub_tokens = [tokenizer.unk_token]
@@ -362,6 +421,7 @@ def truncate_for_bert_like(data: list,
     ----------
     [1] Sun et al. 2019. How to fine-tune BERT for text classification? CCL 2019. 
     """
+    _prefetch_sub_tokens(data, tokenizer)
     num_truncated = 0
     for entry in tqdm.tqdm(data, disable=not verbose, ncols=100, desc="Truncating data"):
         tokens = entry['tokens']
@@ -412,6 +472,7 @@ def segment_uniformly_for_bert_like(data: list, tokenizer: transformers.PreTrain
     assert 'relations' not in data[0]
     assert 'attributes' not in data[0]
     
+    _prefetch_sub_tokens(data, tokenizer)
     max_len = tokenizer.model_max_length - 2
     new_data = []
     num_segmented = 0
@@ -504,6 +565,7 @@ def subtokenize_for_bert_like(data: list, tokenizer: transformers.PreTrainedToke
     """For word-level tokens, sub-tokenize the words with sub-word `tokenizer`. 
     Modify the corresponding start/end indexes in `chunks`, `relations`, `attributes`.
     """
+    _prefetch_sub_tokens(data, tokenizer)
     new_data = []
     for entry in tqdm.tqdm(data, disable=not verbose, ncols=100, desc="Subtokenizing words in data"):
         new_entry = _subtokenize_tokens(entry, tokenizer, num_digits=num_digits)
@@ -611,6 +673,7 @@ def merge_sentences_for_bert_like(data: list, tokenizer: transformers.PreTrained
     if doc_key is None:
         logger.warning(f"Specifying `doc_key=None` will merge consecutive sentences as long as possible")
     
+    _prefetch_sub_tokens(data, tokenizer)
     max_len = tokenizer.model_max_length - 2
     new_data = []
     new_entry = {}
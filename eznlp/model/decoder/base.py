@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from typing import List, Union
+import weakref
 import torch
 
 from ...wrapper import Batch
@@ -89,6 +90,27 @@ class DecoderBase(torch.nn.Module):
     def decode(self, batch: Batch, **states):
         raise NotImplementedError("Not Implemented `decode`")
         
+    def forward_and_decode(self, batch: Batch, **states):
+        """Forward to the losses and decode, sharing the computation of scores if possible. 
+        
+        Subclasses with expensive scoring should override this method, and cache the scores 
+        by `_cache_scores`, so that a following `decode` on the same batch can reuse them. 
+        """
+        return self(batch, **states), self.decode(batch, **states)
+        
+    def _cache_scores(self, batch: Batch, hidden: torch.Tensor, scores):
+        # The cache holds weak references to `batch` and `hidden`, and the detached scores, so that it never keeps 
+        # the autograd graph alive (e.g., in training loops without a following `decode`)
+        self._scores_cache = (weakref.ref(batch), weakref.ref(hidden), _detach_scores(scores))
+        
+    def _pop_cached_scores(self, batch: Batch, hidden: torch.Tensor):
+        """Pop the cached scores if they were computed from the same `batch` and `hidden`; otherwise return None. 
+        """
+        cached = self.__dict__.pop('_scores_cache', None)
+        if cached is not None and cached[0]() is batch and cached[1]() is hidden:
+            return cached[2]
+        return None
+        
     # TODO: Loosely decoding
     def loosely_decode(self, batch: Batch, **states):
         return self.decode(batch, **states)
@@ -100,3 +122,11 @@ class DecoderBase(torch.nn.Module):
             return (self.decode(batch, **states), )
         else:
             return self.decode(batch, **states)
+
+
+
+def _detach_scores(scores):
+    if isinstance(scores, torch.Tensor):
+        return scores.detach()
+    else:
+        return [_detach_scores(x) for x in scores]
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from typing import Union, Tuple, List
 import itertools
+import functools
 import random
 import math
 import torch
@@ -60,6 +61,47 @@ def _span_sizes_from_diagonals(seq_len: int, max_span_size: int=None):
             yield k
 
 
+@functools.lru_cache(maxsize=128)
+def _diagonal_span_index(seq_len: int, max_span_size: int, device: torch.device=None):
+    """Index tensors of all spans in the diagonal format, padded to `seq_len` spans for each size. 
+    
+    The spans are laid out as a flattened (max_span_size, seq_len) grid of (size, start); for a sequence 
+    of length `curr_len`, the spans with `start + size <= curr_len` are exactly (in the same order) those 
+    yielded by `_spans_from_diagonals(curr_len, max_span_size)`. 
+    
+    The returned tensors are cached and shared; do NOT modify them in-place. 
+    
+    Returns
+    -------
+    span_starts : torch.LongTensor (num_spans = max_span_size*seq_len, )
+    span_sizes : torch.LongTensor (num_spans, )
+    span_token_ids : torch.LongTensor (num_spans, max_span_size)
+        The token indexes covered by each span, padded (and clipped) to `max_span_size`. 
+    span_token_mask : torch.BoolTensor (num_spans, max_span_size)
+        The positions with values of True are MASKED (i.e., beyond the span size). 
+    """
+    span_starts = torch.arange(seq_len, device=device).repeat(max_span_size)
+    span_sizes = torch.arange(1, max_span_size+1, device=device).repeat_interleave(seq_len)
+    offsets = torch.arange(max_span_size, device=device)
+    span_token_ids = (span_starts.unsqueeze(-1) + offsets).clamp(max=seq_len-1)
+    span_token_mask = (offsets >= span_sizes.unsqueeze(-1))
+    return span_starts, span_sizes, span_token_ids, span_token_mask
+
+
+@functools.lru_cache(maxsize=128)
+def _diagonal_span_boundaries(seq_len: int, max_span_size: int=None, device: torch.device=None):
+    """Start and end positions of spans from diagonals, i.e., in the same order as `_spans_from_diagonals`. 
+    
+    The returned tensors are cached and shared; do NOT modify them in-place. 
+    """
+    if max_span_size is None or max_span_size > seq_len:
+        max_span_size = seq_len
+    
+    span_starts, span_sizes, *_ = _diagonal_span_index(seq_len, max_span_size, device=device)
+    span_non_pad = (span_starts + span_sizes <= seq_len)
+    return span_starts[span_non_pad], (span_starts + span_sizes)[span_non_pad]
+
+
 def _ij2diagonal(i: int, j: int, seq_len: int):
     assert i <= j
     return (seq_len*2 - (j-i-1)) * (j-i) // 2 + i
@@ -93,6 +135,14 @@ class Boundaries(TargetWrapper):
     Eberts and Ulges (2019) use a fixed number of negative samples as 100. 
     Li et al. (2021) recommend negative sampling rate as 0.3 to 0.4. 
     
+    Notes
+    -----
+    The targets are stored in the diagonal format, i.e., only for spans not exceeding `max_span_size`, 
+    ordered as `_spans_from_diagonals`. The soft labels (for boundary/label smoothing) are stored only 
+    for the spans with positive probabilities, and expanded to the full `diagonal_label_ids` on access 
+    (on the device where this object lives). The dense `(num_tokens, num_tokens)` versions `label_ids`, 
+    `non_mask` and `nest_non_mask` are re-constructed on access, and should not be used in modeling. 
+    
     Parameters
     ----------
     entry: dict
@@ -113,20 +163,22 @@ class Boundaries(TargetWrapper):
             self.ori2sub_idx = entry['ori2sub_idx']
         
         self.num_tokens = len(entry['tokens'])
-        self.max_span_size = min(getattr(config, 'max_span_size', self.num_tokens), self.num_tokens)
+        # `max_span_size` may be absent or `None` for unlimited span size
+        self.max_span_size = min(getattr(config, 'max_span_size', None) or self.num_tokens, self.num_tokens)
+        num_spans = (self.num_tokens*2 - (self.max_span_size-1)) * self.max_span_size // 2
         
         if getattr(config, 'inex_mkmmd_lambda', 0.0) > 0 or config.nested_sampling_rate < 1:
-            self.nest_non_mask = torch.zeros(self.num_tokens, self.num_tokens, dtype=torch.bool)
+            self.diagonal_nest_non_mask = torch.zeros(num_spans, dtype=torch.bool)
             for label, start, end in self.chunks:
                 for nest_start, nest_end in _spans_from_nested((start, end)):
-                    self.nest_non_mask[nest_start, nest_end-1] = True
+                    if self._is_valid_span(nest_start, nest_end):
+                        self.diagonal_nest_non_mask[self._span2idx(nest_start, nest_end)] = True
         
         if training and (config.neg_sampling_rate < 1 or 
                          config.neg_sampling_power_decay > 0 or 
                          config.nested_sampling_rate < 1):
-            span_size_ids = torch.arange(self.num_tokens) - torch.arange(self.num_tokens).unsqueeze(-1)
-            non_mask_rate = config.neg_sampling_rate * (span_size_ids+1)**(-config.neg_sampling_power_decay)
-            non_mask_rate.masked_fill_(span_size_ids < 0, 0)
+            span_sizes = torch.tensor(list(_span_sizes_from_diagonals(self.num_tokens, self.max_span_size)), dtype=torch.float)
+            non_mask_rate = config.neg_sampling_rate * span_sizes**(-config.neg_sampling_power_decay)
             non_mask_rate.clamp_(max=1)
             
             # Extra sampling rate surrounding positive samples
@@ -136,71 +188,120 @@ class Boundaries(TargetWrapper):
                 for label, start, end in self.chunks:
                     for dist in range(1, config.neg_sampling_surr_size+1):
                         for surr_start, surr_end in _spans_from_surrounding((start, end), dist, self.num_tokens):
-                            surr_non_mask[surr_start, surr_end-1] = True
+                            if self._is_valid_span(surr_start, surr_end):
+                                surr_non_mask[self._span2idx(surr_start, surr_end)] = True
                 non_mask_rate[surr_non_mask] += (1 - non_mask_rate[surr_non_mask]) * config.neg_sampling_surr_rate
             
             # Reduce sampling rate for spans nested in positive samples
             # p <- p * p_{nest}
             if config.nested_sampling_rate < 1:
-                non_mask_rate[self.nest_non_mask] *= config.nested_sampling_rate
+                non_mask_rate[self.diagonal_nest_non_mask] *= config.nested_sampling_rate
             
             # Sampling rate set to 1 for positive samples
             for label, start, end in self.chunks:
-                non_mask_rate[start, end-1] = 1
+                if self._is_valid_span(start, end):
+                    non_mask_rate[self._span2idx(start, end)] = 1
             
             # Bernoulli sampling according probability in `non_mask_rate`
-            self.non_mask = non_mask_rate.bernoulli().bool() 
+            self.diagonal_non_mask = non_mask_rate.bernoulli().bool() 
             
             # In case of all masked (may appears when no positive samples, very short sequence, and low negative sampling rate), 
             # randomly re-select one span of size 1 for un-masking. 
-            if not self.non_mask.any().item():
+            if not self.diagonal_non_mask.any().item():
                 start = random.randrange(self.num_tokens)
-                self.non_mask[start, start] = True
+                self.diagonal_non_mask[self._span2idx(start, start+1)] = True
         
         if self.chunks is not None:
+            self.none_idx = config.none_idx
             if config.sb_epsilon <= 0 and config.sl_epsilon <= 0:
                 # Cross entropy loss for non-smoothing
-                self.label_ids = torch.full((self.num_tokens, self.num_tokens), config.none_idx, dtype=torch.long)
+                self.diagonal_label_ids = torch.full((num_spans, ), config.none_idx, dtype=torch.long)
                 for label, start, end in self.chunks:
-                    self.label_ids[start, end-1] = config.label2idx[label]
+                    if self._is_valid_span(start, end):
+                        self.diagonal_label_ids[self._span2idx(start, end)] = config.label2idx[label]
             else:
                 # Soft label loss for boundary/label smoothing 
-                self.label_ids = torch.zeros(self.num_tokens, self.num_tokens, config.voc_dim, dtype=torch.float)
+                # Only the spans with positive probabilities on non-`<none>` labels are stored 
+                soft_label_entries = []
                 for label, start, end in self.chunks:
                     label_id = config.label2idx[label]
-                    self.label_ids[start, end-1, label_id] += (1 - config.sb_epsilon)
+                    soft_label_entries.append((start, end, label_id, 1 - config.sb_epsilon))
                     
                     for dist in range(1, config.sb_size+1):
                         eps_per_span = config.sb_epsilon / (config.sb_size * dist * 4)
                         sur_spans = list(_spans_from_surrounding((start, end), dist, self.num_tokens))
                         for sur_start, sur_end in sur_spans:
-                            self.label_ids[sur_start, sur_end-1, label_id] += (eps_per_span*config.sb_adj_factor)
+                            soft_label_entries.append((sur_start, sur_end, label_id, eps_per_span*config.sb_adj_factor))
                         # Absorb the probabilities assigned to illegal positions
-                        self.label_ids[start, end-1, label_id] += eps_per_span * (dist * 4 - len(sur_spans))
+                        soft_label_entries.append((start, end, label_id, eps_per_span * (dist * 4 - len(sur_spans))))
+                
+                span2row = {}
+                for start, end, label_id, value in soft_label_entries:
+                    if value > 0 and self._is_valid_span(start, end) and (start, end) not in span2row:
+                        span2row[(start, end)] = len(span2row)
+                
+                self.soft_span_ids = torch.tensor([self._span2idx(start, end) for start, end in span2row], dtype=torch.long)
+                self.soft_label_ids = torch.zeros(len(span2row), config.voc_dim, dtype=torch.float)
+                for start, end, label_id, value in soft_label_entries:
+                    if (start, end) in span2row:
+                        self.soft_label_ids[span2row[(start, end)], label_id] += value
                 
                 # In very rare cases of some datasets (e.g., ACE 2005), multiple entities may have the same span but different types
-                overflow_indic = (self.label_ids.sum(dim=-1) > 1)
+                overflow_indic = (self.soft_label_ids.sum(dim=-1) > 1)
                 if overflow_indic.any().item():
-                    self.label_ids[overflow_indic] = torch.nn.functional.normalize(self.label_ids[overflow_indic], p=1, dim=-1)
-                self.label_ids[:, :, config.none_idx] = 1 - self.label_ids.sum(dim=-1)
+                    self.soft_label_ids[overflow_indic] = torch.nn.functional.normalize(self.soft_label_ids[overflow_indic], p=1, dim=-1)
+                self.soft_label_ids[:, config.none_idx] = 1 - self.soft_label_ids.sum(dim=-1)
                 
                 if config.sl_epsilon > 0:
                     # Do not smooth to `<none>` label
                     pos_indic = (torch.arange(config.voc_dim) != config.none_idx)
-                    self.label_ids[:, :, pos_indic] = (self.label_ids[:, :, pos_indic] * (1-config.sl_epsilon) + 
-                                                       self.label_ids[:, :, pos_indic].sum(dim=-1, keepdim=True)*config.sl_epsilon / (config.voc_dim-1))
+                    self.soft_label_ids[:, pos_indic] = (self.soft_label_ids[:, pos_indic] * (1-config.sl_epsilon) + 
+                                                         self.soft_label_ids[:, pos_indic].sum(dim=-1, keepdim=True)*config.sl_epsilon / (config.voc_dim-1))
+        
+        
+    def _is_valid_span(self, start: int, end: int):
+        return 0 <= start < end <= self.num_tokens and end - start <= self.max_span_size
+        
+    def _span2idx(self, start: int, end: int):
+        # The index in the diagonal format does not depend on `max_span_size` (for valid spans)
+        return _span2diagonal(start, end, self.num_tokens)
+        
+        
+    def _expand_soft_label_ids(self):
+        num_spans = (self.num_tokens*2 - (self.max_span_size-1)) * self.max_span_size // 2
+        # diagonal_label_ids: (\sum_k seq_len-k+1, logit_dim)
+        diagonal_label_ids = torch.zeros(num_spans, self.soft_label_ids.size(-1), dtype=torch.float, device=self.soft_label_ids.device)
+        diagonal_label_ids[:, self.none_idx] = 1
+        diagonal_label_ids[self.soft_span_ids] = self.soft_label_ids
+        return diagonal_label_ids
+        
+        
+    def _diagonal2dense(self, diagonal_x: torch.Tensor, fill_value):
+        # diagonal_x: (\sum_k seq_len-k+1, ) or (\sum_k seq_len-k+1, logit_dim)
+        span_starts, span_ends = _diagonal_span_boundaries(self.num_tokens, self.max_span_size, device=diagonal_x.device)
+        # x: (seq_len, seq_len) or (seq_len, seq_len, logit_dim)
+        x = torch.empty(self.num_tokens, self.num_tokens, *diagonal_x.size()[1:], dtype=diagonal_x.dtype, device=diagonal_x.device)
+        x[:] = fill_value
+        x[span_starts, span_ends-1] = diagonal_x
+        return x
         
         
     def __getattr__(self, name):
-        if name.startswith('diagonal_'):
-            # x: (seq_len, seq_len)
-            x = getattr(self, name.replace('diagonal_', ''))
-            # diagonal_x: (\sum_k seq_len-k+1, )
-            diagonal_x = torch.cat([x.diagonal(offset=k-1) for k in range(1, self.max_span_size+1)], dim=-1)
-            if diagonal_x.dim() == 2:
-                # diagonal_x: (\sum_k seq_len-k+1, logit_dim)
-                diagonal_x = diagonal_x.permute(1, 0)
-            return diagonal_x
+        # Note: `__getattr__` is invoked only if the attribute is not found in the usual ways
+        if name == 'diagonal_label_ids' and 'soft_span_ids' in self.__dict__:
+            return self._expand_soft_label_ids()
+        
+        elif name in ('label_ids', 'non_mask', 'nest_non_mask'):
+            # The dense versions, re-constructed on access (for compatibility and inspection)
+            diagonal_x = getattr(self, f'diagonal_{name}')
+            if name != 'label_ids':
+                fill_value = False
+            elif diagonal_x.dim() == 1:
+                fill_value = self.none_idx
+            else:
+                fill_value = torch.nn.functional.one_hot(torch.tensor(self.none_idx), num_classes=diagonal_x.size(-1)).to(diagonal_x)
+            return self._diagonal2dense(diagonal_x, fill_value)
+        
         else:
             raise AttributeError(f"{self.__class__.__name__} has no attribute {name}")
 
@@ -255,24 +356,85 @@ class DiagBoundariesPairs(TargetWrapper):
             self.span2ck_label = {(start, end): label for label, start, end in self.chunks}
         
         
+    @property
+    def num_spans(self):
+        return (self.num_tokens*2 - (self.max_span_size-1)) * self.max_span_size // 2
+        
+        
     def build(self, config: Union[SingleDecoderConfigBase, DecoderBase]):
-        num_spans = (self.num_tokens*2 - (self.max_span_size-1)) * self.max_span_size // 2
+        """Build the sparse (COO-style) targets, i.e., only the positive pairs of diagonal span indexes (and the 
+        sampled negative pairs, if any) are stored, instead of the dense (num_spans, num_spans) tensors. 
+        """
+        num_spans = self.num_spans
         
-        if self.training and config.neg_sampling_rate < 1:
-            non_mask_rate = config.neg_sampling_rate * torch.ones(num_spans, num_spans, dtype=torch.float)
-            for label, (_, h_start, h_end), (_, t_start, t_end) in self.relations:
-                if h_end - h_start <= self.max_span_size and t_end - t_start <= self.max_span_size:
-                    hk = _span2diagonal(h_start, h_end, self.num_tokens)
-                    tk = _span2diagonal(t_start, t_end, self.num_tokens)
-                    non_mask_rate[hk, tk] = 1
-            
-            # Bernoulli sampling according probability in `non_mask_rate`
-            self.non_mask = non_mask_rate.bernoulli().bool() 
+        pair2label_id = {}
+        for label, (_, h_start, h_end), (_, t_start, t_end) in (self.relations if self.relations is not None else []):
+            if h_end - h_start <= self.max_span_size and t_end - t_start <= self.max_span_size:
+                hk = _span2diagonal(h_start, h_end, self.num_tokens)
+                tk = _span2diagonal(t_start, t_end, self.num_tokens)
+                pair2label_id[(hk, tk)] = config.label2idx[label]
         
         if self.relations is not None:
-            self.dbp2label_id = torch.full((num_spans, num_spans), config.none_idx, dtype=torch.long)
-            for label, (_, h_start, h_end), (_, t_start, t_end) in self.relations:
-                if h_end - h_start <= self.max_span_size and t_end - t_start <= self.max_span_size:
-                    hk = _span2diagonal(h_start, h_end, self.num_tokens)
-                    tk = _span2diagonal(t_start, t_end, self.num_tokens)
-                    self.dbp2label_id[hk, tk] = config.label2idx[label]
+            self.none_idx = config.none_idx
+            # pos_pair_ids: (num_pos_pairs, 2)
+            self.pos_pair_ids = torch.tensor(list(pair2label_id.keys()), dtype=torch.long).view(-1, 2)
+            self.pos_label_ids = torch.tensor(list(pair2label_id.values()), dtype=torch.long)
+        
+        if self.training and config.neg_sampling_rate < 1:
+            # Sample the negative pairs, which is equivalent to Bernoulli sampling on each pair 
+            # (except for the very rare duplicates), without enumerating all the pairs
+            # Both the number and the positions are drawn from the torch RNG
+            num_neg_pairs = torch.distributions.Binomial(total_count=torch.tensor(float(num_spans**2), dtype=torch.float64), 
+                                                         probs=torch.tensor(config.neg_sampling_rate, dtype=torch.float64)).sample()
+            neg_flat_ids = torch.randint(num_spans**2, size=(int(num_neg_pairs.item()), )).unique()
+            if len(pair2label_id) > 0:
+                # Exclude the positive pairs by binary search (`torch.isin` requires torch>=1.10)
+                pos_flat_ids = torch.tensor(sorted(hk*num_spans + tk for hk, tk in pair2label_id.keys()), dtype=torch.long)
+                pos_indexes = torch.searchsorted(pos_flat_ids, neg_flat_ids).clamp(max=pos_flat_ids.size(0)-1)
+                neg_flat_ids = neg_flat_ids[pos_flat_ids[pos_indexes] != neg_flat_ids]
+            # neg_pair_ids: (num_neg_pairs, 2)
+            self.neg_pair_ids = torch.stack([neg_flat_ids // num_spans, neg_flat_ids % num_spans], dim=-1)
+        
+        
+    @property
+    def sampled_pair_ids(self):
+        """The pairs (of diagonal span indexes) used in training with negative sampling. 
+        """
+        return torch.cat([self.pos_pair_ids, self.neg_pair_ids], dim=0)
+        
+    @property
+    def sampled_label_ids(self):
+        return torch.cat([self.pos_label_ids, torch.full_like(self.neg_pair_ids[:, 0], self.none_idx)], dim=0)
+        
+    def head_chunk_label_ids(self, head_start: int, head_end: int):
+        """The dense labels of the pairs with head spans in [`head_start`, `head_end`), i.e., the rows of 
+        `dbp2label_id`, which are built from the positive pairs without the full (num_spans, num_spans) tensor. 
+        
+        Returns
+        -------
+        label_ids: torch.LongTensor
+            (head_end - head_start, num_spans)
+        """
+        label_ids = torch.full((head_end-head_start, self.num_spans), self.none_idx, dtype=torch.long, device=self.pos_pair_ids.device)
+        is_within = (self.pos_pair_ids[:, 0] >= head_start) & (self.pos_pair_ids[:, 0] < head_end)
+        label_ids[self.pos_pair_ids[is_within, 0]-head_start, self.pos_pair_ids[is_within, 1]] = self.pos_label_ids[is_within]
+        return label_ids
+        
+        
+    def __getattr__(self, name):
+        # Note: `__getattr__` is invoked only if the attribute is not found in the usual ways
+        if name == 'dbp2label_id' and 'pos_pair_ids' in self.__dict__:
+            # The dense version, re-constructed on access
+            dbp2label_id = torch.full((self.num_spans, self.num_spans), self.none_idx, dtype=torch.long, device=self.pos_pair_ids.device)
+            dbp2label_id[self.pos_pair_ids[:, 0], self.pos_pair_ids[:, 1]] = self.pos_label_ids
+            return dbp2label_id
+        
+        elif name == 'non_mask' and 'neg_pair_ids' in self.__dict__:
+            # The dense version, re-constructed on access
+            sampled_pair_ids = self.sampled_pair_ids
+            non_mask = torch.zeros(self.num_spans, self.num_spans, dtype=torch.bool, device=sampled_pair_ids.device)
+            non_mask[sampled_pair_ids[:, 0], sampled_pair_ids[:, 1]] = True
+            return non_mask
+        
+        else:
+            raise AttributeError(f"{self.__class__.__name__} has no attribute {name}")
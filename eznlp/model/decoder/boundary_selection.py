@@ -13,10 +13,13 @@ from ...nn.init import reinit_embedding_, reinit_layer_
 from ...metrics import precision_recall_f1_report
 from ..encoder import EncoderConfig
 from .base import DecoderMixinBase, SingleDecoderConfigBase, DecoderBase
-from .boundaries import Boundaries, MAX_SIZE_ID_COV_RATE, _spans_from_upper_triangular
+from .boundaries import Boundaries, MAX_SIZE_ID_COV_RATE, _spans_from_diagonals, _diagonal_span_boundaries
 
 logger = logging.getLogger(__name__)
 
+# The maximum number of elements in the intermediate tensor of biaffine products for each chunk of spans
+SCORE_CHUNK_NUMEL = 2**24
+
 
 class BoundariesDecoderMixin(DecoderMixinBase):
     """The standard `Mixin` for span-based entity recognition. 
@@ -65,6 +68,8 @@ class BoundarySelectionDecoderConfig(SingleDecoderConfigBase, BoundariesDecoderM
         self.affine = kwargs.pop('affine', EncoderConfig(arch='FFN', hid_dim=150, num_layers=1, in_drop_rates=(0.4, 0.0, 0.0), hid_drop_rate=0.2))
         self.use_prod = kwargs.pop('use_prod', True)
         
+        # Only the spans not exceeding `max_span_size` are scored, in a banded manner; `None` for unlimited span size
+        self.max_span_size = kwargs.pop('max_span_size', None)
         self.max_len = kwargs.pop('max_len', None)
         self.size_emb_dim = kwargs.pop('size_emb_dim', 25)
         self.hid_drop_rates = kwargs.pop('hid_drop_rates', (0.2, 0.0, 0.0))
@@ -128,6 +133,12 @@ class BoundarySelectionDecoderConfig(SingleDecoderConfigBase, BoundariesDecoderM
         
         span_sizes = [end-start for data in partitions for entry in data for label, start, end in entry['chunks']]
         self.max_size_id = math.ceil(numpy.quantile(span_sizes, MAX_SIZE_ID_COV_RATE)) - 1
+        if self.max_span_size is not None:
+            self.max_size_id = min(self.max_size_id, self.max_span_size-1)
+            
+            num_oov_spans = sum(size > self.max_span_size for size in span_sizes)
+            if num_oov_spans > 0:
+                logger.warning(f"OOV positive spans: {num_oov_spans} ({num_oov_spans/len(span_sizes)*100:.2f}%)")
         
         self.max_len = max(len(data_entry['tokens']) for data in partitions for data_entry in data)
         
@@ -145,6 +156,7 @@ class BoundarySelectionDecoder(DecoderBase, BoundariesDecoderMixin):
         self.idx2label = config.idx2label
         self.overlapping_level = config.overlapping_level
         self.chunk_priority = config.chunk_priority
+        self.max_span_size = config.max_span_size
         
         if config.use_biaffine:
             self.affine_start = config.affine.instantiate()
@@ -184,13 +196,34 @@ class BoundarySelectionDecoder(DecoderBase, BoundariesDecoderMixin):
         return self._span_non_mask[:seq_len, :seq_len]
         
         
-    def compute_scores(self, batch: Batch, full_hidden: torch.Tensor):
+    def _affine(self, batch: Batch, full_hidden: torch.Tensor):
         if hasattr(self, 'affine_start'):
             affined_start = self.affine_start(full_hidden, batch.mask)
             affined_end = self.affine_end(full_hidden, batch.mask)
         else:
             affined_start = self.affine(full_hidden, batch.mask)
             affined_end = self.affine(full_hidden, batch.mask)
+        return affined_start, affined_end
+        
+        
+    def _split_W(self):
+        """Decompose `W` into the projections for start, end and size embedding, so that the concatenated 
+        (start, end, size) representations of spans are never materialized. 
+        """
+        size_emb_dim = self.size_embedding.embedding_dim if hasattr(self, 'size_embedding') else 0
+        affine_dim = (self.W.size(1) - size_emb_dim) // 2
+        return self.W.split([affine_dim, affine_dim, size_emb_dim], dim=-1)
+        
+        
+    def compute_scores(self, batch: Batch, full_hidden: torch.Tensor):
+        """Scores of all spans in the (start, end) format. 
+        
+        Returns
+        -------
+        scores: torch.Tensor
+            (batch, start_step, end_step, voc_dim)
+        """
+        affined_start, affined_end = self._affine(batch, full_hidden)
         
         if hasattr(self, 'U'):
             # affined_start: (batch, start_step, affine_dim) -> (batch, 1, start_step, affine_dim)
@@ -202,45 +235,103 @@ class BoundarySelectionDecoder(DecoderBase, BoundariesDecoderMixin):
         else:
             scores = 0
         
-        # affined_cat: (batch, start_step, end_step, affine_dim*2)
-        affined_cat = torch.cat([self.dropout(affined_start).unsqueeze(2).expand(-1, -1, affined_end.size(1), -1), 
-                                 self.dropout(affined_end).unsqueeze(1).expand(-1, affined_start.size(1), -1, -1)], dim=-1)
+        W_start, W_end, W_size = self._split_W()
+        # scores2: (batch, start_step, 1, voc_dim) + (batch, 1, end_step, voc_dim) -> (batch, start_step, end_step, voc_dim)
+        scores2 = self.dropout(affined_start).matmul(W_start.T).unsqueeze(2) + self.dropout(affined_end).matmul(W_end.T).unsqueeze(1)
         
         if hasattr(self, 'size_embedding'):
             # size_embedded: (start_step, end_step, emb_dim)
             size_embedded = self.size_embedding(self._get_span_size_ids(full_hidden.size(1)))
-            # affined_cat: (batch, start_step, end_step, affine_dim*2 + emb_dim)
-            affined_cat = torch.cat([affined_cat, self.dropout(size_embedded).unsqueeze(0).expand(full_hidden.size(0), -1, -1, -1)], dim=-1)
+            scores2 = scores2 + self.dropout(size_embedded).matmul(W_size.T)
         
-        # scores2: (voc_dim, affine_dim*2 + emb_dim) * (batch, start_step, end_step, affine_dim*2 + emb_dim, 1) -> (batch, start_step, end_step, voc_dim, 1)
-        scores2 = self.W.matmul(affined_cat.unsqueeze(-1))
         # scores: (batch, start_step, end_step, voc_dim)
-        scores = scores + scores2.squeeze(-1)
+        scores = scores + scores2
+        return scores + self.b
+        
+        
+    def compute_diagonal_scores(self, batch: Batch, full_hidden: torch.Tensor):
+        """Scores of spans in the diagonal format, i.e., only for spans not exceeding `max_span_size`. 
+        
+        The biaffine products are computed in chunks of spans, so that the memory is bounded by `SCORE_CHUNK_NUMEL` 
+        elements, instead of growing with (batch, step, step, affine_dim). 
+        
+        Returns
+        -------
+        scores: torch.Tensor
+            (batch, num_spans, voc_dim), with spans ordered as `_diagonal_span_boundaries(step, max_span_size)`. 
+        """
+        batch_size, seq_len, _ = full_hidden.size()
+        affined_start, affined_end = self._affine(batch, full_hidden)
+        span_starts, span_ends = _diagonal_span_boundaries(seq_len, self.max_span_size, device=full_hidden.device)
+        
+        W_start, W_end, W_size = self._split_W()
+        # scores: (batch, num_spans, voc_dim)
+        scores = self.dropout(affined_start).matmul(W_start.T)[:, span_starts] + self.dropout(affined_end).matmul(W_end.T)[:, span_ends-1]
+        
+        if hasattr(self, 'size_embedding'):
+            # size_embedded: (num_spans, emb_dim)
+            size_embedded = self.size_embedding(self._span_size_ids[span_starts, span_ends-1])
+            scores = scores + self.dropout(size_embedded).matmul(W_size.T)
+        
+        if hasattr(self, 'U'):
+            dropped_start, dropped_end = self.dropout(affined_start), self.dropout(affined_end)
+            chunk_size = max(SCORE_CHUNK_NUMEL // (batch_size * self.U.size(0) * self.U.size(1)), 1)
+            # scores1: (batch, num_spans, voc_dim)
+            scores1 = [torch.einsum('bnd,cde,bne->bnc', dropped_start[:, chunk_starts], self.U, dropped_end[:, chunk_ends-1]) 
+                           for chunk_starts, chunk_ends in zip(span_starts.split(chunk_size), span_ends.split(chunk_size))]
+            scores = scores + torch.cat(scores1, dim=1)
+        
         return scores + self.b
         
         
     def forward(self, batch: Batch, full_hidden: torch.Tensor):
-        batch_scores = self.compute_scores(batch, full_hidden)
+        batch_scores = self.compute_diagonal_scores(batch, full_hidden)
+        return self._losses_from_scores(batch, batch_scores, seq_len=full_hidden.size(1))
+        
+        
+    def _losses_from_scores(self, batch: Batch, batch_scores: torch.Tensor, seq_len: int):
+        _, span_ends = _diagonal_span_boundaries(seq_len, self.max_span_size, device=batch_scores.device)
         
         losses = []
         for curr_scores, boundaries_obj, curr_len in zip(batch_scores, batch.boundaries_objs, batch.seq_lens.cpu().tolist()):
-            curr_non_mask = getattr(boundaries_obj, 'non_mask', self._get_span_non_mask(curr_len))
+            # curr_scores: (num_spans = \sum_k curr_len-k+1, logit_dim)
+            curr_scores = curr_scores[span_ends <= curr_len]
+            
+            # label_ids: (num_spans = \sum_k curr_len-k+1, ) or (num_spans = \sum_k curr_len-k+1, logit_dim)
+            label_ids = boundaries_obj.diagonal_label_ids
+            if hasattr(boundaries_obj, 'diagonal_non_mask'):
+                non_mask = boundaries_obj.diagonal_non_mask
+                curr_scores, label_ids = curr_scores[non_mask], label_ids[non_mask]
             
-            loss = self.criterion(curr_scores[:curr_len, :curr_len][curr_non_mask], boundaries_obj.label_ids[curr_non_mask])
+            loss = self.criterion(curr_scores, label_ids)
             losses.append(loss)
         return torch.stack(losses)
         
         
     def decode(self, batch: Batch, full_hidden: torch.Tensor):
-        batch_scores = self.compute_scores(batch, full_hidden)
+        batch_scores = self._pop_cached_scores(batch, full_hidden)
+        if batch_scores is None:
+            batch_scores = self.compute_diagonal_scores(batch, full_hidden)
+        return self._decode_from_scores(batch, batch_scores, seq_len=full_hidden.size(1))
+        
+        
+    def forward_and_decode(self, batch: Batch, full_hidden: torch.Tensor):
+        batch_scores = self.compute_diagonal_scores(batch, full_hidden)
+        # Cache the scores for a following `decode` on the same batch
+        self._cache_scores(batch, full_hidden, batch_scores)
+        return self._losses_from_scores(batch, batch_scores, seq_len=full_hidden.size(1)), self._decode_from_scores(batch, batch_scores, seq_len=full_hidden.size(1))
+        
+        
+    def _decode_from_scores(self, batch: Batch, batch_scores: torch.Tensor, seq_len: int):
+        _, span_ends = _diagonal_span_boundaries(seq_len, self.max_span_size, device=batch_scores.device)
         
         batch_chunks = []
         for curr_scores, boundaries_obj, curr_len in zip(batch_scores, batch.boundaries_objs, batch.seq_lens.cpu().tolist()):
-            curr_non_mask = self._get_span_non_mask(curr_len)
-            
-            confidences, label_ids = curr_scores[:curr_len, :curr_len][curr_non_mask].softmax(dim=-1).max(dim=-1)
+            # Spans ordered as `_spans_from_diagonals`; the order of chunks with a same length (i.e., by start positions) 
+            # is consistent to `_spans_from_upper_triangular`
+            confidences, label_ids = curr_scores[span_ends <= curr_len].softmax(dim=-1).max(dim=-1)
             labels = [self.idx2label[i] for i in label_ids.cpu().tolist()]
-            chunks = [(label, start, end) for label, (start, end) in zip(labels, _spans_from_upper_triangular(curr_len)) if label != self.none_label]
+            chunks = [(label, start, end) for label, (start, end) in zip(labels, _spans_from_diagonals(curr_len, self.max_span_size)) if label != self.none_label]
             confidences = [conf for label, conf in zip(labels, confidences.cpu().tolist()) if label != self.none_label]
             assert len(confidences) == len(chunks)
             
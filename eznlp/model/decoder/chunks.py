@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from typing import List, Union
+from typing import List, Dict, Union
 import random
 import torch
 
@@ -46,7 +46,8 @@ class ChunkPairs(TargetWrapper):
         if self.chunks_pred is not None:
             # Do not use ```chunks = list(set(chunks_gold + chunks_pred))```, which may return non-deterministic order. 
             # In the early training stage, the chunk-decoder may produce too many predicted chunks, so do sampling here. 
-            chunks_extra = [ck for ck in self.chunks_pred if ck not in self.chunks_gold]
+            chunks_gold_set = set(self.chunks_gold)
+            chunks_extra = [ck for ck in self.chunks_pred if ck not in chunks_gold_set]
             num_neg_chunks = max(len(self.chunks_gold), int(self.num_tokens*0.2)-len(self.chunks_gold), 10)
             if len(chunks_extra) > num_neg_chunks:
                 chunks_extra = random.sample(chunks_extra, num_neg_chunks)
@@ -61,36 +62,55 @@ class ChunkPairs(TargetWrapper):
         
         
     def build(self, config: Union[SingleDecoderConfigBase, DecoderBase]):
-        num_chunks = len(self.chunks)
-        
-        self.span_size_ids = torch.tensor([end-start-1 for label, start, end in self.chunks], dtype=torch.long)
-        self.span_size_ids.masked_fill_(self.span_size_ids > config.max_size_id, config.max_size_id)
-        self.ck_label_ids = torch.tensor([config.ck_label2idx[label] for label, start, end in self.chunks], dtype=torch.long)
-        
-        if self.training and config.neg_sampling_rate < 1:
-            non_mask_rate = config.neg_sampling_rate * torch.ones(num_chunks, num_chunks, dtype=torch.float)
-            for label, head, tail in self.relations:
-                if head in self.chunk2idx and tail in self.chunk2idx:
-                    hk = self.chunk2idx[head]
-                    tk = self.chunk2idx[tail]
-                    non_mask_rate[hk, tk] = 1
-            
-            # Bernoulli sampling according probability in `non_mask_rate`
-            self.non_mask = non_mask_rate.bernoulli().bool() 
-        
-        if self.relations is not None:
-            self.cp2label_id = torch.full((num_chunks, num_chunks), config.none_idx, dtype=torch.long)
-            for label, head, tail in self.relations:
-                if head in self.chunk2idx and tail in self.chunk2idx:
-                    hk = self.chunk2idx[head]
-                    tk = self.chunk2idx[tail]
-                    self.cp2label_id[hk, tk] = config.label2idx[label]
+        ChunkPairs.build_batch([self], config)
+        
+        
+    @staticmethod
+    def build_batch(cp_objs: List['ChunkPairs'], config: Union[SingleDecoderConfigBase, DecoderBase], device: torch.device=None):
+        """Build the targets for a batch of `ChunkPairs` objects at once. 
+        
+        The chunks and relations are first converted to integer arrays, with chunk indexes looked up by hashing; 
+        the padded label and mask tensors are then constructed in one vectorized pass, transferred to `device` at once, 
+        and assigned to each object as views. 
+        """
+        num_chunks = [len(cp_obj.chunks) for cp_obj in cp_objs]
+        max_chunks = max(num_chunks, default=0)
+        targets = _build_chunk_arrays(cp_objs, config)
+        
+        # rel_array: (num_relations, 4), with columns of batch index, head index, tail index, label id
+        rel_array = []
+        for i, cp_obj in enumerate(cp_objs):
+            for label, head, tail in (cp_obj.relations or []):
+                if head in cp_obj.chunk2idx and tail in cp_obj.chunk2idx:
+                    rel_array.append((i, cp_obj.chunk2idx[head], cp_obj.chunk2idx[tail], config.label2idx[label]))
                 else:
                     # `head`/`tail` may not appear in `chunks` in case of:
                     # (1) in the evaluation phase where `chunks_gold` are not allowed to access. 
                     # In this case, `cp2label_id` is only for forwarding to a "fake" loss, but not for backwarding. 
                     # (2) `head`/`tail` is filtered out because of exceeding `max_span_size`.
-                    assert (not self.training) or (head[2]-head[1] > self.max_span_size) or (tail[2]-tail[1] > self.max_span_size)
+                    assert (not cp_obj.training) or (head[2]-head[1] > cp_obj.max_span_size) or (tail[2]-tail[1] > cp_obj.max_span_size)
+        rel_array = torch.tensor(rel_array, dtype=torch.long).view(-1, 4)
+        batch_ids, head_ids, tail_ids, label_ids = rel_array.T
+        
+        if any(cp_obj.training for cp_obj in cp_objs) and config.neg_sampling_rate < 1:
+            non_mask_rate = config.neg_sampling_rate * torch.ones(len(cp_objs), max_chunks, max_chunks, dtype=torch.float)
+            non_mask_rate[batch_ids, head_ids, tail_ids] = 1
+            # Bernoulli sampling according probability in `non_mask_rate`
+            targets['non_mask'] = non_mask_rate.bernoulli().bool()
+        
+        if any(cp_obj.relations is not None for cp_obj in cp_objs):
+            # cp2label_id: (batch, max_chunks, max_chunks)
+            targets['cp2label_id'] = torch.full((len(cp_objs), max_chunks, max_chunks), config.none_idx, dtype=torch.long)
+            targets['cp2label_id'][batch_ids, head_ids, tail_ids] = label_ids
+        
+        targets = _transfer_at_once(targets, device)
+        for i, (cp_obj, offset, n) in enumerate(zip(cp_objs, _cumsum_offsets(num_chunks), num_chunks)):
+            for name in ['span_starts', 'span_ends', 'span_size_ids', 'ck_label_ids']:
+                setattr(cp_obj, name, targets[name][offset:offset+n])
+            if cp_obj.training and 'non_mask' in targets:
+                cp_obj.non_mask = targets['non_mask'][i, :n, :n]
+            if cp_obj.relations is not None:
+                cp_obj.cp2label_id = targets['cp2label_id'][i, :n, :n]
 
 
 
@@ -133,7 +153,8 @@ class ChunkSingles(TargetWrapper):
         if self.chunks_pred is not None:
             # Do not use ```chunks = list(set(chunks_gold + chunks_pred))```, which may return non-deterministic order. 
             # In the early training stage, the chunk-decoder may produce too many predicted chunks, so do sampling here. 
-            chunks_extra = [ck for ck in self.chunks_pred if ck not in self.chunks_gold]
+            chunks_gold_set = set(self.chunks_gold)
+            chunks_extra = [ck for ck in self.chunks_pred if ck not in chunks_gold_set]
             num_neg_chunks = max(len(self.chunks_gold), int(self.num_tokens*0.2)-len(self.chunks_gold), 10)
             if len(chunks_extra) > num_neg_chunks:
                 chunks_extra = random.sample(chunks_extra, num_neg_chunks)
@@ -148,35 +169,81 @@ class ChunkSingles(TargetWrapper):
         
         
     def build(self, config: Union[SingleDecoderConfigBase, DecoderBase]):
-        num_chunks = len(self.chunks)
-        
-        self.span_size_ids = torch.tensor([end-start-1 for label, start, end in self.chunks], dtype=torch.long)
-        self.span_size_ids.masked_fill_(self.span_size_ids > config.max_size_id, config.max_size_id)
-        self.ck_label_ids = torch.tensor([config.ck_label2idx[label] for label, start, end in self.chunks], dtype=torch.long)
-        
-        if self.training and config.neg_sampling_rate < 1:
-            non_mask_rate = config.neg_sampling_rate * torch.ones(num_chunks, dtype=torch.float)
-            for label, chunk in self.attributes:
-                if chunk in self.chunk2idx:
-                    k = self.chunk2idx[chunk]
-                    non_mask_rate[k] = 1
-            
+        ChunkSingles.build_batch([self], config)
+        
+        
+    @staticmethod
+    def build_batch(cs_objs: List['ChunkSingles'], config: Union[SingleDecoderConfigBase, DecoderBase], device: torch.device=None):
+        """Build the targets for a batch of `ChunkSingles` objects at once. 
+        
+        See `ChunkPairs.build_batch`. 
+        """
+        num_chunks = [len(cs_obj.chunks) for cs_obj in cs_objs]
+        max_chunks = max(num_chunks, default=0)
+        targets = _build_chunk_arrays(cs_objs, config)
+        del targets['span_starts'], targets['span_ends']
+        
+        # attr_array: (num_attributes, 3), with columns of batch index, chunk index, label id
+        attr_array = []
+        for i, cs_obj in enumerate(cs_objs):
+            for label, chunk in (cs_obj.attributes or []):
+                if chunk in cs_obj.chunk2idx:
+                    attr_array.append((i, cs_obj.chunk2idx[chunk], config.label2idx[label]))
+                else:
+                    # `chunk` may not appear in `chunks` in case of:
+                    # (1) in the evaluation phase where `chunks_gold` are not allowed to access. 
+                    # In this case, `cs2label_id` is only for forwarding to a "fake" loss, but not for backwarding. 
+                    # (2) `chunk` is filtered out because of exceeding `max_span_size`.
+                    assert (not cs_obj.training) or (chunk[2]-chunk[1] > cs_obj.max_span_size)
+        attr_array = torch.tensor(attr_array, dtype=torch.long).view(-1, 3)
+        batch_ids, chunk_ids, label_ids = attr_array.T
+        
+        if any(cs_obj.training for cs_obj in cs_objs) and config.neg_sampling_rate < 1:
+            non_mask_rate = config.neg_sampling_rate * torch.ones(len(cs_objs), max_chunks, dtype=torch.float)
+            non_mask_rate[batch_ids, chunk_ids] = 1
             # Bernoulli sampling according probability in `non_mask_rate`
-            self.non_mask = non_mask_rate.bernoulli().bool() 
+            targets['non_mask'] = non_mask_rate.bernoulli().bool()
         
-        if self.attributes is not None:
+        if any(cs_obj.attributes is not None for cs_obj in cs_objs):
             # `torch.nn.BCEWithLogitsLoss` uses float tensor as target
-            self.cs2label_id = torch.zeros(num_chunks, config.voc_dim, dtype=torch.float)
-            for label, chunk in self.attributes:
-                if chunk in self.chunk2idx:
-                    k = self.chunk2idx[chunk]
-                    self.cs2label_id[k, config.label2idx[label]] = 1
-                else:
-                    # `head`/`tail` may not appear in `chunks` in case of:
-                    # (1) in the evaluation phase where `chunks_gold` are not allowed to access. 
-                    # In this case, `cp2label_id` is only for forwarding to a "fake" loss, but not for backwarding. 
-                    # (2) `head`/`tail` is filtered out because of exceeding `max_span_size`.
-                    assert (not self.training) or (chunk[2]-chunk[1] > self.max_span_size)
-            
+            # cs2label_id: (batch, max_chunks, voc_dim)
+            cs2label_id = torch.zeros(len(cs_objs), max_chunks, config.voc_dim, dtype=torch.float)
+            cs2label_id[batch_ids, chunk_ids, label_ids] = 1
             # Assign `<none>` label
-            self.cs2label_id[:, config.none_idx] = (self.cs2label_id == 0).all(dim=1)
+            cs2label_id[:, :, config.none_idx] = (cs2label_id == 0).all(dim=-1)
+            targets['cs2label_id'] = cs2label_id
+        
+        targets = _transfer_at_once(targets, device)
+        for i, (cs_obj, offset, n) in enumerate(zip(cs_objs, _cumsum_offsets(num_chunks), num_chunks)):
+            for name in ['span_size_ids', 'ck_label_ids']:
+                setattr(cs_obj, name, targets[name][offset:offset+n])
+            if cs_obj.training and 'non_mask' in targets:
+                cs_obj.non_mask = targets['non_mask'][i, :n]
+            if cs_obj.attributes is not None:
+                cs_obj.cs2label_id = targets['cs2label_id'][i, :n]
+
+
+
+def _build_chunk_arrays(objs: list, config: Union[SingleDecoderConfigBase, DecoderBase]):
+    # chunk_array: (num_chunks, 3), with columns of label id, start, end
+    chunk_array = torch.tensor([(config.ck_label2idx[label], start, end) for obj in objs for label, start, end in obj.chunks], dtype=torch.long).view(-1, 3)
+    ck_label_ids, span_starts, span_ends = chunk_array.T.contiguous()
+    span_size_ids = (span_ends - span_starts - 1).clamp(max=config.max_size_id)
+    return {'span_starts': span_starts, 'span_ends': span_ends, 'span_size_ids': span_size_ids, 'ck_label_ids': ck_label_ids}
+
+
+def _cumsum_offsets(nums: List[int]):
+    offsets = [0]
+    for n in nums[:-1]:
+        offsets.append(offsets[-1] + n)
+    return offsets
+
+
+def _transfer_at_once(tensors: Dict[str, torch.Tensor], device: torch.device=None):
+    """Transfer integer-valued tensors to `device` by a single copy, restoring their shapes and dtypes. 
+    """
+    if device is None:
+        return tensors
+    flat = torch.cat([x.flatten().long() for x in tensors.values()]).to(device)
+    flat_splits = flat.split([x.numel() for x in tensors.values()])
+    return {name: x_flat.view(x.size()).to(x.dtype) for (name, x), x_flat in zip(tensors.items(), flat_splits)}
@@ -86,6 +86,8 @@ class GeneratorConfig(SingleDecoderConfigBase, GeneratorMixin):
             self.num_layers = kwargs.pop('num_layers', 3)
             self.num_heads = kwargs.pop('num_heads', 8)
             self.scoring = kwargs.pop('scoring', 'scaled_dot')
+            # Attention implementation: `naive`, `sdpa` or `chunked`
+            self.atten_backend = kwargs.pop('atten_backend', 'naive')
             self.in_drop_rates = kwargs.pop('in_drop_rates', (0.1, 0.0, 0.0))
             self.hid_drop_rate = kwargs.pop('hid_drop_rate', 0.1)
             self.shortcut = kwargs.pop('shortcut', False)
@@ -97,6 +99,8 @@ class GeneratorConfig(SingleDecoderConfigBase, GeneratorMixin):
         self.weight_tying = kwargs.pop('weight_tying', False)
         self.weight_tying_scale = kwargs.pop('weight_tying_scale', 1.0)  # self.emb_dim**-0.5
         self.teacher_forcing_rate = kwargs.pop('teacher_forcing_rate', 0.5)
+        # Length normalization in beam search; 0 means no normalization
+        self.length_penalty = kwargs.pop('length_penalty', 0.0)
         super().__init__(**kwargs)
         
     @property
@@ -147,6 +151,7 @@ class Generator(DecoderBase, GeneratorMixin):
         super().__init__()
         self.vocab = config.vocab
         self.teacher_forcing_rate = config.teacher_forcing_rate
+        self.length_penalty = config.length_penalty
         self.shortcut = config.shortcut
         
         self.dropout = CombinedDropout(*config.in_drop_rates)
@@ -262,88 +267,110 @@ class Generator(DecoderBase, GeneratorMixin):
         return batch_toks
         
         
-    def _expand_states(self, batch_size:int, **states):
-        raise NotImplementedError("Not Implemented `_expand_states`")
-        
     def _select_states(self, batch_indexing: torch.Tensor, **states):
+        """Select (and reorder) the decoder states along the batch dimension. 
+        
+        Parameters
+        ----------
+        batch_indexing: torch.Tensor
+            A boolean mask of (batch, ), or indexes of (new_batch, ). 
+        """
         raise NotImplementedError("Not Implemented `_select_states`")
         
-    def beam_search(self, beam_size:int, batch: Batch, src_hidden: torch.Tensor, src_mask: torch.Tensor=None):
-        batch_best_trg_toks = []
+    def beam_search(self, beam_size: int, batch: Batch, src_hidden: torch.Tensor, src_mask: torch.Tensor=None):
+        """Beam search, batched over source sequences. 
+        
+        The (batch, beam) hypotheses are flattened as (batch*beam, ) and decoded in parallel; the decoder states 
+        are reordered by `_select_states` at each step. Once a hypothesis ends with `<eos>`, it is removed from 
+        the beam, i.e., the beam shrinks; once all hypotheses of a source end, this source stops being decoded. 
+        
+        The ended hypotheses are ranked by `log_score / length**length_penalty`. 
+        """
+        batch_size, voc_dim = src_hidden.size(0), self.voc_dim
+        device = src_hidden.device
         
-        for k in range(src_hidden.size(0)):
-            # The `k`-th source states
-            curr_src_hidden = src_hidden[k].unsqueeze(0)
-            curr_src_mask = None if src_mask is None else src_mask[k].unsqueeze(0)
+        states_0 = self._init_states(src_hidden, src_mask=src_mask)
+        
+        # The `k`-th source is expanded to rows of `k*beam_size, ..., (k+1)*beam_size-1`
+        row_indexes = torch.arange(batch_size, device=device).repeat_interleave(beam_size)
+        src_hidden = src_hidden[row_indexes]
+        src_mask = None if src_mask is None else src_mask[row_indexes]
+        states_utm1 = self._select_states(row_indexes, **states_0)
+        
+        # x_t: (batch*beam, step=1)
+        x_t = batch.trg_tok_ids[row_indexes, 0].unsqueeze(1)
+        # trg_tok_ids: (batch*beam, step=t-1)
+        trg_tok_ids = torch.empty(x_t.size(0), 0, dtype=torch.long, device=device)
+        # log_scores: (batch, beam); only the first hypothesis is alive at the beginning
+        log_scores = torch.full((batch_size, beam_size), -float('inf'), device=device)
+        log_scores[:, 0] = 0
+        # num_alive: (batch, ); the number of alive hypotheses (i.e., the current beam size) of each source
+        num_alive = torch.full((batch_size, ), beam_size, dtype=torch.long, device=device)
+        rank = torch.arange(beam_size, device=device)
+        
+        # The indexes of sources being decoded
+        src_indexes = list(range(batch_size))
+        ended_hyps = [[] for _ in range(batch_size)]
+        
+        for t in range(1, batch.trg_tok_ids.size(1)):
+            # t: 1, 2, ..., T-1
+            # logits_t: (batch*beam, step=1, voc_dim)
+            logits_t, states_ut, _ = self.forward_step(x_t, t, src_hidden=src_hidden, src_mask=src_mask, **states_utm1)
             
-            states_0 = self._init_states(curr_src_hidden, src_mask=curr_src_mask)
-            # x_t: (batch=1, step=1)
-            x_t = batch.trg_tok_ids[k, 0].view(1, 1)
-            states_utm1 = states_0
+            # cand_log_scores: (batch, beam*voc_dim)
+            cand_log_scores = (log_scores.unsqueeze(-1) + logits_t.squeeze(1).log_softmax(dim=-1).view(-1, beam_size, voc_dim)).flatten(start_dim=1)
+            # log_scores/topk_indexes: (batch, beam)
+            log_scores, topk_indexes = cand_log_scores.topk(beam_size, dim=-1)
+            prev_indexes, x_t = (topk_indexes // voc_dim), (topk_indexes % voc_dim)
             
-            beam_trg_toks = [[]]
-            ended_beam_trg_toks, ended_log_scores = [], []
+            # Reorder the hypotheses and states
+            # prev_rows: (batch*beam, )
+            prev_rows = (torch.arange(log_scores.size(0), device=device).unsqueeze(1)*beam_size + prev_indexes).flatten()
+            trg_tok_ids = torch.cat([trg_tok_ids[prev_rows], x_t.view(-1, 1)], dim=1)
+            states_ut = self._select_states(prev_rows, **states_ut)
             
-            for t in range(1, batch.trg_tok_ids.size(1)):
-                # t: 1, 2, ..., T-1
-                # logits_t: (batch=1, step=1, voc_dim)
-                logits_t, states_ut, _ = self.forward_step(x_t, t, 
-                                                           src_hidden=curr_src_hidden.expand(x_t.size(0), -1, -1), 
-                                                           src_mask=None if src_mask is None else curr_src_mask.expand(x_t.size(0), -1), 
-                                                           **states_utm1)
-                
-                if t == 1:
-                    # log_scores: (batch=1, step=1, voc_dim)
-                    log_scores = logits_t.log_softmax(dim=-1)
-                    # log_scores/topk_indexes: (batch=beam, step=1)
-                    log_scores, topk_indexes = log_scores.permute(0, 2, 1).flatten(end_dim=1).topk(beam_size, dim=0)
-                    
-                    states_ut = self._expand_states(beam_size, **states_ut)
-                else:
-                    # log_scores: (batch=beam, step=1, voc_dim)
-                    log_scores = log_scores.unsqueeze(-1) + logits_t.log_softmax(dim=-1)
-                    # log_scores/topk_indexes: (batch=beam, step=1)
-                    log_scores, topk_indexes = log_scores.permute(0, 2, 1).flatten(end_dim=1).topk(x_t.size(0), dim=0)
-                
-                # Treat it as having a batch size of `beam_size`
-                # prev_indexes/x_t: (batch=beam, step=1)
-                prev_indexes, x_t = (topk_indexes // self.voc_dim), (topk_indexes % self.voc_dim)
-                
-                beam_trg_toks = [beam_trg_toks[prev_idx] + [self.vocab.itos[tok_id]] 
-                                    for prev_idx, tok_id 
-                                    in zip(prev_indexes.flatten().cpu().tolist(), x_t.flatten().cpu().tolist())]
-                
-                # is_end: (batch=beam, )
-                is_end = (x_t.flatten() == self.eos_idx)
-                
-                if is_end.any().item():
+            # The beam of each source shrinks with its ended hypotheses
+            is_alive = rank < num_alive.unsqueeze(1)
+            is_end = is_alive & (x_t == self.eos_idx)
+            log_scores = log_scores.masked_fill(~is_alive, -float('inf'))
+            
+            if is_end.any().item():
+                for i, k in is_end.nonzero().cpu().tolist():
                     # Remove `<eos>`
-                    ended_beam_trg_toks.extend([trg_toks[:-1] for trg_toks, ise in zip(beam_trg_toks, is_end.cpu().tolist()) if ise])
-                    ended_log_scores.extend(log_scores[is_end].flatten().cpu().tolist())
-                    
-                    if len(ended_beam_trg_toks) == beam_size:
-                        break
-                    
-                    beam_trg_toks = [trg_toks for trg_toks, ise in zip(beam_trg_toks, is_end.cpu().tolist()) if not ise]
-                    x_t = x_t[~is_end]
-                    states_ut = self._select_states(~is_end, **states_ut)
-                    log_scores = log_scores[~is_end]
+                    ended_hyps[src_indexes[i]].append((log_scores[i, k].item(), t, trg_tok_ids[i*beam_size+k, :-1].cpu().tolist()))
+                log_scores = log_scores.masked_fill(is_end, -float('inf'))
+                num_alive = num_alive - is_end.sum(dim=-1)
                 
-                states_utm1 = states_ut
+                # Stop decoding the sources of which all hypotheses are ended
+                is_done = (num_alive == 0)
+                if is_done.all().item():
+                    break
+                elif is_done.any().item():
+                    src_indexes = [k for k, isd in zip(src_indexes, is_done.cpu().tolist()) if not isd]
+                    log_scores, num_alive, x_t = log_scores[~is_done], num_alive[~is_done], x_t[~is_done]
+                    row_indexing = (~is_done).repeat_interleave(beam_size)
+                    trg_tok_ids, src_hidden = trg_tok_ids[row_indexing], src_hidden[row_indexing]
+                    src_mask = None if src_mask is None else src_mask[row_indexing]
+                    states_ut = self._select_states(row_indexing, **states_ut)
             
-            # Use *ended* sequences only, unless all sequences are not *ended*
-            if len(ended_beam_trg_toks) == 0:
-                ended_beam_trg_toks = beam_trg_toks
-                ended_log_scores = log_scores.flatten().cpu().tolist()
-            
-            max_log_score, best_trg_toks = max(zip(ended_log_scores, ended_beam_trg_toks))
-            batch_best_trg_toks.append(best_trg_toks)
+            x_t = x_t.view(-1, 1)
+            states_utm1 = states_ut
         
+        # Use *ended* sequences only, unless all sequences are not *ended*
+        for i, k in enumerate(src_indexes):
+            if len(ended_hyps[k]) == 0:
+                ended_hyps[k] = [(log_score, t, tok_ids) for log_score, tok_ids, isa 
+                                     in zip(log_scores[i].cpu().tolist(), trg_tok_ids[i*beam_size:(i+1)*beam_size].cpu().tolist(), (rank < num_alive[i]).cpu().tolist()) if isa]
+        
+        batch_best_trg_toks = []
+        for hyps in ended_hyps:
+            # Length normalization, where the length includes `<eos>` if any
+            max_log_score, best_tok_ids = max((log_score / length**self.length_penalty, tok_ids) for log_score, length, tok_ids in hyps)
+            batch_best_trg_toks.append([self.vocab.itos[tok_id] for tok_id in best_tok_ids])
         return batch_best_trg_toks
 
 
 
-
 class RNNGenerator(Generator):
     def __init__(self, config: GeneratorConfig):
         super().__init__(config)
@@ -400,14 +427,6 @@ class RNNGenerator(Generator):
             # h_t: (num_layers, batch, hid_dim) -> (batch, step=1, hid_dim)
             return h_t[-1].unsqueeze(1)
         
-    def _expand_states(self, batch_size: int, h_tm1: torch.Tensor):
-        if isinstance(self.rnn, torch.nn.LSTM):
-            h_tm1 = (h_tm1[0].expand(-1, batch_size, -1).contiguous(), 
-                     h_tm1[1].expand(-1, batch_size, -1).contiguous())
-        else:
-            h_tm1 = h_tm1.expand(-1, batch_size, -1).contiguous()
-        return {'h_tm1': h_tm1}
-        
     def _select_states(self, batch_indexing: torch.Tensor, h_tm1: torch.Tensor):
         if isinstance(self.rnn, torch.nn.LSTM):
             h_tm1 = (h_tm1[0][:, batch_indexing].contiguous(), 
@@ -483,9 +502,6 @@ class GehringConvGenerator(Generator):
     def _init_states(self, src_hidden: torch.Tensor, src_mask: torch.Tensor=None):
         return {'hidden_stack_utm1': [self._pre_padding.expand(src_hidden.size(0), -1, -1) for _ in self.conv_blocks]}
         
-    def _expand_states(self, batch_size: int, hidden_stack_utm1: List[torch.Tensor]):
-        return {'hidden_stack_utm1': [hidden_utm1.expand(batch_size, -1, -1) for hidden_utm1 in hidden_stack_utm1]}
-        
     def _select_states(self, batch_indexing: torch.Tensor, hidden_stack_utm1: List[torch.Tensor]):
         return {'hidden_stack_utm1': [hidden_utm1[batch_indexing] for hidden_utm1 in hidden_stack_utm1]}
         
@@ -595,23 +611,19 @@ class TransformerGenerator(Generator):
                                      ctx_dim=config.ctx_dim, 
                                      num_heads=config.num_heads, 
                                      drop_rate=(0.0 if (k==0 and not config.use_emb2init_hid) else config.hid_drop_rate), 
-                                     nonlinearity='relu') for k in range(config.num_layers)]
+                                     nonlinearity='relu', 
+                                     atten_backend=getattr(config, 'atten_backend', 'naive')) for k in range(config.num_layers)]
         )
-        # Actually no pre-padding is needed
-        # This is a placeholder for `_init_states`, and thus for consistent/easier implementation of `forward_step`
-        self.register_buffer('_pre_padding', torch.zeros(0, config.hid_dim))
         
         
     def _init_states(self, src_hidden: torch.Tensor, src_mask: torch.Tensor=None):
-        return {'hidden_stack_utm1': [self._pre_padding.expand(src_hidden.size(0), -1, -1) for _ in self.tf_blocks]}
+        # Incremental decoding with the key/value cache of each layer
+        return {'cache_stack_utm1': [tf_block.init_cache(src_hidden) for tf_block in self.tf_blocks]}
         
-    def _expand_states(self, batch_size: int, hidden_stack_utm1: List[torch.Tensor]):
-        return {'hidden_stack_utm1': [hidden_utm1.expand(batch_size, -1, -1) for hidden_utm1 in hidden_stack_utm1]}
+    def _select_states(self, batch_indexing: torch.Tensor, cache_stack_utm1: List[dict]):
+        return {'cache_stack_utm1': [{key: value[batch_indexing] for key, value in cache_utm1.items()} for cache_utm1 in cache_stack_utm1]}
         
-    def _select_states(self, batch_indexing: torch.Tensor, hidden_stack_utm1: List[torch.Tensor]):
-        return {'hidden_stack_utm1': [hidden_utm1[batch_indexing] for hidden_utm1 in hidden_stack_utm1]}
-        
-    def forward_step(self, x_t: torch.Tensor, t: int, src_hidden: torch.Tensor, src_mask: torch.Tensor=None, hidden_stack_utm1: List[torch.Tensor]=None):
+    def forward_step(self, x_t: torch.Tensor, t: int, src_hidden: torch.Tensor, src_mask: torch.Tensor=None, cache_stack_utm1: List[dict]=None):
         # x_t: (batch, step=1)
         # embedded_t: (batch, step=1, emb_dim)
         embedded_t = self.dropout(self.embedding(x_t, start_position_id=t-1))
@@ -621,12 +633,15 @@ class TransformerGenerator(Generator):
         else:
             hidden_t = embedded_t
         
-        hidden_stack_ut = []
-        for tf_block, hidden_utm1 in zip(self.tf_blocks, hidden_stack_utm1):
-            hidden_ut = torch.cat([hidden_utm1, hidden_t], dim=1)
-            hidden_stack_ut.append(hidden_ut)
-            
-            hidden_t, atten_weight_t, cross_atten_weight_t = tf_block(hidden_ut, src_hidden, src_mask=src_mask, last_step=True, return_atten_weight=True)
+        # Note: `src_hidden` has been projected as keys/values in the cache
+        cache_stack_ut = []
+        for k, (tf_block, cache_utm1) in enumerate(zip(self.tf_blocks, cache_stack_utm1)):
+            # Only the attention weight on the top layer is returned
+            if k == len(self.tf_blocks) - 1:
+                hidden_t, cache_ut, atten_weight_t, cross_atten_weight_t = tf_block.forward_step(hidden_t, cache_utm1, src_mask=src_mask, return_atten_weight=True)
+            else:
+                hidden_t, cache_ut = tf_block.forward_step(hidden_t, cache_utm1, src_mask=src_mask)
+            cache_stack_ut.append(cache_ut)
         
         # hidden_t: (batch, step=1, hid_dim)
         if self.shortcut:
@@ -634,7 +649,7 @@ class TransformerGenerator(Generator):
         
         # logits_t: (batch, step=1, voc_dim)
         logits_t = self._forward_hid2logit(hidden_t)
-        return logits_t, {'hidden_stack_utm1': hidden_stack_ut}, cross_atten_weight_t
+        return logits_t, {'cache_stack_utm1': cache_stack_ut}, cross_atten_weight_t
         
         
     def forward2logits_all_at_once(self, batch: Batch, src_hidden: torch.Tensor, src_mask: torch.Tensor=None, return_atten_weight: bool=False):
@@ -646,8 +661,11 @@ class TransformerGenerator(Generator):
         else:
             hidden = embedded
         
-        for tf_block in self.tf_blocks:
-            hidden, atten_weight, cross_atten_weight = tf_block(hidden, src_hidden, src_mask=src_mask, last_step=False, return_atten_weight=True)
+        for k, tf_block in enumerate(self.tf_blocks):
+            if return_atten_weight and k == len(self.tf_blocks) - 1:
+                hidden, atten_weight, cross_atten_weight = tf_block(hidden, src_hidden, src_mask=src_mask, last_step=False, return_atten_weight=True)
+            else:
+                hidden = tf_block(hidden, src_hidden, src_mask=src_mask, last_step=False)
         
         if self.shortcut:
             hidden = torch.cat([hidden, embedded], dim=-1)
@@ -151,8 +151,9 @@ class JointExtractionDecoder(DecoderBase, JointExtractionDecoderMixin):
         
         
     def forward(self, batch: Batch, **states):
-        losses = self.ck_decoder(batch, **states) * self.ck_loss_weight
-        batch_chunks_pred = self.ck_decoder.decode(batch, **states)
+        # Compute the chunk scores once for both the losses and the predicted chunks
+        losses, batch_chunks_pred = self.ck_decoder.forward_and_decode(batch, **states)
+        losses = losses * self.ck_loss_weight
         
         if self.has_attr_decoder:
             self.attr_decoder.assign_chunks_pred(batch, batch_chunks_pred)
@@ -87,6 +87,10 @@ class SequenceTaggingDecoderConfig(SingleDecoderConfigBase, SequenceTaggingDecod
         self.idx2tag = kwargs.pop('idx2tag', None)
         
         self.use_crf = kwargs.pop('use_crf', True)
+        # 'sequential' or 'scan'; the latter is preferable for long sequences
+        self.crf_partition_mode = kwargs.pop('crf_partition_mode', 'sequential')
+        # Mask the illegal transitions (according to `scheme`) in CRF decoding
+        self.constrained_decoding = kwargs.pop('constrained_decoding', False)
         super().__init__(**kwargs)
         
         
@@ -107,7 +111,7 @@ class SequenceTaggingDecoderConfig(SingleDecoderConfigBase, SequenceTaggingDecod
         
     def instantiate_criterion(self, **kwargs):
         if self.criterion.lower().startswith('crf'):
-            return CRF(tag_dim=self.voc_dim, pad_idx=self.pad_idx, batch_first=True)
+            return CRF(tag_dim=self.voc_dim, pad_idx=self.pad_idx, batch_first=True, partition_mode=self.crf_partition_mode)
         else:
             return super().instantiate_criterion(**kwargs)
         
@@ -137,6 +141,9 @@ class SequenceTaggingDecoder(DecoderBase, SequenceTaggingDecoderMixin):
         reinit_layer_(self.hid2logit, 'sigmoid')
         
         self.criterion = config.instantiate_criterion(ignore_index=config.pad_idx, reduction='sum')
+        if isinstance(self.criterion, CRF) and config.constrained_decoding:
+            sos_legal, legal, eos_legal = self.translator.build_transition_legality(self.idx2tag)
+            self.criterion.set_transition_constraints(torch.tensor(sos_legal), torch.tensor(legal), torch.tensor(eos_legal))
         
         
     def forward(self, batch: Batch, full_hidden: torch.Tensor):
@@ -157,7 +164,7 @@ class SequenceTaggingDecoder(DecoderBase, SequenceTaggingDecoderMixin):
         return losses
         
         
-    def decode_tags(self, batch: Batch, full_hidden: torch.Tensor):
+    def decode_tag_ids(self, batch: Batch, full_hidden: torch.Tensor):
         # logits: (batch, step, tag_dim)
         logits = self.hid2logit(full_hidden)
         
@@ -169,9 +176,14 @@ class SequenceTaggingDecoder(DecoderBase, SequenceTaggingDecoderMixin):
             best_paths = logits.argmax(dim=-1)
             batch_tag_ids = unpad_seqs(best_paths, batch.seq_lens)
         
+        return batch_tag_ids
+        
+        
+    def decode_tags(self, batch: Batch, full_hidden: torch.Tensor):
+        batch_tag_ids = self.decode_tag_ids(batch, full_hidden)
         return [[self.idx2tag[i] for i in tag_ids] for tag_ids in batch_tag_ids]
         
         
     def decode(self, batch: Batch, full_hidden: torch.Tensor):
-        batch_tags = self.decode_tags(batch, full_hidden)
-        return [self.translator.tags2chunks(tags) for tags in batch_tags]
+        batch_tag_ids = self.decode_tag_ids(batch, full_hidden)
+        return [self.translator.tag_ids2chunks(tag_ids, self.idx2tag) for tag_ids in batch_tag_ids]
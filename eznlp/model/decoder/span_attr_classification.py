@@ -158,11 +158,15 @@ class SpanAttrClassificationDecoder(DecoderBase, ChunkSinglesDecoderMixin):
     def assign_chunks_pred(self, batch: Batch, batch_chunks_pred: List[List[tuple]]):
         """This method should be called on-the-fly for joint modeling. 
         """
+        cs_objs_to_build = []
         for cs_obj, chunks_pred in zip(batch.cs_objs, batch_chunks_pred):
             if cs_obj.chunks_pred is None:
                 cs_obj.chunks_pred = chunks_pred
-                cs_obj.build(self)
-                cs_obj.to(self.hid2logit.weight.device)
+                cs_objs_to_build.append(cs_obj)
+        
+        # Build the targets of the whole batch at once, with a single transfer to the device
+        if len(cs_objs_to_build) > 0:
+            ChunkSingles.build_batch(cs_objs_to_build, self, device=self.hid2logit.weight.device)
         
         
     def get_logits(self, batch: Batch, full_hidden: torch.Tensor):
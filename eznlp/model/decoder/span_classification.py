@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
+from typing import List
 from collections import Counter
+import itertools
 import logging
 import math
 import numpy
@@ -8,10 +10,9 @@ import torch
 from ...wrapper import Batch
 from ...utils.chunk import detect_overlapping_level, filter_clashed_by_priority
 from ...nn.modules import SequencePooling, SequenceAttention, CombinedDropout, SoftLabelCrossEntropyLoss, MultiKernelMaxMeanDiscrepancyLoss
-from ...nn.functional import seq_lens2mask
 from ...nn.init import reinit_embedding_, reinit_layer_
 from .base import SingleDecoderConfigBase, DecoderBase
-from .boundaries import Boundaries, MAX_SIZE_ID_COV_RATE, _spans_from_diagonals
+from .boundaries import Boundaries, MAX_SIZE_ID_COV_RATE, _spans_from_diagonals, _diagonal_span_index
 from .boundary_selection import BoundariesDecoderMixin
 
 logger = logging.getLogger(__name__)
@@ -149,31 +150,33 @@ class SpanClassificationDecoder(DecoderBase, BoundariesDecoderMixin):
         self.criterion = config.instantiate_criterion(reduction='sum')
         
         
-    def _get_diagonal_span_size_ids(self, seq_len: int):
-        span_size_ids = self._span_size_ids[:seq_len, :seq_len]
-        return torch.cat([span_size_ids.diagonal(offset=k-1) for k in range(1, min(self.max_span_size, seq_len)+1)], dim=-1)
-        
-        
     def get_logits(self, batch: Batch, full_hidden: torch.Tensor, return_states: bool=False):
         # full_hidden: (batch, step, hid_dim)
-        batch_logits, batch_states = [], []
-        for i, curr_len in enumerate(batch.seq_lens.cpu().tolist()):
-            # span_hidden: (num_spans, span_size, hid_dim) -> (num_spans, hid_dim)
-            span_hidden = [full_hidden[i, start:end] for start, end in _spans_from_diagonals(curr_len, self.max_span_size)]
-            span_mask = seq_lens2mask(torch.tensor([h.size(0) for h in span_hidden], dtype=torch.long, device=full_hidden.device))
-            span_hidden = torch.nn.utils.rnn.pad_sequence(span_hidden, batch_first=True, padding_value=0.0)
-            span_hidden = self.aggregating(self.dropout(span_hidden), mask=span_mask)
-            
-            if hasattr(self, 'size_embedding'):
-                # size_embedded: (num_spans, emb_dim)
-                size_embedded = self.size_embedding(self._get_diagonal_span_size_ids(curr_len))
-                span_hidden = torch.cat([span_hidden, self.dropout(size_embedded)], dim=-1)
-            
-            logits = self.hid2logit(span_hidden)
-            batch_logits.append(logits)
-            batch_states.append({'span_hidden': span_hidden})
+        batch_size, seq_len, hid_dim = full_hidden.size()
+        span_starts, span_sizes, span_token_ids, span_token_mask = _diagonal_span_index(seq_len, min(self.max_span_size, seq_len), device=full_hidden.device)
+        
+        # span_hidden: (batch, num_spans, span_size, hid_dim) -> (batch*num_spans, span_size, hid_dim)
+        span_hidden = full_hidden[:, span_token_ids].flatten(end_dim=1)
+        span_mask = span_token_mask.expand(batch_size, -1, -1).flatten(end_dim=1)
+        # span_hidden: (batch*num_spans, hid_dim) -> (batch, num_spans, hid_dim)
+        span_hidden = self.aggregating(self.dropout(span_hidden), mask=span_mask).view(batch_size, -1, hid_dim)
+        
+        if hasattr(self, 'size_embedding'):
+            # size_embedded: (num_spans, emb_dim) -> (batch, num_spans, emb_dim)
+            size_embedded = self.size_embedding(self._span_size_ids[0, span_sizes-1]).expand(batch_size, -1, -1)
+            span_hidden = torch.cat([span_hidden, self.dropout(size_embedded)], dim=-1)
+        
+        # logits: (batch, num_spans, logit_dim)
+        logits = self.hid2logit(span_hidden)
+        
+        # Retain the spans within each sequence, following the order of `_spans_from_diagonals`
+        # span_non_pad: (batch, num_spans)
+        span_non_pad = (span_starts + span_sizes <= batch.seq_lens.unsqueeze(-1))
+        num_spans = span_non_pad.sum(dim=-1).cpu().tolist()
+        batch_logits = list(logits[span_non_pad].split(num_spans))
         
         if return_states:
+            batch_states = [{'span_hidden': h} for h in span_hidden[span_non_pad].split(num_spans)]
             return batch_logits, batch_states
         else:
             return batch_logits
@@ -181,12 +184,15 @@ class SpanClassificationDecoder(DecoderBase, BoundariesDecoderMixin):
         
     def forward(self, batch: Batch, full_hidden: torch.Tensor):
         batch_logits, batch_states = self.get_logits(batch, full_hidden, return_states=True)
+        return self._losses_from_logits(batch, batch_logits, batch_states)
         
+        
+    def _losses_from_logits(self, batch: Batch, batch_logits: List[torch.Tensor], batch_states: List[dict]):
         losses = []
         for logits, boundaries_obj, curr_len in zip(batch_logits, batch.boundaries_objs, batch.seq_lens.cpu().tolist()):
             # label_ids: (num_spans = \sum_k curr_len-k+1, ) or (num_spans = \sum_k curr_len-k+1, logit_dim)
             label_ids = boundaries_obj.diagonal_label_ids
-            if hasattr(boundaries_obj, 'non_mask'):
+            if hasattr(boundaries_obj, 'diagonal_non_mask'):
                 non_mask = boundaries_obj.diagonal_non_mask
                 logits, label_ids = logits[non_mask], label_ids[non_mask]
             
@@ -205,14 +211,32 @@ class SpanClassificationDecoder(DecoderBase, BoundariesDecoderMixin):
         
         
     def decode(self, batch: Batch, full_hidden: torch.Tensor):
-        batch_logits = self.get_logits(batch, full_hidden)
+        batch_logits = self._pop_cached_scores(batch, full_hidden)
+        if batch_logits is None:
+            batch_logits = self.get_logits(batch, full_hidden)
+        return self._decode_from_logits(batch, batch_logits)
+        
+        
+    def forward_and_decode(self, batch: Batch, full_hidden: torch.Tensor):
+        batch_logits, batch_states = self.get_logits(batch, full_hidden, return_states=True)
+        # Cache the logits for a following `decode` on the same batch
+        self._cache_scores(batch, full_hidden, batch_logits)
+        return self._losses_from_logits(batch, batch_logits, batch_states), self._decode_from_logits(batch, batch_logits)
+        
+        
+    def _decode_from_logits(self, batch: Batch, batch_logits: List[torch.Tensor]):
+        num_spans = [logits.size(0) for logits in batch_logits]
+        
+        # Compute the predictions over all spans in the batch at once
+        all_confidences, all_label_ids = torch.cat(batch_logits, dim=0).softmax(dim=-1).max(dim=-1)
+        all_confidences, all_label_ids = all_confidences.cpu().tolist(), all_label_ids.cpu().tolist()
+        span_offsets = [0] + list(itertools.accumulate(num_spans))
         
         batch_chunks = []
-        for logits, boundaries_obj, curr_len in zip(batch_logits, batch.boundaries_objs, batch.seq_lens.cpu().tolist()):
-            confidences, label_ids = logits.softmax(dim=-1).max(dim=-1)
-            labels = [self.idx2label[i] for i in label_ids.cpu().tolist()]
+        for i, (boundaries_obj, curr_len) in enumerate(zip(batch.boundaries_objs, batch.seq_lens.cpu().tolist())):
+            labels = [self.idx2label[idx] for idx in all_label_ids[span_offsets[i]:span_offsets[i+1]]]
             chunks = [(label, start, end) for label, (start, end) in zip(labels, _spans_from_diagonals(curr_len, self.max_span_size)) if label != self.none_label]
-            confidences = [conf for label, conf in zip(labels, confidences.cpu().tolist()) if label != self.none_label]
+            confidences = [conf for label, conf in zip(labels, all_confidences[span_offsets[i]:span_offsets[i+1]]) if label != self.none_label]
             assert len(confidences) == len(chunks)
             
             if hasattr(boundaries_obj, 'sub2ori_idx'):
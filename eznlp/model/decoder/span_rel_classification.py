@@ -9,7 +9,7 @@ import torch
 
 from ...wrapper import Batch
 from ...nn.modules import SequencePooling, SequenceAttention, CombinedDropout
-from ...nn.functional import seq_lens2mask
+from ...nn.functional import range_pooling
 from ...nn.init import reinit_embedding_, reinit_layer_, reinit_vector_parameter_
 from ...metrics import precision_recall_f1_report
 from .base import DecoderMixinBase, SingleDecoderConfigBase, DecoderBase
@@ -84,6 +84,8 @@ class SpanRelClassificationDecoderConfig(SingleDecoderConfigBase, ChunkPairsDeco
         # self.neg_sampling_surr_size = kwargs.pop('neg_sampling_surr_size', 5)
         
         self.agg_mode = kwargs.pop('agg_mode', 'max_pooling')
+        # Chunk pairs with more than `max_pair_distance` tokens in between are not scored, and always predicted as `none_label`
+        self.max_pair_distance = kwargs.pop('max_pair_distance', None)
         
         self.none_label = kwargs.pop('none_label', '<none>')
         self.idx2label = kwargs.pop('idx2label', None)
@@ -135,6 +137,7 @@ class SpanRelClassificationDecoder(DecoderBase, ChunkPairsDecoderMixin):
         self.existing_rht_labels = config.existing_rht_labels
         self.filter_self_relation = config.filter_self_relation
         self.existing_self_relation = config.existing_self_relation
+        self.max_pair_distance = config.max_pair_distance
         
         if config.agg_mode.lower().endswith('_pooling'):
             self.aggregating = SequencePooling(mode=config.agg_mode.replace('_pooling', ''))
@@ -162,73 +165,127 @@ class SpanRelClassificationDecoder(DecoderBase, ChunkPairsDecoderMixin):
     def assign_chunks_pred(self, batch: Batch, batch_chunks_pred: List[List[tuple]]):
         """This method should be called on-the-fly for joint modeling. 
         """
+        cp_objs_to_build = []
         for cp_obj, chunks_pred in zip(batch.cp_objs, batch_chunks_pred):
             if cp_obj.chunks_pred is None:
                 cp_obj.chunks_pred = chunks_pred
-                cp_obj.build(self)
-                cp_obj.to(self.hid2logit.weight.device)
+                cp_objs_to_build.append(cp_obj)
         
+        # Build the targets of the whole batch at once, with a single transfer to the device
+        if len(cp_objs_to_build) > 0:
+            ChunkPairs.build_batch(cp_objs_to_build, self, device=self.hid2logit.weight.device)
         
-    def get_logits(self, batch: Batch, full_hidden: torch.Tensor):
+        
+    def _pool_ranges(self, full_hidden: torch.Tensor, batch_ids: torch.LongTensor, starts: torch.LongTensor, ends: torch.LongTensor):
+        """Aggregate `full_hidden` over the (non-empty) ranges [`starts`, `ends`) in sequences `batch_ids`. 
+        """
+        if isinstance(self.aggregating, SequencePooling) and self.aggregating.mode.lower() in ('mean', 'max', 'min'):
+            return range_pooling(self.dropout(full_hidden), batch_ids, starts, ends, mode=self.aggregating.mode)
+        else:
+            # range_hidden: (num_ranges, max_range_size, hid_dim)
+            range_sizes = ends - starts
+            offsets = torch.arange(range_sizes.max().item() if range_sizes.size(0) > 0 else 1, device=full_hidden.device)
+            range_step_ids = (starts.unsqueeze(-1) + offsets).clamp(max=full_hidden.size(1)-1)
+            range_mask = (offsets >= range_sizes.unsqueeze(-1))
+            return self.aggregating(self.dropout(full_hidden[batch_ids.unsqueeze(-1), range_step_ids]), mask=range_mask)
+        
+        
+    def get_logits(self, batch: Batch, full_hidden: torch.Tensor, return_states: bool=False):
+        """Logits of all chunk pairs, which are computed for the whole batch at once. 
+        
+        Returns
+        -------
+        batch_logits: List[torch.Tensor]
+            Each of (num_chunks, num_chunks, logit_dim)
+        batch_states: List[dict]
+            {'pair_non_mask': torch.BoolTensor (num_chunks, num_chunks)}, where `pair_non_mask` is False 
+            for the chunk pairs beyond `max_pair_distance`. 
+        """
         # full_hidden: (batch, step, hid_dim)
-        batch_logits = []
-        for i, cp_obj in enumerate(batch.cp_objs):
-            num_chunks = len(cp_obj.chunks)
-            if num_chunks == 0:
-                # Empty row produces loss of 0, when `criterion` uses `reduction='sum'`
-                logits = torch.empty(0, self.hid2logit.out_features, device=full_hidden.device)
+        device = full_hidden.device
+        num_chunks = [len(cp_obj.chunks) for cp_obj in batch.cp_objs]
+        ck_offsets = [0] + numpy.cumsum(num_chunks).tolist()
+        
+        if ck_offsets[-1] > 0:
+            # (num_all_chunks, ) for chunks in all sequences
+            ck_batch_ids = torch.arange(len(num_chunks), device=device).repeat_interleave(torch.tensor(num_chunks, device=device))
+            ck_starts = torch.cat([cp_obj.span_starts for cp_obj in batch.cp_objs])
+            ck_ends = torch.cat([cp_obj.span_ends for cp_obj in batch.cp_objs])
+            
+            # span_hidden: (num_all_chunks, hid_dim)
+            span_hidden = self._pool_ranges(full_hidden, ck_batch_ids, ck_starts, ck_ends)
+            
+            if hasattr(self, 'size_embedding'):
+                # size_embedded: (num_all_chunks, emb_dim)
+                size_embedded = self.size_embedding(torch.cat([cp_obj.span_size_ids for cp_obj in batch.cp_objs]))
+                span_hidden = torch.cat([span_hidden, self.dropout(size_embedded)], dim=-1)
+            
+            if hasattr(self, 'label_embedding'):
+                # label_embedded: (num_all_chunks, emb_dim)
+                label_embedded = self.label_embedding(torch.cat([cp_obj.ck_label_ids for cp_obj in batch.cp_objs]))
+                span_hidden = torch.cat([span_hidden, self.dropout(label_embedded)], dim=-1)
+            
+            # (num_all_pairs = \sum_i num_chunks_i^2, ), following the order of `itertools.product(chunks, chunks)`
+            heads = torch.cat([torch.arange(off, off+n, device=device).repeat_interleave(n) for off, n in zip(ck_offsets, num_chunks)])
+            tails = torch.cat([torch.arange(off, off+n, device=device).repeat(n) for off, n in zip(ck_offsets, num_chunks)])
+            
+            # The context between head and tail is [min(h_end, t_end), max(h_start, t_start)), if non-empty
+            ctx_starts = torch.minimum(ck_ends[heads], ck_ends[tails])
+            ctx_ends = torch.maximum(ck_starts[heads], ck_starts[tails])
+            ctx_non_empty = (ctx_starts < ctx_ends)
+            
+            if self.max_pair_distance is not None:
+                pair_non_mask = (ctx_ends - ctx_starts <= self.max_pair_distance)
+                heads, tails = heads[pair_non_mask], tails[pair_non_mask]
+                ctx_starts, ctx_ends, ctx_non_empty = ctx_starts[pair_non_mask], ctx_ends[pair_non_mask], ctx_non_empty[pair_non_mask]
+            
+            # contexts: (num_pairs, hid_dim)
+            contexts = self._pool_ranges(full_hidden, 
+                                         ck_batch_ids[heads], 
+                                         torch.where(ctx_non_empty, ctx_starts, torch.zeros_like(ctx_starts)), 
+                                         torch.where(ctx_non_empty, ctx_ends, torch.ones_like(ctx_ends)))
+            # Trainable context vector for overlapping/adjacent chunks
+            contexts = torch.where(ctx_non_empty.unsqueeze(-1), contexts, self.dropout(self.zero_context.unsqueeze(0)))
+            
+            # hidden_cat: (num_pairs, hid_dim*3)
+            hidden_cat = torch.cat([span_hidden[heads], span_hidden[tails], contexts], dim=-1)
+            # logits: (num_pairs, logit_dim)
+            logits = self.hid2logit(hidden_cat)
+            
+            if self.max_pair_distance is not None:
+                # The chunk pairs beyond `max_pair_distance` are predicted as `none_label`
+                full_logits = torch.full((pair_non_mask.size(0), logits.size(-1)), torch.finfo(logits.dtype).min, dtype=logits.dtype, device=device)
+                full_logits[:, self.none_idx] = 0
+                logits = full_logits.masked_scatter(pair_non_mask.unsqueeze(-1), logits)
+        else:
+            # Empty row produces loss of 0, when `criterion` uses `reduction='sum'`
+            logits = torch.empty(0, self.hid2logit.out_features, device=device)
+        
+        batch_logits = [lg.view(n, n, -1) for lg, n in zip(logits.split([n**2 for n in num_chunks]), num_chunks)]
+        if return_states:
+            if self.max_pair_distance is not None:
+                batch_states = [{'pair_non_mask': nm.view(n, n)} for nm, n in zip(pair_non_mask.split([n**2 for n in num_chunks]), num_chunks)]
             else:
-                # span_hidden: (num_chunks, span_size, hid_dim) -> (num_chunks, hid_dim)
-                span_hidden = [full_hidden[i, start:end] for label, start, end in cp_obj.chunks]
-                span_mask = seq_lens2mask(torch.tensor([h.size(0) for h in span_hidden], dtype=torch.long, device=full_hidden.device))
-                span_hidden = torch.nn.utils.rnn.pad_sequence(span_hidden, batch_first=True, padding_value=0.0)
-                span_hidden = self.aggregating(self.dropout(span_hidden), mask=span_mask)
-                
-                if hasattr(self, 'size_embedding'):
-                    # size_embedded: (num_chunks, emb_dim)
-                    size_embedded = self.size_embedding(cp_obj.span_size_ids)
-                    span_hidden = torch.cat([span_hidden, self.dropout(size_embedded)], dim=-1)
-                
-                if hasattr(self, 'label_embedding'):
-                    # label_embedded: (num_chunks, emb_dim)
-                    label_embedded = self.label_embedding(cp_obj.ck_label_ids)
-                    span_hidden = torch.cat([span_hidden, self.dropout(label_embedded)], dim=-1)
-                
-                # contexts: (num_chunks^2, ctx_span_size, hid_dim) -> (num_chunks^2, hid_dim)
-                contexts = []
-                for (h_label, h_start, h_end), (t_label, t_start, t_end) in itertools.product(cp_obj.chunks, cp_obj.chunks):
-                    if h_end < t_start:
-                        contexts.append(full_hidden[i, h_end:t_start])
-                    elif t_end < h_start:
-                        contexts.append(full_hidden[i, t_end:h_start])
-                    else:
-                        contexts.append(self.zero_context.unsqueeze(0))
-                ctx_mask = seq_lens2mask(torch.tensor([c.size(0) for c in contexts], dtype=torch.long, device=full_hidden.device))
-                contexts = torch.nn.utils.rnn.pad_sequence(contexts, batch_first=True, padding_value=0.0)
-                contexts = self.aggregating(self.dropout(contexts), mask=ctx_mask)
-                
-                # hidden_cat: (num_chunks, num_chunks, hid_dim*3)
-                hidden_cat = torch.cat([span_hidden.unsqueeze(1).expand(-1, num_chunks, -1), 
-                                        span_hidden.unsqueeze(0).expand(num_chunks, -1, -1), 
-                                        contexts.view(num_chunks, num_chunks, -1)], dim=-1)
-                # logits: (num_chunks, num_chunks, logit_dim)
-                logits = self.hid2logit(hidden_cat)
-            batch_logits.append(logits)
-        
-        return batch_logits
+                batch_states = [{'pair_non_mask': None} for n in num_chunks]
+            return batch_logits, batch_states
+        else:
+            return batch_logits
         
         
     def forward(self, batch: Batch, full_hidden: torch.Tensor):
-        batch_logits = self.get_logits(batch, full_hidden)
+        batch_logits, batch_states = self.get_logits(batch, full_hidden, return_states=True)
         
         losses = []
-        for logits, cp_obj in zip(batch_logits, batch.cp_objs):
+        for logits, states, cp_obj in zip(batch_logits, batch_states, batch.cp_objs):
             if len(cp_obj.chunks) == 0:
                 loss = torch.tensor(0.0, device=full_hidden.device)
             else:
                 label_ids = cp_obj.cp2label_id
-                if hasattr(cp_obj, 'non_mask'):
-                    non_mask = cp_obj.non_mask
+                non_mask = getattr(cp_obj, 'non_mask', None)
+                if states['pair_non_mask'] is not None:
+                    non_mask = states['pair_non_mask'] if non_mask is None else (non_mask & states['pair_non_mask'])
+                
+                if non_mask is not None:
                     logits, label_ids = logits[non_mask], label_ids[non_mask]
                 else:
                     logits, label_ids = logits.flatten(end_dim=1), label_ids.flatten(end_dim=1)
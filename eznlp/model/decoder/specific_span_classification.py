@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from typing import Dict
+from typing import List, Dict
 from collections import Counter
 import logging
 import math
@@ -12,7 +12,7 @@ from ...nn.modules import CombinedDropout, SoftLabelCrossEntropyLoss, MultiKerne
 from ...nn.init import reinit_embedding_, reinit_layer_
 from ..encoder import EncoderConfig
 from .base import SingleDecoderConfigBase, DecoderBase
-from .boundaries import Boundaries, MAX_SIZE_ID_COV_RATE, _spans_from_diagonals
+from .boundaries import Boundaries, MAX_SIZE_ID_COV_RATE, _spans_from_diagonals, _diagonal_span_boundaries
 from .boundary_selection import BoundariesDecoderMixin
 
 logger = logging.getLogger(__name__)
@@ -149,35 +149,36 @@ class SpecificSpanClsDecoder(DecoderBase, BoundariesDecoderMixin):
         self.criterion = config.instantiate_criterion(reduction='sum')
         
         
-    def _get_diagonal_span_size_ids(self, seq_len: int):
-        span_size_ids = self._span_size_ids[:seq_len, :seq_len]
-        return torch.cat([span_size_ids.diagonal(offset=k-1) for k in range(1, min(self.max_span_size, seq_len)+1)], dim=-1)
-        
-        
     def get_logits(self, batch: Batch, full_hidden: torch.Tensor, all_query_hidden: Dict[int, torch.Tensor], return_states: bool=False):
         # full_hidden: (batch, step, hid_dim)
         # query_hidden: (batch, step-k+1, hid_dim)
-        all_hidden = [full_hidden] + list(all_query_hidden.values())
+        seq_len = full_hidden.size(1)
+        max_span_size = min(self.max_span_size, seq_len)
+        all_hidden = [full_hidden] + [all_query_hidden[k] for k in range(2, max_span_size+1)]
         
-        batch_logits, batch_states = [], []
-        for i, curr_len in enumerate(batch.seq_lens.cpu().tolist()):
-            # (curr_len-k+1, hid_dim) -> (num_spans = \sum_k curr_len-k+1, hid_dim)
-            span_hidden = torch.cat([all_hidden[k-1][i, :curr_len-k+1] for k in range(1, min(self.max_span_size, curr_len)+1)], dim=0)
-            
-            if hasattr(self, 'size_embedding'):
-                # size_embedded: (num_spans = \sum_k curr_len-k+1, emb_dim)
-                size_embedded = self.size_embedding(self._get_diagonal_span_size_ids(curr_len))
-                span_hidden = torch.cat([span_hidden, size_embedded], dim=-1)
-            
-            # No mask input needed here
-            affined = self.affine(span_hidden)
-            
-            # (num_spans, logit_dim)
-            logits = self.hid2logit(self.dropout(affined))
-            batch_logits.append(logits)
-            batch_states.append({'span_hidden': affined})
+        # span_hidden: (batch, num_spans = \sum_k seq_len-k+1, hid_dim), following the order of `_spans_from_diagonals`
+        span_hidden = torch.cat(all_hidden, dim=1)
+        span_starts, span_ends = _diagonal_span_boundaries(seq_len, max_span_size, device=full_hidden.device)
+        
+        if hasattr(self, 'size_embedding'):
+            # size_embedded: (num_spans, emb_dim) -> (batch, num_spans, emb_dim)
+            size_embedded = self.size_embedding(self._span_size_ids[span_starts, span_ends-1]).expand(full_hidden.size(0), -1, -1)
+            span_hidden = torch.cat([span_hidden, size_embedded], dim=-1)
+        
+        # No mask input needed here
+        affined = self.affine(span_hidden)
+        
+        # logits: (batch, num_spans, logit_dim)
+        logits = self.hid2logit(self.dropout(affined))
+        
+        # Retain the spans within each sequence, following the order of `_spans_from_diagonals`
+        # span_non_pad: (batch, num_spans)
+        span_non_pad = (span_ends <= batch.seq_lens.unsqueeze(-1))
+        num_spans = span_non_pad.sum(dim=-1).cpu().tolist()
+        batch_logits = list(logits[span_non_pad].split(num_spans))
         
         if return_states:
+            batch_states = [{'span_hidden': h} for h in affined[span_non_pad].split(num_spans)]
             return batch_logits, batch_states
         else:
             return batch_logits
@@ -185,12 +186,15 @@ class SpecificSpanClsDecoder(DecoderBase, BoundariesDecoderMixin):
         
     def forward(self, batch: Batch, full_hidden: torch.Tensor, all_query_hidden: Dict[int, torch.Tensor]):
         batch_logits, batch_states = self.get_logits(batch, full_hidden, all_query_hidden, return_states=True)
+        return self._losses_from_logits(batch, batch_logits, batch_states)
         
+        
+    def _losses_from_logits(self, batch: Batch, batch_logits: List[torch.Tensor], batch_states: List[dict]):
         losses = []
         for logits, boundaries_obj, curr_len in zip(batch_logits, batch.boundaries_objs, batch.seq_lens.cpu().tolist()):
             # label_ids: (num_spans = \sum_k curr_len-k+1, ) or (num_spans = \sum_k curr_len-k+1, logit_dim)
             label_ids = boundaries_obj.diagonal_label_ids
-            if hasattr(boundaries_obj, 'non_mask'):
+            if hasattr(boundaries_obj, 'diagonal_non_mask'):
                 non_mask = boundaries_obj.diagonal_non_mask
                 logits, label_ids = logits[non_mask], label_ids[non_mask]
             
@@ -209,8 +213,20 @@ class SpecificSpanClsDecoder(DecoderBase, BoundariesDecoderMixin):
         
         
     def decode(self, batch: Batch, full_hidden: torch.Tensor, all_query_hidden: Dict[int, torch.Tensor]):
-        batch_logits = self.get_logits(batch, full_hidden, all_query_hidden)
+        batch_logits = self._pop_cached_scores(batch, full_hidden)
+        if batch_logits is None:
+            batch_logits = self.get_logits(batch, full_hidden, all_query_hidden)
+        return self._decode_from_logits(batch, batch_logits)
+        
+        
+    def forward_and_decode(self, batch: Batch, full_hidden: torch.Tensor, all_query_hidden: Dict[int, torch.Tensor]):
+        batch_logits, batch_states = self.get_logits(batch, full_hidden, all_query_hidden, return_states=True)
+        # Cache the logits for a following `decode` on the same batch
+        self._cache_scores(batch, full_hidden, batch_logits)
+        return self._losses_from_logits(batch, batch_logits, batch_states), self._decode_from_logits(batch, batch_logits)
+        
         
+    def _decode_from_logits(self, batch: Batch, batch_logits: List[torch.Tensor]):
         batch_chunks = []
         for logits, boundaries_obj, curr_len in zip(batch_logits, batch.boundaries_objs, batch.seq_lens.cpu().tolist()):
             confidences, label_ids = logits.softmax(dim=-1).max(dim=-1)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from typing import List, Dict
 from collections import Counter
+import itertools
 import logging
 import math
 import numpy
@@ -12,7 +13,8 @@ from ...nn.init import reinit_embedding_, reinit_layer_
 from ...metrics import precision_recall_f1_report
 from ..encoder import EncoderConfig
 from .base import DecoderMixinBase, SingleDecoderConfigBase, DecoderBase
-from .boundaries import DiagBoundariesPairs, MAX_SIZE_ID_COV_RATE, _span_pairs_from_diagonals
+from .boundaries import DiagBoundariesPairs, MAX_SIZE_ID_COV_RATE, _span2diagonal, _diagonal_span_boundaries
+from .boundary_selection import SCORE_CHUNK_NUMEL
 
 logger = logging.getLogger(__name__)
 
@@ -201,82 +203,144 @@ class SpecificSpanRelClsDecoder(DecoderBase, DiagBoundariesPairsDecoderMixin):
                 dbp_obj.to(self.W.device)
         
         
-    def _get_diagonal_span_size_ids(self, seq_len: int):
-        span_size_ids = self._span_size_ids[:seq_len, :seq_len]
-        return torch.cat([span_size_ids.diagonal(offset=k-1) for k in range(1, min(self.max_span_size, seq_len)+1)], dim=-1)
+    def _compute_affined(self, batch: Batch, full_hidden: torch.Tensor, all_query_hidden: Dict[int, torch.Tensor]):
+        """Affined representations of all spans (not exceeding `max_span_size`) for each sequence. 
         
-        
-    def compute_scores(self, batch: Batch, full_hidden: torch.Tensor, all_query_hidden: Dict[int, torch.Tensor]):
+        Returns
+        -------
+        batch_affined: List[Tuple[torch.Tensor]]
+            Each of (affined_head, affined_tail), both (num_spans = \sum_k curr_len-k+1, affine_dim), 
+            with spans ordered as `_spans_from_diagonals(curr_len, max_span_size)`. 
+        """
         # full_hidden: (batch, step, hid_dim)
         # query_hidden: (batch, step-k+1, hid_dim)
-        all_hidden = [full_hidden] + list(all_query_hidden.values())
+        seq_len = full_hidden.size(1)
+        max_span_size = min(self.max_span_size, seq_len)
+        all_hidden = [full_hidden] + [all_query_hidden[k] for k in range(2, max_span_size+1)]
+        
+        # span_hidden: (batch, num_spans = \sum_k seq_len-k+1, hid_dim)
+        span_hidden = torch.cat(all_hidden, dim=1)
+        span_starts, span_ends = _diagonal_span_boundaries(seq_len, max_span_size, device=full_hidden.device)
+        
+        if hasattr(self, 'size_embedding'):
+            # size_embedded: (num_spans, emb_dim) -> (batch, num_spans, emb_dim)
+            size_embedded = self.size_embedding(self._span_size_ids[span_starts, span_ends-1]).expand(full_hidden.size(0), -1, -1)
+            span_hidden = torch.cat([span_hidden, size_embedded], dim=-1)
+        
+        if hasattr(self, 'affine_head'):
+            # No mask input needed here
+            affined_head = self.affine_head(span_hidden)
+            affined_tail = self.affine_tail(span_hidden)
+        else:
+            affined_head = self.affine(span_hidden)
+            affined_tail = self.affine(span_hidden)
         
-        batch_scores = []
-        for i, curr_len in enumerate(batch.seq_lens.cpu().tolist()):
-            # (curr_len-k+1, hid_dim) -> (num_spans = \sum_k curr_len-k+1, hid_dim)
-            span_hidden = torch.cat([all_hidden[k-1][i, :curr_len-k+1] for k in range(1, min(self.max_span_size, curr_len)+1)], dim=0)
-            
-            if hasattr(self, 'size_embedding'):
-                # size_embedded: (num_spans, emb_dim)
-                size_embedded = self.size_embedding(self._get_diagonal_span_size_ids(curr_len))
-                span_hidden = torch.cat([span_hidden, size_embedded], dim=-1)
-            
-            if hasattr(self, 'affine_head'):
-                # No mask input needed here
-                affined_head = self.affine_head(span_hidden)
-                affined_tail = self.affine_tail(span_hidden)
-            else:
-                affined_head = self.affine(span_hidden)
-                affined_tail = self.affine(span_hidden)
-            
-            # scores1: (head_spans, affine_dim) * (voc_dim, affine_dim, affine_dim) * (affine_dim, tail_spans) -> (voc_dim, head_spans, tail_spans)
-            scores1 = self.dropout(affined_head).matmul(self.U).matmul(self.dropout(affined_tail.permute(1, 0)))
-            
-            # affined_cat: (head_spans, tail_spans, affine_dim*2)
-            affined_cat = torch.cat([self.dropout(affined_head).unsqueeze(1).expand(-1, affined_tail.size(0), -1), 
-                                     self.dropout(affined_tail).unsqueeze(0).expand(affined_head.size(0), -1, -1)], dim=-1)
-            
-            # scores2: (voc_dim, affine_dim*2) * (head_spans, tail_spans, affine_dim*2, 1) -> (head_spans, tail_spans, voc_dim, 1) 
-            scores2 = self.W.matmul(affined_cat.unsqueeze(-1))
-            # scores: (head_spans, tail_spans, voc_dim)
-            scores = scores1.permute(1, 2, 0) + scores2.squeeze(-1) + self.b
-            batch_scores.append(scores)
+        # Retain the spans within each sequence
+        return [(curr_head[span_ends <= curr_len], curr_tail[span_ends <= curr_len]) 
+                    for curr_head, curr_tail, curr_len in zip(affined_head, affined_tail, batch.seq_lens.cpu().tolist())]
+        
+        
+    def _score_all_pairs(self, affined_head: torch.Tensor, affined_tail: torch.Tensor):
+        return self._score_dropped_pairs(self.dropout(affined_head), self.dropout(affined_tail))
+        
+        
+    def _score_dropped_pairs(self, affined_head: torch.Tensor, affined_tail: torch.Tensor):
+        W_head, W_tail = self.W.split(affined_head.size(-1), dim=-1)
+        
+        # scores1: (head_spans, affine_dim) * (voc_dim, affine_dim, affine_dim) * (affine_dim, tail_spans) -> (voc_dim, head_spans, tail_spans)
+        scores1 = affined_head.matmul(self.U).matmul(affined_tail.permute(1, 0))
+        # scores2: (head_spans, 1, voc_dim) + (1, tail_spans, voc_dim) -> (head_spans, tail_spans, voc_dim)
+        scores2 = affined_head.matmul(W_head.T).unsqueeze(1) + affined_tail.matmul(W_tail.T).unsqueeze(0)
+        # scores: (head_spans, tail_spans, voc_dim)
+        return scores1.permute(1, 2, 0) + scores2 + self.b
         
-        return batch_scores
+        
+    def _score_pairs(self, affined_head: torch.Tensor, affined_tail: torch.Tensor, pair_ids: torch.LongTensor):
+        """Scores of the given pairs only. 
+        
+        Parameters
+        ----------
+        pair_ids: torch.LongTensor
+            (num_pairs, 2), the indexes of (head, tail) spans. 
+        
+        Returns
+        -------
+        scores: torch.Tensor
+            (num_pairs, voc_dim)
+        """
+        affined_head, affined_tail = self.dropout(affined_head), self.dropout(affined_tail)
+        W_head, W_tail = self.W.split(affined_head.size(-1), dim=-1)
+        
+        # pair_head/pair_tail: (num_pairs, affine_dim)
+        pair_head, pair_tail = affined_head[pair_ids[:, 0]], affined_tail[pair_ids[:, 1]]
+        scores1 = torch.einsum('pd,cde,pe->pc', pair_head, self.U, pair_tail)
+        scores2 = pair_head.matmul(W_head.T) + pair_tail.matmul(W_tail.T)
+        return scores1 + scores2 + self.b
+        
+        
+    def compute_scores(self, batch: Batch, full_hidden: torch.Tensor, all_query_hidden: Dict[int, torch.Tensor]):
+        # scores: (head_spans, tail_spans, voc_dim)
+        return [self._score_all_pairs(affined_head, affined_tail) 
+                    for affined_head, affined_tail in self._compute_affined(batch, full_hidden, all_query_hidden)]
         
         
     def forward(self, batch: Batch, full_hidden: torch.Tensor, all_query_hidden: Dict[int, torch.Tensor]):
-        batch_scores = self.compute_scores(batch, full_hidden, all_query_hidden)
+        batch_affined = self._compute_affined(batch, full_hidden, all_query_hidden)
         
         losses = []
-        for scores, dbp_obj in zip(batch_scores, batch.dbp_objs):
-            # label_ids: (num_spans, num_spans) or (num_spans, num_spans, voc_dim)
-            label_ids = dbp_obj.dbp2label_id
-            if hasattr(dbp_obj, 'non_mask'):
-                non_mask = dbp_obj.non_mask
-                scores, label_ids = scores[non_mask], label_ids[non_mask]
+        for (affined_head, affined_tail), dbp_obj in zip(batch_affined, batch.dbp_objs):
+            if hasattr(dbp_obj, 'neg_pair_ids'):
+                # Only score the positive and sampled negative pairs
+                scores = self._score_pairs(affined_head, affined_tail, dbp_obj.sampled_pair_ids)
+                label_ids = dbp_obj.sampled_label_ids
+                loss = self.criterion(scores, label_ids)
             else:
-                scores, label_ids = scores.flatten(end_dim=1), label_ids.flatten(end_dim=1)
-            
-            loss = self.criterion(scores, label_ids)
+                loss = self._all_pairs_loss(affined_head, affined_tail, dbp_obj)
             losses.append(loss)
         return torch.stack(losses)
         
         
+    def _all_pairs_loss(self, affined_head: torch.Tensor, affined_tail: torch.Tensor, dbp_obj: DiagBoundariesPairs):
+        """Loss over all pairs, computed in chunks of head spans, so that the scores and labels of each chunk 
+        are bounded by `SCORE_CHUNK_NUMEL` elements, instead of growing with (num_spans, num_spans, voc_dim). 
+        This bounds the peak memory of evaluation; in training, the tensors retained for backward still scale 
+        with the number of pairs, unless negative sampling (`neg_sampling_rate` < 1) is applied. 
+        """
+        dropped_head, dropped_tail = self.dropout(affined_head), self.dropout(affined_tail)
+        num_spans = affined_tail.size(0)
+        chunk_size = max(SCORE_CHUNK_NUMEL // (self.U.size(0) * max(num_spans, self.U.size(1))), 1)
+        
+        losses = []
+        for chunk_start in range(0, affined_head.size(0), chunk_size):
+            chunk_end = min(chunk_start + chunk_size, affined_head.size(0))
+            # scores: (chunk_size, tail_spans, voc_dim)
+            scores = self._score_dropped_pairs(dropped_head[chunk_start:chunk_end], dropped_tail)
+            label_ids = dbp_obj.head_chunk_label_ids(chunk_start, chunk_end)
+            # The criterion is in the `sum` reduction, and hence additive over chunks
+            losses.append(self.criterion(scores.flatten(end_dim=1), label_ids.flatten(end_dim=1)))
+        return torch.stack(losses).sum()
+        
+        
     def decode(self, batch: Batch, full_hidden: torch.Tensor, all_query_hidden: Dict[int, torch.Tensor]):
-        batch_scores = self.compute_scores(batch, full_hidden, all_query_hidden)
+        batch_affined = self._compute_affined(batch, full_hidden, all_query_hidden)
         
         batch_relations = []
-        for scores, dbp_obj, curr_len in zip(batch_scores, batch.dbp_objs, batch.seq_lens.cpu().tolist()):
+        for (affined_head, affined_tail), dbp_obj, curr_len in zip(batch_affined, batch.dbp_objs, batch.seq_lens.cpu().tolist()):
+            # Only the pairs between candidate spans (i.e., with chunk labels) are scored, 
+            # where the candidates are sorted by the diagonal indexes, consistent to `_span_pairs_from_diagonals`
+            candidates = sorted((_span2diagonal(start, end, curr_len), (label, start, end)) for (start, end), label in dbp_obj.span2ck_label.items() 
+                                    if end - start <= self.max_span_size and label != self.ck_none_label)
+            if len(candidates) == 0:
+                batch_relations.append([])
+                continue
+            
+            candidate_ids = torch.tensor([k for k, ck in candidates], dtype=torch.long, device=full_hidden.device)
+            pair_ids = torch.cartesian_prod(candidate_ids, candidate_ids).view(-1, 2)
+            scores = self._score_pairs(affined_head, affined_tail, pair_ids)
             confidences, label_ids = scores.softmax(dim=-1).max(dim=-1)
-            labels = [self.idx2label[i] for i in label_ids.flatten().cpu().tolist()]
+            labels = [self.idx2label[i] for i in label_ids.cpu().tolist()]
             
-            relations = []
-            for label, ((h_start, h_end), (t_start, t_end)) in zip(labels, _span_pairs_from_diagonals(curr_len, self.max_span_size)):
-                head = (dbp_obj.span2ck_label.get((h_start, h_end), self.ck_none_label), h_start, h_end)
-                tail = (dbp_obj.span2ck_label.get((t_start, t_end), self.ck_none_label), t_start, t_end)
-                if label != self.none_label and head[0] != self.ck_none_label and tail[0] != self.ck_none_label:
-                    relations.append((label, head, tail))
+            relations = [(label, head, tail) for label, ((_, head), (_, tail)) in zip(labels, itertools.product(candidates, candidates)) if label != self.none_label]
             relations = [(label, head, tail) for label, head, tail in relations 
                              if  (not self.filter_by_labels or ((label, head[0], tail[0]) in self.existing_rht_labels)) 
                              and (not self.filter_self_relation or self.existing_self_relation or (head[1:] != tail[1:]))]
@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 from typing import List, Dict
 from collections import Counter
-import itertools
 import logging
 import copy
 import math
@@ -9,6 +8,7 @@ import numpy
 import torch
 
 from ...wrapper import Batch
+from ...nn.functional import seq_lens2mask
 from ...nn.modules import CombinedDropout
 from ...nn.init import reinit_embedding_, reinit_layer_, reinit_vector_parameter_
 from ..encoder import EncoderConfig
@@ -118,6 +118,9 @@ class SpecificSpanSparseRelClsDecoder(DecoderBase, ChunkPairsDecoderMixin):
         self.existing_rht_labels = config.existing_rht_labels
         self.filter_self_relation = config.filter_self_relation
         self.existing_self_relation = config.existing_self_relation
+        # The existing (label, head-type, tail-type) triplets, as a mask tensor for filtering in decoding; 
+        # non-persistent, so that the `state_dict` is compatible with that of earlier versions
+        self.register_buffer('_rht_non_mask', _build_rht_non_mask(config.existing_rht_labels, config.label2idx, config.ck_label2idx), persistent=False)
         
         if config.use_biaffine:
             self.affine_head = config.affine.instantiate()
@@ -154,74 +157,104 @@ class SpecificSpanSparseRelClsDecoder(DecoderBase, ChunkPairsDecoderMixin):
     def assign_chunks_pred(self, batch: Batch, batch_chunks_pred: List[List[tuple]]):
         """This method should be called on-the-fly for joint modeling. 
         """
+        cp_objs_to_build = []
         for cp_obj, chunks_pred in zip(batch.cp_objs, batch_chunks_pred):
             if cp_obj.chunks_pred is None:
                 cp_obj.chunks_pred = chunks_pred
-                cp_obj.build(self)
-                cp_obj.to(self.W.device)
+                cp_objs_to_build.append(cp_obj)
         
+        # Build the targets of the whole batch at once, with a single transfer to the device
+        if len(cp_objs_to_build) > 0:
+            ChunkPairs.build_batch(cp_objs_to_build, self, device=self.W.device)
         
-    def compute_scores(self, batch: Batch, full_hidden: torch.Tensor, all_query_hidden: Dict[int, torch.Tensor]):
+        
+    def _compute_padded_scores(self, batch: Batch, full_hidden: torch.Tensor, all_query_hidden: Dict[int, torch.Tensor]):
+        """Compute the scores of all chunk-pairs in the batch at once, padded to (batch, max_chunks, max_chunks). 
+        
+        Returns
+        -------
+        scores: torch.Tensor
+            (batch, max_chunks, max_chunks, voc_dim)
+        chunk_mask: torch.BoolTensor
+            (batch, max_chunks), True for padding chunks. 
+        """
         # full_hidden: (batch, step, hid_dim)
         # query_hidden: (batch, step-k+1, hid_dim)
         all_hidden = [full_hidden] + list(all_query_hidden.values())
+        flat_hidden, flat_offsets, flat_steps = _flatten_specific_span_hidden(all_hidden)
+        
+        num_chunks = torch.tensor([len(cp_obj.chunks) for cp_obj in batch.cp_objs], device=full_hidden.device)
+        # chunk_mask: (batch, max_chunks)
+        chunk_mask = seq_lens2mask(num_chunks, max_len=num_chunks.max().item())
+        batch_size, max_chunks = chunk_mask.size()
+        
+        # The chunks are flattened over the batch: (num_chunks_in_batch, )
+        batch_ids = torch.arange(batch_size, device=full_hidden.device).repeat_interleave(num_chunks)
+        span_starts = torch.cat([cp_obj.span_starts for cp_obj in batch.cp_objs])
+        span_ends = torch.cat([cp_obj.span_ends for cp_obj in batch.cp_objs])
+        
+        # span_hidden: (num_chunks_in_batch, hid_dim)
+        span_hidden = flat_hidden[_specific_span_flat_ids(batch_ids, span_starts, span_ends-span_starts, flat_offsets, flat_steps)]
+        
+        if hasattr(self, 'size_embedding'):
+            # size_embedded: (num_chunks_in_batch, emb_dim)
+            size_embedded = self.size_embedding(torch.cat([cp_obj.span_size_ids for cp_obj in batch.cp_objs]))
+            span_hidden = torch.cat([span_hidden, size_embedded], dim=-1)
+        
+        if hasattr(self, 'label_embedding'):
+            # label_embedded: (num_chunks_in_batch, emb_dim)
+            label_embedded = self.label_embedding(torch.cat([cp_obj.ck_label_ids for cp_obj in batch.cp_objs]))
+            span_hidden = torch.cat([span_hidden, label_embedded], dim=-1)
+        
+        if hasattr(self, 'affine_head'):
+            # No mask input needed here
+            affined_head = self.affine_head(span_hidden)
+            affined_tail = self.affine_tail(span_hidden)
+        else:
+            affined_head = self.affine(span_hidden)
+            affined_tail = self.affine(span_hidden)
+        
+        # Dropout on the flattened chunks, and then pad to (batch, max_chunks, affine_dim)
+        head4U, tail4U, head4W, tail4W = [_pad_flattened(self.dropout(x), ~chunk_mask) for x in (affined_head, affined_tail, affined_head, affined_tail)]
+        
+        # scores1: (batch, head_chunks, affine_dim) * (voc_dim, affine_dim, affine_dim) * (batch, tail_chunks, affine_dim) -> (batch, head_chunks, tail_chunks, voc_dim)
+        scores = torch.einsum('bhd,cde,bte->bhtc', head4U, self.U, tail4U)
+        
+        # `W` is decomposed into the head, tail (and context) parts, so that the concatenated (batch, head_chunks, tail_chunks, affine_dim*2) is not materialized
+        W_head, W_tail, *W_ctx = self.W.split(self.U.size(-1), dim=-1)
+        scores = scores + head4W.matmul(W_head.T).unsqueeze(2) + tail4W.matmul(W_tail.T).unsqueeze(1)
+        
+        if hasattr(self, 'affine_ctx'):
+            # pair_non_mask: (batch, max_chunks, max_chunks)
+            pair_non_mask = (~chunk_mask).unsqueeze(2) & (~chunk_mask).unsqueeze(1)
+            pair_batch_ids = torch.arange(batch_size, device=full_hidden.device).view(-1, 1, 1).expand_as(pair_non_mask)[pair_non_mask]
+            padded_starts, padded_ends = _pad_flattened(span_starts, ~chunk_mask), _pad_flattened(span_ends, ~chunk_mask)
+            h_starts, h_ends = [x.unsqueeze(2).expand_as(pair_non_mask)[pair_non_mask] for x in (padded_starts, padded_ends)]
+            t_starts, t_ends = [x.unsqueeze(1).expand_as(pair_non_mask)[pair_non_mask] for x in (padded_starts, padded_ends)]
+            
+            # The context is the span between the head and tail chunks; overlapping or adjacent chunks have no context
+            head_first, tail_first = (h_ends < t_starts), (t_ends < h_starts)
+            has_context = head_first | tail_first
+            ctx_starts = torch.where(head_first, h_ends, t_ends).masked_fill(~has_context, 0)
+            ctx_ends = torch.where(head_first, t_starts, h_starts).masked_fill(~has_context, 1)
+            # contexts: (num_pairs_in_batch, hid_dim)
+            contexts = _collect_context_from_specific_span_hidden(pair_batch_ids, ctx_starts, ctx_ends, flat_hidden, flat_offsets, flat_steps)
+            contexts = torch.where(has_context.unsqueeze(-1), contexts, self.zero_context)
+            
+            # affined_ctx: (num_pairs_in_batch, affine_dim) -> (batch, max_chunks, max_chunks, affine_dim)
+            affined_ctx = _pad_flattened(self.dropout(self.affine_ctx(contexts)), pair_non_mask)
+            scores = scores + affined_ctx.matmul(W_ctx[0].T)
+        
+        return scores + self.b, chunk_mask
         
-        batch_scores = []
-        for i, cp_obj in enumerate(batch.cp_objs):
-            num_chunks = len(cp_obj.chunks)
-            if num_chunks == 0:
-                scores = torch.empty(0, 0, self.W.size(0), device=full_hidden.device)
-            else:
-                # (num_chunks, hid_dim)
-                span_hidden = torch.stack([all_hidden[end-start-1][i, start] for label, start, end in cp_obj.chunks])
-                
-                if hasattr(self, 'size_embedding'):
-                    # size_embedded: (num_chunks, emb_dim)
-                    size_embedded = self.size_embedding(cp_obj.span_size_ids)
-                    span_hidden = torch.cat([span_hidden, size_embedded], dim=-1)
-                
-                if hasattr(self, 'label_embedding'):
-                    # label_embedded: (num_chunks, emb_dim)
-                    label_embedded = self.label_embedding(cp_obj.ck_label_ids)
-                    span_hidden = torch.cat([span_hidden, label_embedded], dim=-1)
-                
-                if hasattr(self, 'affine_head'):
-                    # No mask input needed here
-                    affined_head = self.affine_head(span_hidden)
-                    affined_tail = self.affine_tail(span_hidden)
-                else:
-                    affined_head = self.affine(span_hidden)
-                    affined_tail = self.affine(span_hidden)
-                
-                # scores1: (head_chunks, affine_dim) * (voc_dim, affine_dim, affine_dim) * (affine_dim, tail_chunks) -> (voc_dim, head_chunks, tail_chunks)
-                scores1 = self.dropout(affined_head).matmul(self.U).matmul(self.dropout(affined_tail.permute(1, 0)))
-                
-                # affined_cat: (head_chunks, tail_chunks, affine_dim*2)
-                affined_cat = torch.cat([self.dropout(affined_head).unsqueeze(1).expand(-1, affined_tail.size(0), -1), 
-                                         self.dropout(affined_tail).unsqueeze(0).expand(affined_head.size(0), -1, -1)], dim=-1)
-                
-                if hasattr(self, 'affine_ctx'):
-                    # contexts: (num_chunks^2, hid_dim)
-                    contexts = []
-                    for (h_label, h_start, h_end), (t_label, t_start, t_end) in itertools.product(cp_obj.chunks, cp_obj.chunks):
-                        if h_end < t_start:
-                            contexts.append(_collect_context_from_specific_span_hidden(i, h_end, t_start, all_hidden))
-                        elif t_end < h_start:
-                            contexts.append(_collect_context_from_specific_span_hidden(i, t_end, h_start, all_hidden))
-                        else:
-                            contexts.append(self.zero_context)
-                    contexts = torch.stack(contexts)
-                    # affined_ctx: (num_chunks^2, affine_dim) -> (num_chunks, num_chunks, affine_dim)
-                    affined_ctx = self.affine_ctx(contexts).view(num_chunks, num_chunks, -1)
-                    affined_cat = torch.cat([affined_cat, self.dropout(affined_ctx)], dim=-1)
-                
-                # scores2: (voc_dim, affine_dim*2) * (head_chunks, tail_chunks, affine_dim*2, 1) -> (head_chunks, tail_chunks, voc_dim, 1) 
-                scores2 = self.W.matmul(affined_cat.unsqueeze(-1))
-                # scores: (head_chunks, tail_chunks, voc_dim)
-                scores = scores1.permute(1, 2, 0) + scores2.squeeze(-1) + self.b
-            batch_scores.append(scores)
-        
-        return batch_scores
+        
+    def compute_scores(self, batch: Batch, full_hidden: torch.Tensor, all_query_hidden: Dict[int, torch.Tensor]):
+        if all(len(cp_obj.chunks) == 0 for cp_obj in batch.cp_objs):
+            return [torch.empty(0, 0, self.W.size(0), device=full_hidden.device) for cp_obj in batch.cp_objs]
+        
+        batch_scores, _ = self._compute_padded_scores(batch, full_hidden, all_query_hidden)
+        # scores: (num_chunks, num_chunks, voc_dim)
+        return [scores[:len(cp_obj.chunks), :len(cp_obj.chunks)] for scores, cp_obj in zip(batch_scores, batch.cp_objs)]
         
         
     def forward(self, batch: Batch, full_hidden: torch.Tensor, all_query_hidden: Dict[int, torch.Tensor]):
@@ -244,28 +277,85 @@ class SpecificSpanSparseRelClsDecoder(DecoderBase, ChunkPairsDecoderMixin):
         
         
     def decode(self, batch: Batch, full_hidden: torch.Tensor, all_query_hidden: Dict[int, torch.Tensor]):
-        batch_scores = self.compute_scores(batch, full_hidden, all_query_hidden)
-        
-        batch_relations = []
-        for scores, cp_obj in zip(batch_scores, batch.cp_objs):
-            if len(cp_obj.chunks) == 0:
-                relations = []
-            else:
-                confidences, label_ids = scores.softmax(dim=-1).max(dim=-1)
-                labels = [self.idx2label[i] for i in label_ids.flatten().cpu().tolist()]
-                relations = [(label, head, tail) for label, (head, tail) in zip(labels, itertools.product(cp_obj.chunks, cp_obj.chunks)) if label != self.none_label]
-                relations = [(label, head, tail) for label, head, tail in relations 
-                                if  (not self.filter_by_labels or ((label, head[0], tail[0]) in self.existing_rht_labels)) 
-                                and (not self.filter_self_relation or self.existing_self_relation or (head[1:] != tail[1:]))]
-            batch_relations.append(relations)
+        batch_relations = [[] for cp_obj in batch.cp_objs]
+        if all(len(cp_obj.chunks) == 0 for cp_obj in batch.cp_objs):
+            return batch_relations
+        
+        batch_scores, chunk_mask = self._compute_padded_scores(batch, full_hidden, all_query_hidden)
+        # label_ids: (batch, head_chunks, tail_chunks)
+        label_ids = batch_scores.argmax(dim=-1)
+        is_valid = (~chunk_mask).unsqueeze(2) & (~chunk_mask).unsqueeze(1) & (label_ids != self.none_idx)
+        
+        if self.filter_by_labels:
+            if getattr(self, '_rht_non_mask', None) is None:
+                # Models saved by earlier versions
+                self.register_buffer('_rht_non_mask', _build_rht_non_mask(self.existing_rht_labels, self.label2idx, self.ck_label2idx).to(full_hidden.device), persistent=False)
+            ck_label_ids = _pad_flattened(torch.cat([cp_obj.ck_label_ids for cp_obj in batch.cp_objs]), ~chunk_mask)
+            is_valid &= self._rht_non_mask[label_ids, ck_label_ids.unsqueeze(2).expand_as(label_ids), ck_label_ids.unsqueeze(1).expand_as(label_ids)]
+        
+        if self.filter_self_relation and not self.existing_self_relation:
+            span_starts = _pad_flattened(torch.cat([cp_obj.span_starts for cp_obj in batch.cp_objs]), ~chunk_mask)
+            span_ends = _pad_flattened(torch.cat([cp_obj.span_ends for cp_obj in batch.cp_objs]), ~chunk_mask)
+            is_valid &= (span_starts.unsqueeze(2) != span_starts.unsqueeze(1)) | (span_ends.unsqueeze(2) != span_ends.unsqueeze(1))
+        
+        # `nonzero` returns indexes in the row-major order, consistent to `itertools.product(chunks, chunks)`
+        for i, hk, tk, label_id in zip(*[x.cpu().tolist() for x in is_valid.nonzero(as_tuple=True)], label_ids[is_valid].cpu().tolist()):
+            chunks = batch.cp_objs[i].chunks
+            batch_relations[i].append((self.idx2label[label_id], chunks[hk], chunks[tk]))
         return batch_relations
 
 
 
+def _build_rht_non_mask(existing_rht_labels: set, label2idx: dict, ck_label2idx: dict):
+    """Build the mask of existing (label, head-type, tail-type) triplets. 
+    
+    Returns
+    -------
+    rht_non_mask: torch.BoolTensor
+        (voc_dim, ck_voc_dim, ck_voc_dim)
+    """
+    rht_non_mask = torch.zeros(len(label2idx), len(ck_label2idx), len(ck_label2idx), dtype=torch.bool)
+    for label, head_label, tail_label in existing_rht_labels:
+        rht_non_mask[label2idx[label], ck_label2idx[head_label], ck_label2idx[tail_label]] = True
+    return rht_non_mask
+
+
+def _flatten_specific_span_hidden(all_hidden: List[torch.Tensor]):
+    """Flatten the span representations of all sizes into a single tensor for gathering. 
+    
+    Returns
+    -------
+    flat_hidden: torch.Tensor
+        (sum_k batch*(step-k+1), hid_dim)
+    flat_offsets: torch.LongTensor
+        (max_span_size, ), the starting row of spans of size k+1 in `flat_hidden`. 
+    flat_steps: torch.LongTensor
+        (max_span_size, ), the number of spans of size k+1 in each sequence. 
+    """
+    flat_hidden = torch.cat([hidden.flatten(end_dim=1) for hidden in all_hidden], dim=0)
+    flat_steps = torch.tensor([hidden.size(1) for hidden in all_hidden], device=flat_hidden.device)
+    flat_sizes = torch.tensor([hidden.size(0)*hidden.size(1) for hidden in all_hidden], device=flat_hidden.device)
+    return flat_hidden, flat_sizes.cumsum(dim=0) - flat_sizes, flat_steps
+
+
+def _specific_span_flat_ids(batch_ids: torch.LongTensor, starts: torch.LongTensor, sizes: torch.LongTensor, flat_offsets: torch.LongTensor, flat_steps: torch.LongTensor):
+    return flat_offsets[sizes-1] + batch_ids*flat_steps[sizes-1] + starts
+
+
+def _pad_flattened(x: torch.Tensor, non_mask: torch.BoolTensor):
+    """Scatter the flattened `x` (num_items, *) to the padded shape (*non_mask.size(), *), with zeros at the masked positions. 
+    """
+    padded = x.new_zeros(*non_mask.size(), *x.size()[1:])
+    padded[non_mask] = x
+    return padded
+
+
 # TODO: Aggregation?
-def _collect_context_from_specific_span_hidden(i: int, start: int, end: int, all_hidden: List[torch.Tensor]):
-    max_span_size = len(all_hidden)
-    if end - start <= max_span_size:
-        return all_hidden[end-start-1][i, start]
-    else:
-        return (all_hidden[max_span_size-1][i, start] + all_hidden[max_span_size-1][i, end-max_span_size]) / 2
+def _collect_context_from_specific_span_hidden(batch_ids: torch.LongTensor, starts: torch.LongTensor, ends: torch.LongTensor, 
+                                               flat_hidden: torch.Tensor, flat_offsets: torch.LongTensor, flat_steps: torch.LongTensor):
+    # A context longer than `max_span_size` is represented by the average of its leading and trailing spans of `max_span_size`; 
+    # otherwise, the two spans coincide and the average returns the span representation itself. 
+    sizes = (ends - starts).clamp(max=flat_offsets.size(0))
+    leading_hidden = flat_hidden[_specific_span_flat_ids(batch_ids, starts, sizes, flat_offsets, flat_steps)]
+    trailing_hidden = flat_hidden[_specific_span_flat_ids(batch_ids, ends-sizes, sizes, flat_offsets, flat_steps)]
+    return (leading_hidden + trailing_hidden) / 2
@@ -5,6 +5,8 @@ import allennlp.modules
 
 from ..token import TokenSequence
 from ..config import Config
+from ..nn.functional import seq_lens2mask
+from .representations_store import TokenRepresentationsStore, _module_fingerprint
 
 
 class ELMoConfig(Config):
@@ -19,9 +21,19 @@ class ELMoConfig(Config):
         self.mix_layers = kwargs.pop('mix_layers', 'trainable')
         self.use_gamma = kwargs.pop('use_gamma', True)
         
+        # Opt-in: pre-compute the outputs of the frozen ELMo layers into a memory-mapped store at `cache_path`, 
+        # so that only the trainable layer mixing runs in training
+        self.cache_path = kwargs.pop('cache_path', None)
+        self.cache_dtype = kwargs.pop('cache_dtype', 'float32')
+        self.cache = None
+        
         super().__init__(**kwargs)
         
         
+    @property
+    def valid(self):
+        return all(attr is not None for name, attr in self.__dict__.items() if name not in ('cache_path', 'cache'))
+        
     @property
     def name(self):
         return self.arch
@@ -32,11 +44,46 @@ class ELMoConfig(Config):
         return state
         
         
+    def build_representations_cache(self, *partitions, batch_size: int=32):
+        """Run the frozen ELMo over `partitions` once, and store the outputs of all ELMo layers (before mixing) 
+        for each token. The store is built only if not existing at `cache_path`. 
+        """
+        assert self.freeze, "The cached ELMo representations require a frozen ELMo"
+        assert not self.lstm_stateful, "The cached ELMo representations require a stateless ELMo"
+        meta = {'arch': self.arch, 
+                'model': _module_fingerprint(self.elmo._elmo_lstm), 
+                'out_dim': self.out_dim}
+        self.cache = TokenRepresentationsStore(self.cache_path, dtype=self.cache_dtype, meta=meta)
+        if not self.cache.exists:
+            tokenized_texts = [entry['tokens'].raw_text for data in partitions for entry in data]
+            self.cache.build(tokenized_texts, self._compute_layer_outputs, batch_size=batch_size)
+        self.cache.load()
+        
+    @torch.no_grad()
+    def _compute_layer_outputs(self, batch_tokenized_raw_text: List[List[str]]):
+        elmo_lstm = self.elmo._elmo_lstm
+        char_ids = allennlp.modules.elmo.batch_to_ids(batch_tokenized_raw_text).to(next(elmo_lstm.parameters()).device)
+        bilm_outs = elmo_lstm(char_ids)
+        elmo_lstm._elmo_lstm.reset_states()
+        
+        # activations: (batch, step+2, num_layers, hid_dim), including the sentence boundaries
+        activations = torch.stack(bilm_outs['activations'], dim=2)
+        return [curr_acts[1:len(text)+1] for curr_acts, text in zip(activations, batch_tokenized_raw_text)]
+        
+        
     def exemplify(self, tokens: TokenSequence):
         return {'tokenized_raw_text': tokens.raw_text}
         
     def batchify(self, batch_ex: List[dict]):
         batch_tokenized_raw_text = [ex['tokenized_raw_text'] for ex in batch_ex]
+        
+        if self.cache is not None and all(text in self.cache for text in batch_tokenized_raw_text):
+            # layer_outputs: (batch, step, num_layers, hid_dim)
+            batch_layer_outputs = torch.nn.utils.rnn.pad_sequence([self.cache[text] for text in batch_tokenized_raw_text], batch_first=True, padding_value=0.0)
+            seq_lens = torch.tensor([len(text) for text in batch_tokenized_raw_text])
+            return {'layer_outputs': batch_layer_outputs, 
+                    'mask': seq_lens2mask(seq_lens, max_len=batch_layer_outputs.size(1))}
+        
         return {'char_ids': allennlp.modules.elmo.batch_to_ids(batch_tokenized_raw_text)}
         
     def instantiate(self):
@@ -98,7 +145,15 @@ class ELMoEmbedder(torch.nn.Module):
         self.elmo._elmo_lstm.requires_grad_(not freeze)
         
         
-    def forward(self, char_ids: torch.LongTensor):
+    def forward(self, char_ids: torch.LongTensor=None, layer_outputs: torch.Tensor=None, mask: torch.BoolTensor=None):
+        if layer_outputs is not None:
+            # The outputs of the frozen ELMo layers are pre-computed; only the layer mixing runs here
+            # NOTE: The sentence boundaries are excluded in the mask, which only matters if `do_layer_norm` is True
+            assert self.freeze, "The cached ELMo representations require a frozen ELMo"
+            layer_outputs = layer_outputs.to(self.elmo.scalar_mix_0.gamma.dtype)
+            mixed = self.elmo.scalar_mix_0(list(layer_outputs.unbind(dim=2)), ~mask)
+            return self.elmo._dropout(mixed)
+        
         # TODO: use `word_inputs`?
         elmo_outs = self.elmo(inputs=char_ids)
         
@@ -43,6 +43,8 @@ class EncoderConfig(Config):
             elif self.arch.lower() == 'transformer':
                 self.use_emb2init_hid = kwargs.pop('use_emb2init_hid', False)
                 self.num_heads = kwargs.pop('num_heads', 8)
+                # Attention implementation: `naive`, `sdpa` or `chunked`
+                self.atten_backend = kwargs.pop('atten_backend', 'naive')
                 self.ff_dim = kwargs.pop('ff_dim', 256)
                 self.num_layers = kwargs.pop('num_layers', 3)
                 self.in_drop_rates = kwargs.pop('in_drop_rates', (0.1, 0.0, 0.0))
@@ -302,7 +304,8 @@ class TransformerEncoder(Encoder):
                                      ff_dim=config.ff_dim, 
                                      num_heads=config.num_heads, 
                                      drop_rate=(0.0 if (k==0 and not config.use_emb2init_hid) else config.hid_drop_rate), 
-                                     nonlinearity='relu') for k in range(config.num_layers)]
+                                     nonlinearity='relu', 
+                                     atten_backend=getattr(config, 'atten_backend', 'naive')) for k in range(config.num_layers)]
         )
         
     def embedded2hidden(self, embedded: torch.FloatTensor, mask: torch.BoolTensor=None):
@@ -6,6 +6,7 @@ import flair
 from ..token import TokenSequence
 from ..nn.modules import SequenceGroupAggregating
 from ..config import Config
+from .representations_store import TokenRepresentationsStore, _module_fingerprint
 
 
 class FlairConfig(Config):
@@ -28,9 +29,19 @@ class FlairConfig(Config):
         self.agg_mode = kwargs.pop('agg_mode', 'last')
         self.use_gamma = kwargs.pop('use_gamma', False)
         
+        # Opt-in: pre-compute the aggregated outputs of the frozen language model into a memory-mapped store at `cache_path`, 
+        # so that the language model does not run in training
+        self.cache_path = kwargs.pop('cache_path', None)
+        self.cache_dtype = kwargs.pop('cache_dtype', 'float32')
+        self.cache = None
+        
         super().__init__(**kwargs)
         
         
+    @property
+    def valid(self):
+        return all(attr is not None for name, attr in self.__dict__.items() if name not in ('cache_path', 'cache'))
+        
     @property
     def name(self):
         return self.arch
@@ -41,8 +52,47 @@ class FlairConfig(Config):
         return state
         
         
+    def build_representations_cache(self, *partitions, batch_size: int=32):
+        """Run the frozen language model over `partitions` once, and store the aggregated representations 
+        for each token. The store is built only if not existing at `cache_path`. 
+        
+        NOTE: The representations are computed in the evaluation mode, i.e., without the dropout inside the language model. 
+        """
+        assert self.freeze, "The cached flair representations require a frozen language model"
+        meta = {'arch': self.arch, 
+                'model': _module_fingerprint(self.flair_lm), 
+                'is_forward': self.is_forward, 
+                'agg_mode': self.agg_mode, 
+                'boundaries': [self.sos, self.eos, self.sep]}
+        self.cache = TokenRepresentationsStore(self.cache_path, dtype=self.cache_dtype, meta=meta)
+        if not self.cache.exists:
+            tokenized_texts = [entry['tokens'].raw_text for data in partitions for entry in data]
+            self.cache.build(tokenized_texts, self._compute_flair_hidden, batch_size=batch_size)
+        self.cache.load()
+        
+    @torch.no_grad()
+    def _compute_flair_hidden(self, batch_tokenized_raw_text: List[List[str]]):
+        batch = self._batchify_char_ids([self._exemplify_char_ids(text) for text in batch_tokenized_raw_text])
+        device = next(self.flair_lm.parameters()).device
+        
+        was_training = self.flair_lm.training
+        self.flair_lm.eval()
+        # flair_hidden: (char_step, batch, hid_dim)
+        _, flair_hidden, _ = self.flair_lm(batch['char_ids'].to(device), hidden=None)
+        self.flair_lm.train(was_training)
+        
+        # agg_flair_hidden: (batch, tok_step, hid_dim)
+        agg_flair_hidden = SequenceGroupAggregating(mode=self.agg_mode)(flair_hidden.permute(1, 0, 2), batch['ori_indexes'].to(device))
+        return [curr_hidden[:len(text)] for curr_hidden, text in zip(agg_flair_hidden, batch_tokenized_raw_text)]
+        
+        
     def exemplify(self, tokens: TokenSequence):
-        tokenized_raw_text = tokens.raw_text
+        example = self._exemplify_char_ids(tokens.raw_text)
+        if self.cache is not None:
+            example['tokenized_raw_text'] = tokens.raw_text
+        return example
+        
+    def _exemplify_char_ids(self, tokenized_raw_text: List[str]):
         if not self.is_forward:
             tokenized_raw_text = [tok[::-1] for tok in tokenized_raw_text[::-1]]
         
@@ -60,6 +110,14 @@ class FlairConfig(Config):
         
         
     def batchify(self, batch_ex: List[dict]):
+        if self.cache is not None and all('tokenized_raw_text' in ex and ex['tokenized_raw_text'] in self.cache for ex in batch_ex):
+            # flair_hidden: (batch, tok_step, hid_dim)
+            batch_flair_hidden = [self.cache[ex['tokenized_raw_text']] for ex in batch_ex]
+            return {'flair_hidden': torch.nn.utils.rnn.pad_sequence(batch_flair_hidden, batch_first=True, padding_value=0.0)}
+        
+        return self._batchify_char_ids(batch_ex)
+        
+    def _batchify_char_ids(self, batch_ex: List[dict]):
         batch_char_ids = [ex['char_ids'] for ex in batch_ex]
         batch_ori_indexes = [ex['ori_indexes'] for ex in batch_ex]
         
@@ -111,11 +169,16 @@ class FlairEmbedder(torch.nn.Module):
         self._freeze = freeze
         self.flair_lm.requires_grad_(not freeze)
         
-    def forward(self, char_ids: torch.LongTensor, ori_indexes: torch.LongTensor):
-        # flair_hidden: (char_step, batch, hid_dim)
-        _, flair_hidden, _ = self.flair_lm(char_ids, hidden=None)
-        # agg_flair_hidden: (batch, tok_step, hid_dim)
-        agg_flair_hidden = self.group_aggregating(flair_hidden.permute(1, 0, 2), ori_indexes)
+    def forward(self, char_ids: torch.LongTensor=None, ori_indexes: torch.LongTensor=None, flair_hidden: torch.Tensor=None):
+        if flair_hidden is not None:
+            # The aggregated outputs of the frozen language model are pre-computed
+            assert self.freeze, "The cached flair representations require a frozen language model"
+            agg_flair_hidden = flair_hidden.to(next(self.flair_lm.parameters()).dtype)
+        else:
+            # flair_hidden: (char_step, batch, hid_dim)
+            _, flair_hidden, _ = self.flair_lm(char_ids, hidden=None)
+            # agg_flair_hidden: (batch, tok_step, hid_dim)
+            agg_flair_hidden = self.group_aggregating(flair_hidden.permute(1, 0, 2), ori_indexes)
         
         if self.use_gamma:
             return self.gamma * agg_flair_hidden
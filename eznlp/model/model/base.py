@@ -15,6 +15,8 @@ class ModelConfigBase(Config):
       └─embedder
     """
     _all_names = []
+    # Names of the sub-configs whose `exemplify` may be random in training, which should not be cached 
+    _stochastic_names = ['decoder']
     
     @property
     def valid(self):
@@ -71,6 +71,11 @@ class ClassifierConfig(ModelConfigBase):
         return full_hid_dim
         
     def build_vocabs_and_dims(self, *partitions):
+        for name in ['elmo', 'flair_fw', 'flair_bw']:
+            c = getattr(self, name)
+            if c is not None and getattr(c, 'cache_path', None) is not None:
+                c.build_representations_cache(*partitions)
+        
         if self.ohots is not None:
             for c in self.ohots.values():
                 c.build_vocab(*partitions)
@@ -18,6 +18,8 @@ class Image2TextConfig(ModelConfigBase):
     """
     
     _all_names = ['encoder', 'decoder']
+    # `transforms` in the image encoder may include random augmentation
+    _stochastic_names = ['encoder', 'decoder']
     
     def __init__(self, **kwargs):
         self.encoder = kwargs.pop('encoder')
@@ -57,6 +57,8 @@ class SpecificSpanExtractorConfig(ModelConfigBase):
         
         
     def build_vocabs_and_dims(self, *partitions):
+        self.bert_like.build_sub_tokens_cache(*partitions)
+        
         if self.intermediate2 is not None:
             self.intermediate2.in_dim = self.bert_like.out_dim
             self.decoder.in_dim = self.intermediate2.out_dim
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+from typing import List, Callable
+import os
+import json
+import hashlib
+import numpy
+import torch
+
+
+def _module_fingerprint(module: torch.nn.Module):
+    """A stable hash of the parameters and buffers of `module`. 
+    """
+    hasher = hashlib.sha1()
+    for name, tensor in module.state_dict().items():
+        hasher.update(f"{name}{tuple(tensor.size())}".encode())
+        hasher.update(tensor.detach().cpu().numpy().tobytes())
+    return hasher.hexdigest()
+
+
+
+class TokenRepresentationsStore(object):
+    """A memory-mapped store of per-token representations, keyed by tokenized text. 
+    
+    The representations of all distinct sentences are concatenated along the token dimension into 
+    a single `.npy` file, which is memory-mapped when loaded; an index maps each tokenized text to 
+    its offset and length in the file. The metadata (e.g., the model identity and settings producing the 
+    representations) are recorded on building, and checked on loading. 
+    
+    Parameters
+    ----------
+    path: str
+        The directory of the store. 
+    dtype: str
+        The storage data type, e.g., `float32` or `float16`. 
+    meta: dict
+        The JSON-serializable metadata identifying the representations, e.g., the model fingerprint and settings. 
+    """
+    def __init__(self, path: str, dtype: str='float32', meta: dict=None):
+        self.path = path
+        self.dtype = dtype
+        self.meta = {} if meta is None else meta
+        self._index, self._array = None, None
+        
+    @property
+    def _index_path(self):
+        return os.path.join(self.path, "index.json")
+        
+    @property
+    def _array_path(self):
+        return os.path.join(self.path, "representations.npy")
+        
+    @property
+    def _meta_path(self):
+        return os.path.join(self.path, "meta.json")
+        
+    @property
+    def exists(self):
+        return os.path.exists(self._index_path)
+        
+    @staticmethod
+    def _key(tokenized_raw_text: List[str]):
+        return json.dumps(list(tokenized_raw_text), ensure_ascii=False)
+        
+    def build(self, tokenized_texts: List[List[str]], compute_representations: Callable, batch_size: int=32):
+        """Compute and store the representations of the distinct `tokenized_texts`. 
+        
+        Parameters
+        ----------
+        compute_representations: Callable
+            A function mapping a list of tokenized texts to a list of tensors, each of (step, *rep_shape). 
+        """
+        distinct_texts, seen = [], set()
+        for text in tokenized_texts:
+            key = self._key(text)
+            if key not in seen:
+                seen.add(key)
+                distinct_texts.append(list(text))
+        num_tokens = sum(len(text) for text in distinct_texts)
+        
+        os.makedirs(self.path, exist_ok=True)
+        index, array, offset = {}, None, 0
+        for i in range(0, len(distinct_texts), batch_size):
+            batch_texts = distinct_texts[i:i+batch_size]
+            for text, representations in zip(batch_texts, compute_representations(batch_texts)):
+                if array is None:
+                    array = numpy.lib.format.open_memmap(self._array_path, mode='w+', dtype=self.dtype, shape=(num_tokens, *representations.size()[1:]))
+                array[offset:offset+len(text)] = representations.detach().cpu().numpy()
+                index[self._key(text)] = (offset, len(text))
+                offset += len(text)
+        if array is not None:
+            array.flush()
+        
+        with open(self._meta_path, 'w') as f:
+            json.dump({'meta': self.meta, 
+                       'dtype': self.dtype, 
+                       'rep_shape': list(array.shape[1:]) if array is not None else None}, f, ensure_ascii=False)
+        
+        # Write the index at last, marking the store as complete
+        with open(self._index_path, 'w') as f:
+            json.dump(index, f, ensure_ascii=False)
+        
+    def load(self):
+        stored_meta = None
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                stored_meta = json.load(f)
+        # Round-trip the metadata through JSON, so that tuples compare equal to lists
+        expected_meta = {'meta': json.loads(json.dumps(self.meta)), 'dtype': self.dtype}
+        if stored_meta is None or any(stored_meta[key] != value for key, value in expected_meta.items()):
+            raise ValueError(f"The representations store at {self.path} was built with {stored_meta}, "
+                             f"inconsistent with {expected_meta}; specify a different path")
+        self.rep_shape = stored_meta['rep_shape']
+        
+        with open(self._index_path) as f:
+            self._index = json.load(f)
+        self._load_array()
+        if self._array is not None and list(self._array.shape[1:]) != self.rep_shape:
+            raise ValueError(f"The representations at {self._array_path} are of shape {self._array.shape[1:]}, "
+                             f"inconsistent with the recorded {self.rep_shape}")
+        
+    def _load_array(self):
+        if os.path.exists(self._array_path):
+            self._array = numpy.load(self._array_path, mmap_mode='r')
+        
+    def __contains__(self, tokenized_raw_text: List[str]):
+        return self._index is not None and self._key(tokenized_raw_text) in self._index
+        
+    def __getitem__(self, tokenized_raw_text: List[str]):
+        if self._array is None:
+            self._load_array()
+        offset, length = self._index[self._key(tokenized_raw_text)]
+        # Copy out of the read-only memory-map: (step, *rep_shape)
+        return torch.from_numpy(numpy.array(self._array[offset:offset+length]))
+        
+    def __getstate__(self):
+        # The memory-map is re-opened in each process (e.g., `DataLoader` workers)
+        return {**self.__dict__, '_array': None}
+        
+    def __repr__(self):
+        return f"{self.__class__.__name__}(path={self.path}, dtype={self.dtype})"
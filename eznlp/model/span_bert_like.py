@@ -28,6 +28,9 @@ class SpanBertLikeConfig(Config):
         assert (not self.share_weights_ext) or self.share_weights_int
         self.init_agg_mode = kwargs.pop('init_agg_mode', 'max_pooling')
         self.init_drop_rate = kwargs.pop('init_drop_rate', 0.2)
+        # Encode spans of all sizes in a single pass, with the keys/values projected once per layer
+        self.fused = kwargs.pop('fused', False)
+        assert (not self.fused) or self.share_weights_int
         super().__init__(**kwargs)
         
     @property
@@ -83,6 +86,7 @@ class SpanBertLikeEncoder(torch.nn.Module):
         self.max_span_size = config.max_span_size
         self.share_weights_ext = config.share_weights_ext
         self.share_weights_int = config.share_weights_int
+        self.fused = config.fused
         
     @property
     def freeze(self):
@@ -94,9 +98,57 @@ class SpanBertLikeEncoder(torch.nn.Module):
         self.query_bert_like.requires_grad_(not freeze)
         
         
+    def _init_query_states(self, hidden_states: torch.Tensor, k: int):
+        """Initialize the query states of spans of size `k`. 
+        
+        Parameters
+        ----------
+        hidden_states: torch.Tensor
+            (batch, step, hid_dim)
+        
+        Returns
+        -------
+        query_states: torch.Tensor
+            (batch*(step-k+1), 1, hid_dim)
+        """
+        if isinstance(self.init_aggregating, (SequencePooling, SequenceAttention)):
+            # reshaped_states: (B, L, H) -> (B, L-K+1, H, K) -> (B, L-K+1, K, H) -> (B*(L-K+1), K, H)
+            reshaped_states = hidden_states.unfold(dimension=1, size=k, step=1).permute(0, 1, 3, 2).flatten(end_dim=1)
+            # query_states: (B*(L-K+1), 1, H)
+            # query_states = reshaped_states.mean(dim=1, keepdim=True)
+            return self.init_aggregating(self.dropout(reshaped_states)).unsqueeze(1)
+        else:
+            query_states = self.init_aggregating[k-2](self.dropout(hidden_states.permute(0, 2, 1))).permute(0, 2, 1)
+            # query_states: (B, L-K+1, H) -> (B*(L-K+1), 1, H)
+            return query_states.flatten(end_dim=1).unsqueeze(1)
+        
+        
+    def _fused_forward(self, all_hidden_states: List[torch.Tensor]):
+        batch_size, num_steps, hid_dim = all_hidden_states[0].size()
+        span_sizes = list(range(2, min(self.max_span_size, num_steps)+1))
+        if len(span_sizes) == 0:
+            return OrderedDict()
+        
+        # query_states: (B, N, H), where N = \sum_k (L-K+1) spans are packed in the order of span sizes
+        query_states = torch.cat([self._init_query_states(all_hidden_states[0], k).view(batch_size, -1, hid_dim) for k in span_sizes], dim=1)
+        
+        device = all_hidden_states[0].device
+        span_starts = torch.cat([torch.arange(num_steps-k+1, device=device) for k in span_sizes])
+        span_size_mask = torch.cat([torch.arange(span_sizes[-1], device=device).expand(num_steps-k+1, -1) < k for k in span_sizes])
+        
+        query_outs = self.query_bert_like(query_states, all_hidden_states, span_starts=span_starts, span_size_mask=span_size_mask)
+        
+        # query_states: (B, N, H) -> (B, L-K+1, H) for each K
+        all_last_query_states = query_outs['last_query_state'].split([num_steps-k+1 for k in span_sizes], dim=1)
+        return OrderedDict(zip(span_sizes, all_last_query_states))
+        
+        
     def forward(self, all_hidden_states: List[torch.Tensor]):
         # Remove the unused layers of hidden states
         all_hidden_states = all_hidden_states[-(self.num_layers+1):]
+        if self.fused:
+            return self._fused_forward(all_hidden_states)
+        
         batch_size, num_steps, hid_dim = all_hidden_states[0].size()
         
         all_last_query_states = OrderedDict()
@@ -104,15 +156,7 @@ class SpanBertLikeEncoder(torch.nn.Module):
             # reshaped_states: List of (B, L, H) -> (B, L-K+1, H, K) -> (B, L-K+1, K, H) -> (B*(L-K+1), K, H)
             reshaped_states = [hidden_states.unfold(dimension=1, size=k, step=1).permute(0, 1, 3, 2).flatten(end_dim=1) 
                                    for hidden_states in all_hidden_states]
-            
-            if isinstance(self.init_aggregating, (SequencePooling, SequenceAttention)):
-                # query_states: (B*(L-K+1), 1, H)
-                # query_states = reshaped_states[0].mean(dim=1, keepdim=True)
-                query_states = self.init_aggregating(self.dropout(reshaped_states[0])).unsqueeze(1)
-            else:
-                query_states = self.init_aggregating[k-2](self.dropout(all_hidden_states[0].permute(0, 2, 1))).permute(0, 2, 1)
-                # query_states: (B, L-K+1, H) -> (B*(L-K+1), 1, H)
-                query_states = query_states.flatten(end_dim=1).unsqueeze(1)
+            query_states = self._init_query_states(all_hidden_states[0], k)
             
             if self.share_weights_int:
                 query_outs = self.query_bert_like(query_states, reshaped_states)
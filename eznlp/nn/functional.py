@@ -79,6 +79,50 @@ def sequence_pooling(x: torch.FloatTensor,
 
 
 
+def range_pooling(x: torch.FloatTensor, batch_ids: torch.LongTensor, starts: torch.LongTensor, ends: torch.LongTensor, mode: str='mean'):
+    """Pooling values over ranges of steps, i.e., `x[batch_ids[k], starts[k]:ends[k]]` for each `k`. 
+    
+    The ranges are never padded and stacked. Instead, 'mean' pooling uses prefix sums, and 'max'/'min' 
+    pooling uses sparse tables (i.e., range max/min queries over two overlapping power-of-two windows). 
+    
+    Parameters
+    ----------
+    x: torch.FloatTensor (batch, step, hid_dim)
+    batch_ids: torch.LongTensor (num_ranges, )
+    starts: torch.LongTensor (num_ranges, )
+    ends: torch.LongTensor (num_ranges, )
+        The ranges should be non-empty, i.e., `starts < ends`. 
+    mode: str
+        'mean', 'max', 'min'
+    
+    Returns
+    -------
+    pooled: torch.FloatTensor (num_ranges, hid_dim)
+    """
+    if mode.lower() == 'mean':
+        # cum_x: (batch, step+1, hid_dim)
+        cum_x = torch.nn.functional.pad(x.cumsum(dim=1), (0, 0, 1, 0))
+        return (cum_x[batch_ids, ends] - cum_x[batch_ids, starts]) / (ends - starts).unsqueeze(-1)
+    
+    elif mode.lower() in ('max', 'min'):
+        reduce = torch.maximum if mode.lower() == 'max' else torch.minimum
+        num_steps = x.size(1)
+        # table[j][:, i] reduces x[:, i:i+2^j]
+        table = [x]
+        for j in range(1, num_steps.bit_length()):
+            half = 2**(j-1)
+            table.append(reduce(table[-1][:, :-half], table[-1][:, half:]))
+        # table: (num_levels, batch, step, hid_dim)
+        table = torch.stack([torch.nn.functional.pad(t, (0, 0, 0, num_steps-t.size(1))) for t in table])
+        
+        levels = (ends - starts).float().log2().floor().long()
+        return reduce(table[levels, batch_ids, starts], table[levels, batch_ids, ends - 2**levels])
+    
+    else:
+        raise ValueError(f"Invalid pooling mode {mode}")
+
+
+
 def rnn_last_selecting(x: torch.FloatTensor, mask: torch.BoolTensor=None):
     """Selecting the last states of a RNN output. 
     
@@ -119,13 +163,17 @@ def sequence_group_aggregating(x: torch.FloatTensor, group_by: torch.LongTensor,
     
     agg_step = (group_by.max().item() + 1) if agg_step is None else agg_step
     
+    if agg_mode.lower() == 'mean' or hasattr(torch.Tensor, 'scatter_reduce_'):
+        return _scatter_group_aggregating(x, group_by, agg_mode=agg_mode, agg_step=agg_step)
+    
+    # Fallback to the dense projection for `torch` without `scatter_reduce_` (i.e., <1.12)
     # pos_proj: (agg_step, ori_step)
     pos_proj = torch.arange(agg_step, device=group_by.device).unsqueeze(1).expand(-1, group_by.size(1))
     
     # pos_proj: (batch, agg_step, ori_step)
     pos_proj = (pos_proj.unsqueeze(0) == group_by.unsqueeze(1))
     
-    if agg_mode.lower() in ('mean', 'first', 'last'):
+    if agg_mode.lower() in ('first', 'last'):
         pos_proj_weight = _make_pos_proj_weight(pos_proj, agg_mode=agg_mode)
         
         # agg_tensor: (batch, agg_step, hidden)
@@ -135,6 +183,45 @@ def sequence_group_aggregating(x: torch.FloatTensor, group_by: torch.LongTensor,
         return _execute_pos_proj(x, pos_proj, agg_mode=agg_mode)
     
     
+def _scatter_group_aggregating(x: torch.FloatTensor, group_by: torch.LongTensor, agg_mode: str='mean', agg_step: int=None):
+    """Index-based version of `sequence_group_aggregating`, which costs O(ori_step*hidden) 
+    instead of O(agg_step*ori_step*hidden) by the dense projection. 
+    """
+    batch_size, ori_step, hid_dim = x.size()
+    
+    # is_valid: (batch, ori_step)
+    is_valid = (group_by >= 0) & (group_by < agg_step)
+    batch_ids = torch.arange(batch_size, device=group_by.device).unsqueeze(1).expand(-1, ori_step)
+    # agg_ids: (num_valid, ), the flattened after-aggregation positions
+    agg_ids = (batch_ids*agg_step + group_by)[is_valid]
+    # valid_x: (num_valid, hidden)
+    valid_x = x[is_valid]
+    
+    # agg_tensor: (batch*agg_step, hidden)
+    agg_tensor = x.new_zeros(batch_size*agg_step, hid_dim)
+    if agg_mode.lower() == 'mean':
+        agg_tensor = agg_tensor.index_add(0, agg_ids, valid_x)
+        counts = torch.zeros(batch_size*agg_step, dtype=x.dtype, device=x.device).index_add(0, agg_ids, torch.ones_like(agg_ids, dtype=x.dtype))
+        agg_tensor = agg_tensor / counts.clamp(min=1).unsqueeze(-1)
+        
+    elif agg_mode.lower() in ('max', 'min'):
+        # Non-covered positions remain zeros, since `include_self=False`
+        agg_tensor = agg_tensor.scatter_reduce(0, agg_ids.unsqueeze(-1).expand(-1, hid_dim), valid_x, 
+                                               reduce=('amax' if agg_mode.lower() == 'max' else 'amin'), include_self=False)
+        
+    else:
+        # ori_ids: (num_valid, ), the flattened before-aggregation positions
+        ori_ids = (batch_ids*ori_step + torch.arange(ori_step, device=group_by.device))[is_valid]
+        # selected_ids: (batch*agg_step, ); the non-covered positions remain -1
+        selected_ids = torch.full((batch_size*agg_step, ), -1, dtype=torch.long, device=group_by.device)
+        selected_ids = selected_ids.scatter_reduce(0, agg_ids, ori_ids, reduce=('amin' if agg_mode.lower() == 'first' else 'amax'), include_self=False)
+        is_covered = (selected_ids >= 0)
+        agg_tensor[is_covered] = x.reshape(-1, hid_dim)[selected_ids[is_covered]]
+    
+    # agg_tensor: (batch, agg_step, hidden)
+    return agg_tensor.view(batch_size, agg_step, hid_dim)
+    
+    
 def _make_pos_proj_weight(pos_proj: torch.BoolTensor, agg_mode='mean'):
     if agg_mode.lower() == 'mean':
         return torch.nn.functional.normalize(pos_proj.float(), p=1, dim=2)
@@ -31,19 +31,24 @@ def reinit_embedding_by_pretrained_(embedding: torch.nn.Embedding,
     assert embedding.weight.size(1) == vectors.emb_dim
     uniform_range = (3 / embedding.weight.size(1)) ** 0.5
     
-    oov = []
+    # Look up the row indices first, and then gather only the required rows at once 
+    # (i.e., only these rows are read if `vectors` is memory-mapped)
+    pretrained_indices = [vectors.lookup_index(tok) for tok in itos]
+    iv_indices = [idx for idx, pidx in enumerate(pretrained_indices) if pidx is not None]
+    oov_indices = [idx for idx, pidx in enumerate(pretrained_indices) if pidx is None]
+    oov = [itos[idx] for idx in oov_indices]
+    
     acc_vec_abs = 0
-    for idx, tok in enumerate(itos):
-        pretrained_vec = vectors.lookup(tok)
-        if pretrained_vec is not None:
-            acc_vec_abs += pretrained_vec.abs().mean().item()
-            embedding.weight.data[idx].copy_(pretrained_vec)
-        else:
-            oov.append(tok)
-            if oov_init.lower() == 'zeros':
-                torch.nn.init.zeros_(embedding.weight.data[idx])
-            elif oov_init.lower() == 'uniform':
-                torch.nn.init.uniform_(embedding.weight.data[idx], -uniform_range, uniform_range)
+    if len(iv_indices) > 0:
+        pretrained_vecs = vectors.vectors[[pretrained_indices[idx] for idx in iv_indices]].to(embedding.weight.dtype)
+        acc_vec_abs = pretrained_vecs.abs().mean(dim=1).sum().item()
+        embedding.weight.data[iv_indices] = pretrained_vecs.to(embedding.weight.device)
+    
+    if len(oov_indices) > 0:
+        if oov_init.lower() == 'zeros':
+            embedding.weight.data[oov_indices] = 0
+        elif oov_init.lower() == 'uniform':
+            embedding.weight.data[oov_indices] = torch.empty(len(oov_indices), embedding.weight.size(1), device=embedding.weight.device).uniform_(-uniform_range, uniform_range)
     
     if embedding.padding_idx is not None:
         torch.nn.init.zeros_(embedding.weight.data[embedding.padding_idx])
@@ -26,6 +26,13 @@ class SequenceAttention(torch.nn.Module):
         The query sequence.
     key: torch.Tensor (batch, key_step, key_dim)
         The key sequence. 
+    backend: str
+        The implementation for `scoring='scaled_dot'`: 
+        `naive` materializes the scores of all heads; 
+        `sdpa` uses the fused `torch.nn.functional.scaled_dot_product_attention` (if available); 
+        `chunked` computes the attention over chunks of `query_chunk_size` queries, which bounds the memory for long sequences. 
+        In `sdpa` and `chunked`, the heads are split by views and the mask is broadcast over heads, 
+        and the attention weights are computed only if `return_atten_weight` is True. 
     
     References
     ----------
@@ -34,7 +41,8 @@ class SequenceAttention(torch.nn.Module):
     [3] A. Vaswani, et al. 2018. Attention is all you need. 
     """
     def __init__(self, key_dim: int, query_dim: int=None, atten_dim: int=None, num_heads: int=1, 
-                 scoring: str='additive', nonlinearity: str='tanh', drop_rate: float=0.0, external_query: bool=False):
+                 scoring: str='additive', nonlinearity: str='tanh', drop_rate: float=0.0, external_query: bool=False, 
+                 backend: str='naive', query_chunk_size: int=128):
         super().__init__()
         if query_dim is None:
             query_dim = key_dim
@@ -71,6 +79,11 @@ class SequenceAttention(torch.nn.Module):
         else:
             raise ValueError(f"Invalid attention scoring mode {scoring}")
         
+        if backend.lower() not in ('naive', 'sdpa', 'chunked'):
+            raise ValueError(f"Invalid attention backend {backend}")
+        elif backend.lower() != 'naive':
+            assert scoring.lower() == 'scaled_dot', f"Attention backend {backend} only applies to `scaled_dot` scoring"
+        
         self.activation = _nonlinearity2activation(nonlinearity)
         self.dropout = torch.nn.Dropout(drop_rate)
         
@@ -79,6 +92,8 @@ class SequenceAttention(torch.nn.Module):
         self.num_heads = num_heads
         self.scoring = scoring
         self.nonlinearity = nonlinearity
+        self.backend = backend
+        self.query_chunk_size = query_chunk_size
         
         
     def compute_scores(self, query: torch.Tensor, key: torch.Tensor):
@@ -123,6 +138,55 @@ class SequenceAttention(torch.nn.Module):
         return x.view(batch_size, self.num_heads, -1, dim_per_head).permute(0, 2, 1, 3).contiguous().view(batch_size, -1, dim_per_head*self.num_heads)
         
         
+    def _split_heads(self, x: torch.Tensor):
+        assert x.size(-1) % self.num_heads == 0
+        # x: (batch, step, dim) -> (batch, num_heads, step, dim/num_heads), as a view without copying
+        return x.view(x.size(0), x.size(1), self.num_heads, -1).transpose(1, 2)
+        
+        
+    def _scaled_dot_attention(self, x: torch.Tensor, mask: torch.Tensor, query: torch.Tensor, key: torch.Tensor, return_atten_weight: bool=False):
+        # x/key: (batch, key_step, value_dim/key_dim) -> (batch, num_heads, key_step, value_dim/key_dim per head)
+        # query: (batch, query_step, query_dim) -> (batch, num_heads, query_step, query_dim per head)
+        query, key, x = self._split_heads(query), self._split_heads(key), self._split_heads(x)
+        if mask is not None:
+            # mask: (batch, key_step) or (batch, query_step, key_step) -> (batch, 1, 1 or query_step, key_step), broadcast over heads
+            if mask.dim() == 2:
+                mask = mask.unsqueeze(1)
+            assert mask.dim() == 3
+            mask = mask.unsqueeze(1)
+        
+        # Consistent to the `naive` backend, dropout is applied on attention weight only if `mask` is provided
+        drop_rate = self.dropout.p if (self.training and mask is not None) else 0.0
+        
+        backend = getattr(self, 'backend', 'naive')
+        if backend.lower() == 'sdpa' and not return_atten_weight and hasattr(torch.nn.functional, 'scaled_dot_product_attention'):
+            atten_values = torch.nn.functional.scaled_dot_product_attention(query, key, x, attn_mask=None if mask is None else ~mask, dropout_p=drop_rate)
+            atten_weight = None
+        else:
+            query_chunk_size = getattr(self, 'query_chunk_size', 128) if backend.lower() == 'chunked' else query.size(2)
+            atten_values, atten_weight = [], []
+            for chunk_start in range(0, query.size(2), max(query_chunk_size, 1)):
+                chunk_query = query[:, :, chunk_start:chunk_start+query_chunk_size]
+                # chunk_scores: (batch, num_heads, query_chunk_size, key_step)
+                chunk_scores = chunk_query.matmul(key.transpose(-2, -1)) / (query.size(-1) ** 0.5)
+                if mask is not None:
+                    chunk_mask = mask if mask.size(2) == 1 else mask[:, :, chunk_start:chunk_start+query_chunk_size]
+                    chunk_scores = chunk_scores.masked_fill(chunk_mask, float('-inf'))
+                chunk_weight = torch.nn.functional.dropout(torch.nn.functional.softmax(chunk_scores, dim=-1), p=drop_rate, training=self.training)
+                atten_values.append(chunk_weight.matmul(x))
+                if return_atten_weight:
+                    atten_weight.append(chunk_weight)
+            
+            atten_values = torch.cat(atten_values, dim=2)
+            atten_weight = torch.cat(atten_weight, dim=2) if return_atten_weight else None
+        
+        # atten_values: (batch, num_heads, query_step, value_dim per head) -> (batch, query_step, value_dim)
+        atten_values = atten_values.transpose(1, 2).flatten(start_dim=2)
+        if atten_weight is not None and self.num_heads == 1:
+            atten_weight = atten_weight.squeeze(1)
+        return atten_values, atten_weight
+        
+        
     def forward(self, x: torch.Tensor, mask: torch.Tensor=None, query: torch.Tensor=None, key: torch.Tensor=None, return_atten_weight: bool=False):
         if hasattr(self, 'query'):
             assert query is None
@@ -145,6 +209,18 @@ class SequenceAttention(torch.nn.Module):
         # query: (batch, query_step, query_dim)
         # mask: (batch, key_step) or (batch, query_step, key_step)
         
+        # Modules saved before the backends were introduced fall back to the `naive` backend
+        if getattr(self, 'backend', 'naive').lower() != 'naive':
+            atten_values, atten_weight = self._scaled_dot_attention(x, mask, query, key, return_atten_weight=return_atten_weight)
+            if original_query_num_dims <= 2:
+                atten_values = atten_values.squeeze(-2)
+                atten_weight = atten_weight.squeeze(-2) if atten_weight is not None else None
+            
+            if return_atten_weight:
+                return atten_values, atten_weight
+            else:
+                return atten_values
+        
         if self.num_heads > 1:
             query = self._prepare_multiheads(query)
             key   = self._prepare_multiheads(key)
@@ -184,7 +260,7 @@ class SequenceAttention(torch.nn.Module):
         
         
     def __repr__(self):
-        return f"{self.__class__.__name__}(key_dim={self.key_dim}, query_dim={self.query_dim}, num_heads={self.num_heads}, scoring={self.scoring}, nonlinearity={self.nonlinearity})"
+        return f"{self.__class__.__name__}(key_dim={self.key_dim}, query_dim={self.query_dim}, num_heads={self.num_heads}, scoring={self.scoring}, nonlinearity={self.nonlinearity}, backend={getattr(self, 'backend', 'naive')})"
 
 
 
@@ -213,14 +289,22 @@ class MultiheadAttention(torch.nn.Module):
         self.out_affine = torch.nn.Linear(affine_dim, out_dim)
         reinit_layer_(self.out_affine, 'linear')
         
-    def forward(self, query: torch.Tensor, key: torch.Tensor, value: torch.Tensor, mask: torch.Tensor=None, return_atten_weight: bool=False):
+    def project_key_value(self, key: torch.Tensor, value: torch.Tensor):
+        """Project the keys/values, which may be cached for incremental decoding. 
+        """
+        return self.key_affine(key), self.value_affine(value)
+        
+    def forward_projected(self, query: torch.Tensor, KW: torch.Tensor, VW: torch.Tensor, mask: torch.Tensor=None, return_atten_weight: bool=False):
         QW = self.query_affine(query)
-        KW = self.key_affine(key)
-        VW = self.value_affine(value)
         
-        atten_values, atten_weight = self.attention(VW, mask=mask, query=QW, key=KW, return_atten_weight=True)
-        OW = self.out_affine(atten_values)
+        # Request the attention weight only if necessary, which allows the fused backends to skip it
         if return_atten_weight:
-            return OW, atten_weight
+            atten_values, atten_weight = self.attention(VW, mask=mask, query=QW, key=KW, return_atten_weight=True)
+            return self.out_affine(atten_values), atten_weight
         else:
-            return OW
+            atten_values = self.attention(VW, mask=mask, query=QW, key=KW)
+            return self.out_affine(atten_values)
+        
+    def forward(self, query: torch.Tensor, key: torch.Tensor, value: torch.Tensor, mask: torch.Tensor=None, return_atten_weight: bool=False):
+        KW, VW = self.project_key_value(key, value)
+        return self.forward_projected(query, KW, VW, mask=mask, return_atten_weight=return_atten_weight)
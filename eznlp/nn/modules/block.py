@@ -82,9 +82,9 @@ class ConvBlock(torch.nn.Module):
 
 
 class TransformerEncoderBlock(torch.nn.Module):
-    def __init__(self, hid_dim: int, ff_dim: int, num_heads: int=8, scoring: str='scaled_dot', drop_rate: float=0.1, nonlinearity: str='relu'):
+    def __init__(self, hid_dim: int, ff_dim: int, num_heads: int=8, scoring: str='scaled_dot', drop_rate: float=0.1, nonlinearity: str='relu', atten_backend: str='naive'):
         super().__init__()
-        self.self_attention = MultiheadAttention(hid_dim, num_heads=num_heads, scoring=scoring, drop_rate=drop_rate)
+        self.self_attention = MultiheadAttention(hid_dim, num_heads=num_heads, scoring=scoring, drop_rate=drop_rate, backend=atten_backend)
         self.self_norm = torch.nn.LayerNorm(hid_dim)
         
         self.ff1 = torch.nn.Linear(hid_dim, ff_dim)
@@ -99,7 +99,7 @@ class TransformerEncoderBlock(torch.nn.Module):
         
         
     def forward(self, x: torch.Tensor, mask: torch.Tensor=None, return_atten_weight: bool=False):
-        attened, atten_weight = self.self_attention(self.dropout(x), self.dropout(x), self.dropout(x), mask=mask, return_atten_weight=True)
+        attened, atten_weight = _split_atten_outputs(self.self_attention(self.dropout(x), self.dropout(x), self.dropout(x), mask=mask, return_atten_weight=return_atten_weight), return_atten_weight)
         attened_x = self.self_norm(self.dropout(x) + self.dropout(attened))
         
         ffed = self.ff2(self.dropout(self.activation(self.ff1(attened_x))))
@@ -112,12 +112,12 @@ class TransformerEncoderBlock(torch.nn.Module):
 
 
 class TransformerDecoderBlock(torch.nn.Module):
-    def __init__(self, hid_dim: int, ff_dim: int, ctx_dim: int=None, num_heads: int=8, scoring: str='scaled_dot', drop_rate: float=0.1, nonlinearity: str='relu'):
+    def __init__(self, hid_dim: int, ff_dim: int, ctx_dim: int=None, num_heads: int=8, scoring: str='scaled_dot', drop_rate: float=0.1, nonlinearity: str='relu', atten_backend: str='naive'):
         super().__init__()
-        self.self_attention = MultiheadAttention(hid_dim, num_heads=num_heads, scoring=scoring, drop_rate=drop_rate)
+        self.self_attention = MultiheadAttention(hid_dim, num_heads=num_heads, scoring=scoring, drop_rate=drop_rate, backend=atten_backend)
         self.self_norm = torch.nn.LayerNorm(hid_dim)
         
-        self.cross_attention = MultiheadAttention(hid_dim, key_dim=ctx_dim, value_dim=ctx_dim, num_heads=num_heads, scoring=scoring, drop_rate=drop_rate)
+        self.cross_attention = MultiheadAttention(hid_dim, key_dim=ctx_dim, value_dim=ctx_dim, num_heads=num_heads, scoring=scoring, drop_rate=drop_rate, backend=atten_backend)
         self.cross_norm = torch.nn.LayerNorm(hid_dim)
         
         self.ff1 = torch.nn.Linear(hid_dim, ff_dim)
@@ -163,10 +163,10 @@ class TransformerDecoderBlock(torch.nn.Module):
             # trg_mask: (batch, trg_step, trg_step)
             trg_mask = self._get_trg_mask(x.size(1)).expand(x.size(0), -1, -1)
         
-        attened, atten_weight = self.self_attention(self.dropout(xq), self.dropout(x), self.dropout(x), mask=trg_mask, return_atten_weight=True)
+        attened, atten_weight = _split_atten_outputs(self.self_attention(self.dropout(xq), self.dropout(x), self.dropout(x), mask=trg_mask, return_atten_weight=return_atten_weight), return_atten_weight)
         attened_xq = self.self_norm(self.dropout(xq) + self.dropout(attened))
         
-        crossed, cross_atten_weight = self.cross_attention(attened_xq, self.dropout(src_x), self.dropout(src_x), mask=src_mask, return_atten_weight=True)
+        crossed, cross_atten_weight = _split_atten_outputs(self.cross_attention(attened_xq, self.dropout(src_x), self.dropout(src_x), mask=src_mask, return_atten_weight=return_atten_weight), return_atten_weight)
         crossed_attened_xq = self.cross_norm(attened_xq + self.dropout(crossed))
         
         ffed = self.ff2(self.dropout(self.activation(self.ff1(crossed_attened_xq))))
@@ -175,3 +175,72 @@ class TransformerDecoderBlock(torch.nn.Module):
             return ffed_crossed_attened_xq, atten_weight, cross_atten_weight
         else:
             return ffed_crossed_attened_xq
+        
+        
+    def init_cache(self, src_x: torch.Tensor):
+        """Initialize the cache for incremental decoding. 
+        
+        The cross-attention keys/values are computed from `src_x` once, and the self-attention 
+        keys/values are empty and extended by `forward_step` step by step. 
+        
+        In training with dropout, `forward` re-samples the dropout masks on all the previous steps and 
+        `src_x` at each step, which cannot be reused across steps; hence, the inputs of the previous steps 
+        are cached instead, and re-computed by `forward` to keep the training behavior. 
+        """
+        if self.training and self.dropout.p > 0:
+            # x: (batch, trg_step=0, hid_dim)
+            return {'x': src_x.new_zeros(src_x.size(0), 0, self.self_norm.normalized_shape[0]), 'src_x': src_x}
+        
+        # cross_key/cross_value: (batch, src_step, affine_dim)
+        cross_key, cross_value = self.cross_attention.project_key_value(self.dropout(src_x), self.dropout(src_x))
+        # self_key/self_value: (batch, trg_step=0, affine_dim)
+        self_key = cross_key.new_zeros(src_x.size(0), 0, self.self_attention.key_affine.out_features)
+        return {'self_key': self_key, 'self_value': self_key, 'cross_key': cross_key, 'cross_value': cross_value}
+        
+    def forward_step(self, x_t: torch.Tensor, cache: dict, src_mask: torch.Tensor=None, return_atten_weight: bool=False):
+        """Incremental version of `forward(x, src_x, src_mask=src_mask, last_step=True)`, where 
+        `x` is the previous steps (cached in `cache`) concatenated with `x_t`. 
+        
+        Parameters
+        ----------
+        x_t: torch.Tensor (batch, trg_step=1, hid_dim)
+        cache: dict
+            The cache returned by `init_cache` or the last `forward_step`. 
+        """
+        if 'x' in cache:
+            x = torch.cat([cache['x'], x_t], dim=1)
+            outputs = self(x, cache['src_x'], src_mask=src_mask, last_step=True, return_atten_weight=return_atten_weight)
+            cache = {'x': x, 'src_x': cache['src_x']}
+            if return_atten_weight:
+                return outputs[0], cache, *outputs[1:]
+            else:
+                return outputs, cache
+        
+        self_key_t, self_value_t = self.self_attention.project_key_value(self.dropout(x_t), self.dropout(x_t))
+        # self_key/self_value: (batch, trg_step, affine_dim)
+        self_key = torch.cat([cache['self_key'], self_key_t], dim=1)
+        self_value = torch.cat([cache['self_value'], self_value_t], dim=1)
+        
+        attened, atten_weight = _split_atten_outputs(self.self_attention.forward_projected(self.dropout(x_t), self_key, self_value, return_atten_weight=return_atten_weight), return_atten_weight)
+        attened_xq = self.self_norm(self.dropout(x_t) + self.dropout(attened))
+        
+        crossed, cross_atten_weight = _split_atten_outputs(self.cross_attention.forward_projected(attened_xq, cache['cross_key'], cache['cross_value'], mask=src_mask, return_atten_weight=return_atten_weight), return_atten_weight)
+        crossed_attened_xq = self.cross_norm(attened_xq + self.dropout(crossed))
+        
+        ffed = self.ff2(self.dropout(self.activation(self.ff1(crossed_attened_xq))))
+        ffed_crossed_attened_xq = self.ff_norm(crossed_attened_xq + self.dropout(ffed))
+        
+        cache = {'self_key': self_key, 'self_value': self_value, 'cross_key': cache['cross_key'], 'cross_value': cache['cross_value']}
+        if return_atten_weight:
+            return ffed_crossed_attened_xq, cache, atten_weight, cross_atten_weight
+        else:
+            return ffed_crossed_attened_xq, cache
+
+
+
+def _split_atten_outputs(outputs, return_atten_weight: bool):
+    # The attention weight is requested only if it will be returned
+    if return_atten_weight:
+        return outputs
+    else:
+        return outputs, None
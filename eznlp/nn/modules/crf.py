@@ -2,6 +2,26 @@
 import torch
 
 
+def _log_matmul(x: torch.Tensor, y: torch.Tensor):
+    """Matrix product in the log-semiring. 
+    
+    The row maximums of `x` and column maximums of `y` are subtracted before exponentiation, so that 
+    the product is computed by `matmul` in bounded memory, without materializing a (*, i, k, j) tensor. 
+    
+    Parameters
+    ----------
+    x: torch.Tensor (*, i, k)
+    y: torch.Tensor (*, k, j)
+    """
+    # x_max: (*, i, 1); y_max: (*, 1, j)
+    x_max = x.max(dim=-1, keepdim=True).values.detach()
+    y_max = y.max(dim=-2, keepdim=True).values.detach()
+    prod = torch.matmul((x - x_max).exp(), (y - y_max).exp())
+    # Clamp the underflowed products for finite logarithms and gradients
+    return prod.clamp(min=torch.finfo(prod.dtype).tiny).log() + x_max + y_max
+
+
+
 class CRF(torch.nn.Module):
     """Linear-chain conditional random field. 
     
@@ -37,12 +57,19 @@ class CRF(torch.nn.Module):
     mask: torch.BoolTensor
         (step, batch)
     
+    partition_mode: str
+        'sequential': compute the log-partitions step by step; 
+        'scan': compute the log-partitions by a tree reduction over the per-step transition matrices in 
+        the log-semiring, with O(log T) sequential depth (but O(T tag_dim^3) work), preferable for long sequences. 
+    
     References
     ----------
     https://github.com/kmkurn/pytorch-crf
     """
-    def __init__(self, tag_dim: int, pad_idx: int=None, batch_first: bool=True):
+    def __init__(self, tag_dim: int, pad_idx: int=None, batch_first: bool=True, partition_mode: str='sequential'):
         super().__init__()
+        if partition_mode.lower() not in ('sequential', 'scan'):
+            raise ValueError(f"Invalid partition mode {partition_mode}")
         
         self.sos_transitions = torch.nn.Parameter(torch.empty(tag_dim))
         self.transitions = torch.nn.Parameter(torch.empty(tag_dim, tag_dim))
@@ -61,10 +88,11 @@ class CRF(torch.nn.Module):
         self.tag_dim = tag_dim
         self.pad_idx = pad_idx
         self.batch_first = batch_first
+        self.partition_mode = partition_mode
         
         
     def extra_repr(self):
-        return f"tag_dim={self.tag_dim}, pad_idx={self.pad_idx}, batch_first={self.batch_first}"
+        return f"tag_dim={self.tag_dim}, pad_idx={self.pad_idx}, batch_first={self.batch_first}, partition_mode={getattr(self, 'partition_mode', 'sequential')}"
         
         
     def forward(self, emissions: torch.Tensor, tag_ids: torch.LongTensor, mask: torch.BoolTensor):
@@ -77,16 +105,61 @@ class CRF(torch.nn.Module):
             mask      = mask.permute(1, 0)
         
         log_scores = self._compute_log_scores(emissions, tag_ids, mask)
-        log_partitions = self._compute_log_partitions(emissions, mask)
+        if getattr(self, 'partition_mode', 'sequential').lower() == 'scan':
+            log_partitions = self._compute_log_partitions_by_scan(emissions, mask)
+        else:
+            log_partitions = self._compute_log_partitions(emissions, mask)
         return log_partitions - log_scores
         
         
-    def decode(self, emissions: torch.Tensor, mask: torch.BoolTensor):
+    def set_transition_constraints(self, sos_legal: torch.BoolTensor, legal: torch.BoolTensor, eos_legal: torch.BoolTensor):
+        """
+        Set the legal transitions for constrained decoding. The illegal transitions are masked in `decode`, 
+        but do not affect the loss. 
+        
+        Parameters
+        ----------
+        sos_legal: torch.BoolTensor (tag_dim, )
+        legal: torch.BoolTensor (tag_dim, tag_dim)
+            ``legal[i, j]`` indicates whether transitioning from ``i`` to ``j`` is legal. 
+        eos_legal: torch.BoolTensor (tag_dim, )
+        """
+        device = self.transitions.device
+        self.register_buffer('_sos_illegal', ~torch.as_tensor(sos_legal, dtype=torch.bool, device=device))
+        self.register_buffer('_illegal', ~torch.as_tensor(legal, dtype=torch.bool, device=device))
+        self.register_buffer('_eos_illegal', ~torch.as_tensor(eos_legal, dtype=torch.bool, device=device))
+        
+        
+    def decode(self, emissions: torch.Tensor, mask: torch.BoolTensor, nbest: int=1, return_padded: bool=False):
+        """
+        Decode the best paths. 
+        
+        Returns
+        -------
+        If `return_padded` is False: 
+            List of best paths (`nbest` being 1), or list of lists of N-best paths (`nbest` larger than 1). 
+        If `return_padded` is True: 
+            best_paths: torch.LongTensor (batch, step) or (batch, nbest, step)
+            seq_lens: torch.LongTensor (batch, )
+        """
         if self.batch_first:
             emissions = emissions.permute(1, 0, 2)
             mask      = mask.permute(1, 0)
         
-        return self._viterbi_decode(emissions, mask)
+        # best_paths: (batch, nbest, step)
+        best_paths, best_scores, seq_lens = self._viterbi_decode(emissions, mask, nbest=nbest)
+        if nbest == 1:
+            best_paths = best_paths.squeeze(1)
+        
+        if return_padded:
+            return best_paths, seq_lens
+        
+        # Transfer to CPU at once
+        seq_lens = seq_lens.cpu().tolist()
+        if nbest == 1:
+            return [path[:slen] for path, slen in zip(best_paths.cpu().tolist(), seq_lens)]
+        else:
+            return [[path[:slen] for path in paths] for paths, slen in zip(best_paths.cpu().tolist(), seq_lens)]
         
         
     def _compute_log_scores(self, emissions: torch.Tensor, tag_ids: torch.LongTensor, mask: torch.BoolTensor):
@@ -98,14 +171,17 @@ class CRF(torch.nn.Module):
         
         # Note: The first elements are assumed to be NOT masked. 
         # log_scores: (batch, )
-        log_scores = self.sos_transitions[tag_ids[0]] + emissions[0, batch_arange, tag_ids[0]]
+        log_scores = self.sos_transitions[tag_ids[0]]
         
-        for t in range(1, step):
-            # Transition -> Emission
-            next_log_scores = log_scores + self.transitions[tag_ids[t-1], tag_ids[t]] + emissions[t, batch_arange, tag_ids[t]]
-            
-            # Preserve the values where masked. 
-            log_scores = torch.where(mask[t], log_scores, next_log_scores)
+        # Emission scores over all positions
+        # emission_scores: (step, batch)
+        emission_scores = emissions.gather(2, tag_ids.unsqueeze(-1)).squeeze(-1)
+        log_scores = log_scores + emission_scores.masked_fill(mask, 0).sum(dim=0)
+        
+        # Transition scores over all positions
+        # transition_scores: (step-1, batch)
+        transition_scores = self.transitions[tag_ids[:-1], tag_ids[1:]]
+        log_scores = log_scores + transition_scores.masked_fill(mask[1:], 0).sum(dim=0)
         
         log_scores = log_scores + self.eos_transitions[tag_ids[step-1-mask.sum(dim=0), batch_arange]]
         return log_scores
@@ -136,46 +212,117 @@ class CRF(torch.nn.Module):
         return log_partitions
         
         
-    def _viterbi_decode(self, emissions: torch.Tensor, mask: torch.BoolTensor):
+    def _compute_log_partitions_by_scan(self, emissions: torch.Tensor, mask: torch.BoolTensor):
         """
-        Decode the best paths. 
+        Compute the denominator of the conditional probability in log space, by reducing the per-step 
+        transition matrices pairwise in the log-semiring. 
         """
         step, batch_size, tag_dim = emissions.size()
         
         # Note: The first elements are assumed to be NOT masked. 
-        # log_best_scores: (batch, tag_dim)
-        log_best_scores = self.sos_transitions.expand(batch_size, -1) + emissions[0]
-        # history: list of ``indices`` of shape (batch, tag_dim)
-        # In the ``k``-th example of a batch, at timestep ``t``, for each ``j``, 
-        # the best transition is from ``history[t][k, j]`` to ``j``. 
+        # log_partitions: (batch, tag_dim)
+        log_partitions = self.sos_transitions.expand(batch_size, -1) + emissions[0]
+        
+        if step > 1:
+            # The identity matrix in the log-semiring (use a large negative value instead of -inf for stable gradients)
+            log_eye = torch.full((tag_dim, tag_dim), -1e4, device=emissions.device)
+            log_eye.fill_diagonal_(0)
+            
+            # Transition -> Emission
+            # trans_mats: (step-1, batch, tag_dim, tag_dim)
+            trans_mats = self.transitions + emissions[1:].unsqueeze(2)
+            # Masked steps are identity transitions, i.e., preserve the values where masked. 
+            trans_mats = torch.where(mask[1:].view(step-1, batch_size, 1, 1), log_eye, trans_mats)
+            
+            while trans_mats.size(0) > 1:
+                if trans_mats.size(0) % 2 == 1:
+                    trans_mats = torch.cat([trans_mats, log_eye.expand(1, batch_size, -1, -1)], dim=0)
+                trans_mats = _log_matmul(trans_mats[0::2], trans_mats[1::2])
+            
+            # log_partitions: (batch, 1, tag_dim) * (batch, tag_dim, tag_dim) -> (batch, tag_dim)
+            log_partitions = _log_matmul(log_partitions.unsqueeze(1), trans_mats[0]).squeeze(1)
+        
+        # log_partitions: (batch, tag_dim) -> (batch, )
+        log_partitions = (log_partitions + self.eos_transitions).logsumexp(dim=1)
+        return log_partitions
+        
+        
+    def _get_decoding_transitions(self):
+        if hasattr(self, '_illegal'):
+            return (self.sos_transitions.masked_fill(self._sos_illegal, -1e4), 
+                    self.transitions.masked_fill(self._illegal, -1e4), 
+                    self.eos_transitions.masked_fill(self._eos_illegal, -1e4))
+        else:
+            return self.sos_transitions, self.transitions, self.eos_transitions
+        
+        
+    def _viterbi_decode(self, emissions: torch.Tensor, mask: torch.BoolTensor, nbest: int=1):
+        """
+        Decode the (N-)best paths. 
+        
+        Returns
+        -------
+        best_paths: torch.LongTensor (batch, nbest, step)
+            The positions beyond the sequence lengths are padded with 0. 
+        best_scores: torch.Tensor (batch, nbest)
+        seq_lens: torch.LongTensor (batch, )
+        """
+        step, batch_size, tag_dim = emissions.size()
+        sos_transitions, transitions, eos_transitions = self._get_decoding_transitions()
+        
+        # Note: The first elements are assumed to be NOT masked. 
+        # log_best_scores: (batch, tag_dim, nbest)
+        # For each tag at the first timestep, only one path exists; the other `nbest-1` paths are invalid. 
+        log_best_scores = (sos_transitions.expand(batch_size, -1) + emissions[0]).unsqueeze(-1)
+        if nbest > 1:
+            log_best_scores = torch.cat([log_best_scores, log_best_scores.new_full((batch_size, tag_dim, nbest-1), -1e4)], dim=-1)
+        
+        # history: list of ``indices`` of shape (batch, tag_dim, nbest)
+        # In the ``k``-th example of a batch, at timestep ``t``, for each ``j`` and ``n``, the ``n``-th best 
+        # transition to ``j`` is from the ``history[t][k, j, n] % nbest``-th best path ending with tag ``history[t][k, j, n] // nbest``. 
         history = []
         
         for t in range(1, step):
             # Transition -> Emission
-            # log_best_scores: (batch, tag_dim) -> (batch, tag_dim, 1)
-            # emissions[t]: (batch, tag_dim) -> (batch, 1, tag_dim)
-            # next_log_best_scores: (batch, tag_dim, tag_dim) -> (batch, tag_dim)
-            # indices: (batch, tag_dim)
-            next_log_best_scores, indices = (log_best_scores.unsqueeze(2) + self.transitions + emissions[t].unsqueeze(1)).max(dim=1)
+            # log_best_scores: (batch, tag_dim, nbest) -> (batch, tag_dim, nbest, 1)
+            # emissions[t]: (batch, tag_dim) -> (batch, 1, 1, tag_dim)
+            # next_log_best_scores: (batch, tag_dim*nbest, tag_dim) -> (batch, nbest, tag_dim) -> (batch, tag_dim, nbest)
+            # indices: (batch, tag_dim, nbest)
+            next_log_best_scores = (log_best_scores.unsqueeze(-1) + transitions.unsqueeze(1) + emissions[t].view(batch_size, 1, 1, tag_dim)).view(batch_size, tag_dim*nbest, tag_dim)
+            if nbest == 1:
+                next_log_best_scores, indices = next_log_best_scores.max(dim=1, keepdim=True)
+            else:
+                next_log_best_scores, indices = next_log_best_scores.topk(nbest, dim=1)
+            next_log_best_scores, indices = next_log_best_scores.permute(0, 2, 1), indices.permute(0, 2, 1)
             history.append(indices)
             
             # Preserve the values where masked. 
-            log_best_scores = torch.where(mask[t].unsqueeze(-1), log_best_scores, next_log_best_scores)
-            
-        # log_best_scores: (batch, tag_dim) -> (batch, )
-        # last_indices: (batch)
-        log_best_scores, last_indices = (log_best_scores + self.eos_transitions).max(dim=1)
-        
-        # Retrieve the best paths
-        best_paths = []
-        for k in range(batch_size):
-            # the best tag transitioning from to ``<eos>``
-            best_path = [last_indices[k].item()]
-            
-            # retrieve the best path backward
-            for indices in history[:step-1-mask[:, k].sum()][::-1]:
-                best_path.append(indices[k, best_path[-1]].item())
-            
-            # reverse the order of best path
-            best_paths.append(best_path[::-1])
-        return best_paths
+            log_best_scores = torch.where(mask[t].view(-1, 1, 1), log_best_scores, next_log_best_scores)
+        
+        # log_best_scores: (batch, tag_dim, nbest) -> (batch, tag_dim*nbest) -> (batch, nbest)
+        # last_indices: (batch, nbest)
+        log_best_scores = (log_best_scores + eos_transitions.unsqueeze(-1)).view(batch_size, tag_dim*nbest)
+        if nbest == 1:
+            best_scores, last_indices = log_best_scores.max(dim=1, keepdim=True)
+        else:
+            best_scores, last_indices = log_best_scores.topk(nbest, dim=1)
+        
+        # Retrieve the best paths backward, in a batched manner
+        # history: (step-1, batch, tag_dim*nbest)
+        seq_lens = mask.size(0) - mask.sum(dim=0)
+        best_paths = torch.zeros(step, batch_size, nbest, dtype=torch.long, device=emissions.device)
+        curr_indices = last_indices
+        if step > 1:
+            history = torch.stack(history).view(step-1, batch_size, tag_dim*nbest)
+        
+        for t in range(step-1, -1, -1):
+            # Restart the retrieval from the last step of each sequence
+            # curr_indices: (batch, nbest), indicating the tag (and the rank) at timestep ``t``
+            curr_indices = torch.where((seq_lens-1 == t).unsqueeze(-1), last_indices, curr_indices)
+            best_paths[t] = (curr_indices // nbest) if nbest > 1 else curr_indices
+            if t > 0:
+                # (batch, tag_dim*nbest) -> (batch, nbest)
+                curr_indices = history[t-1].gather(1, curr_indices)
+        
+        best_paths.masked_fill_(mask.unsqueeze(-1), 0)
+        return best_paths.permute(1, 2, 0), best_scores, seq_lens
@@ -29,11 +29,59 @@ class QueryBertLikeSelfAttention(torch.nn.Module):
         x = x.view(*new_x_shape)
         return x.permute(0, 2, 1, 3)
         
-    def forward(self, query_states, hidden_states, attention_mask=None, head_mask=None, output_attentions=False):
+    def _band(self, layer, span_starts, band_size: int):
+        """Gather the band of `band_size` steps starting from each of `span_starts`. 
+        
+        Parameters
+        ----------
+        layer: torch.Tensor
+            (batch, head, step, head_size)
+        span_starts: torch.LongTensor
+            (num_spans, )
+        
+        Returns
+        -------
+        band: torch.Tensor
+            (batch, head, num_spans, band_size, head_size)
+        """
+        # (B, NH, L, D) -> (B, NH, L+K-1, D) -> (B, NH, L, D, K) -> (B, NH, N, D, K) -> (B, NH, N, K, D)
+        padded_layer = torch.nn.functional.pad(layer, (0, 0, 0, band_size-1))
+        return padded_layer.unfold(dimension=2, size=band_size, step=1).index_select(2, span_starts).transpose(-1, -2)
+        
+        
+    def forward(self, query_states, hidden_states, attention_mask=None, head_mask=None, output_attentions=False, span_starts=None, span_size_mask=None):
+        """
+        If `span_starts` and `span_size_mask` are provided, the `query_states` are packed queries of spans (of possibly different sizes), 
+        and each query only attends to the steps of its own span, i.e., a banded cross-attention. 
+        
+        Parameters
+        ----------
+        span_starts: torch.LongTensor
+            (num_spans, )
+        span_size_mask: torch.BoolTensor
+            (num_spans, band_size), where `span_size_mask[i, j]` is True if step `span_starts[i]+j` is within span `i`. 
+        """
         query_layer = self.transpose_for_scores(self.query(query_states))
         key_layer = self.transpose_for_scores(self.key(hidden_states))
         value_layer = self.transpose_for_scores(self.value(hidden_states))
         
+        if span_starts is not None:
+            # key_layer/value_layer: (B, NH, N, K, D)
+            key_layer = self._band(key_layer, span_starts, span_size_mask.size(1))
+            value_layer = self._band(value_layer, span_starts, span_size_mask.size(1))
+            
+            # attention_scores: (B, NH, N, K)
+            attention_scores = torch.einsum('bhnd,bhnkd->bhnk', query_layer, key_layer) / math.sqrt(self.attention_head_size)
+            attention_scores = attention_scores.masked_fill(~span_size_mask, torch.finfo(attention_scores.dtype).min)
+            attention_probs = self.dropout(torch.nn.Softmax(dim=-1)(attention_scores))
+            if head_mask is not None:
+                attention_probs = attention_probs * head_mask
+            
+            context_layer = torch.einsum('bhnk,bhnkd->bhnd', attention_probs, value_layer)
+            context_layer = context_layer.permute(0, 2, 1, 3).contiguous()
+            context_layer = context_layer.view(*(context_layer.size()[:-2] + (self.all_head_size,)))
+            return (context_layer, attention_probs) if output_attentions else (context_layer,)
+        
         # Take the dot product between "query" and "key" to get the raw attention scores.
         attention_scores = torch.matmul(query_layer, key_layer.transpose(-1, -2))
         
@@ -129,8 +177,12 @@ class QueryBertLikeEncoder(torch.nn.Module):
                 head_mask=None,
                 output_attentions=False,
                 output_query_states=False, 
-                return_dict=True):
+                return_dict=True, 
+                span_starts=None, 
+                span_size_mask=None):
         assert len(self.layer) + 1 == len(all_hidden_states)
+        # The banded cross-attention (with `span_starts` and `span_size_mask`) does not accept `attention_mask`
+        assert span_starts is None or attention_mask is None
         
         all_query_states = () if output_query_states else None
         all_self_attentions = () if output_attentions else None
@@ -143,7 +195,9 @@ class QueryBertLikeEncoder(torch.nn.Module):
                                          hidden_states, 
                                          attention_mask=attention_mask, 
                                          head_mask=layer_head_mask, 
-                                         output_attentions=output_attentions)
+                                         output_attentions=output_attentions, 
+                                         span_starts=span_starts, 
+                                         span_size_mask=span_size_mask)
             # Update query_states to layer+1
             query_states = layer_outputs[0]
             
@@ -3,6 +3,7 @@ from typing import List, Iterable
 from collections import OrderedDict
 from functools import cached_property
 import string
+import sys
 import re
 import hanziconv
 import spacy
@@ -186,6 +187,32 @@ def _pipeline(*normalizers):
     return pipeline_normalizer
 
 
+def _normalize_text(raw_text: str, pre_text_normalizer=None, 
+                    case_mode='None', number_mode='None', to_half=True, to_zh_simplified=False, 
+                    post_text_normalizer=None):
+    """Normalize the raw text of a token. 
+    
+    Returns
+    -------
+    (raw_text, text): Tuple[str, str]
+        The (possibly pre-normalized) raw text, and the normalized text. 
+    """
+    if callable(pre_text_normalizer):
+        raw_text = pre_text_normalizer(raw_text)
+    
+    pipeline_normalizer = _pipeline(_case_normalizers[case_mode.lower()], 
+                                    _number_normalizers[number_mode.lower()], 
+                                    lambda x: Full2Half.full2half(x) if to_half else x, 
+                                    lambda x: hanziconv.HanziConv.toSimplified(x) if to_zh_simplified else x)
+    text = pipeline_normalizer(raw_text)
+    if callable(post_text_normalizer):
+        text = post_text_normalizer(text)
+    return raw_text, text
+
+
+_normalize_kwarg_names = ['pre_text_normalizer', 'case_mode', 'number_mode', 'to_half', 'to_zh_simplified', 'post_text_normalizer']
+
+
 class Token(object):
     """A token at the modeling level (e.g., word level for English text, or character level for Chinese text). 
     
@@ -202,17 +229,9 @@ class Token(object):
     def __init__(self, raw_text: str, pre_text_normalizer=None, 
                  case_mode='None', number_mode='None', to_half=True, to_zh_simplified=False, 
                  post_text_normalizer=None, **kwargs):
-        self.raw_text = raw_text
-        if callable(pre_text_normalizer):
-            self.raw_text = pre_text_normalizer(self.raw_text)
-        
-        pipeline_normalizer = _pipeline(_case_normalizers[case_mode.lower()], 
-                                        _number_normalizers[number_mode.lower()], 
-                                        lambda x: Full2Half.full2half(x) if to_half else x, 
-                                        lambda x: hanziconv.HanziConv.toSimplified(x) if to_zh_simplified else x)
-        self.text = pipeline_normalizer(self.raw_text)
-        if callable(post_text_normalizer):
-            self.text = post_text_normalizer(self.text)
+        self.raw_text, self.text = _normalize_text(raw_text, pre_text_normalizer=pre_text_normalizer, 
+                                                   case_mode=case_mode, number_mode=number_mode, to_half=to_half, to_zh_simplified=to_zh_simplified, 
+                                                   post_text_normalizer=post_text_normalizer)
         
         for k, v in kwargs.items():
             setattr(self, k, v)
@@ -371,7 +390,7 @@ class TokenSequence(object):
     def build_softwords(self, tokenize_callback, **kwargs):
         self._assert_for_softwords(tokenize_callback)
         
-        self.softword = [numpy.zeros(len(self._softword_idx2tag), dtype=bool) for tok in self.token_list]
+        self.softword = [numpy.zeros(len(self._softword_idx2tag), dtype=bool) for _ in range(len(self))]
         
         for word_text, word_start, word_end in tokenize_callback(self.token_sep.join(self.raw_text), **kwargs):
             if word_end - word_start == 1:
@@ -386,7 +405,7 @@ class TokenSequence(object):
     def build_softlexicons(self, tokenize_callback, **kwargs):
         self._assert_for_softwords(tokenize_callback)
         
-        self.softlexicon = [[[] for t in self._softword_idx2tag] for tok in self.token_list]
+        self.softlexicon = [[[] for t in self._softword_idx2tag] for _ in range(len(self))]
         
         for word_text, word_start, word_end in tokenize_callback(self.token_sep.join(self.raw_text), **kwargs):
             if word_end - word_start == 1:
@@ -416,7 +435,9 @@ class TokenSequence(object):
         
         
     def spans_within_max_length(self, max_len: int):
-        total_len = len(self.token_list)
+        total_len = len(self)
+        # Retrieve the text once, since it may be re-built on each access
+        text = self.text
         slice_start = 0
         
         while True:
@@ -425,10 +446,10 @@ class TokenSequence(object):
                 break
             else:
                 slice_end = slice_start + max_len
-                while not self.token_list[slice_end-1].text in ('.', '?', '!', ';'):
+                while not text[slice_end-1] in ('.', '?', '!', ';'):
                     slice_end -= 1
                     if slice_end <= slice_start:
-                        raise ValueError(f"Cannot find proper slices in {self.token_list[slice_start:slice_start+max_len]}")
+                        raise ValueError(f"Cannot find proper slices in {self[slice_start:slice_start+max_len]}")
                 yield slice(slice_start, slice_end)
                 slice_start = slice_end
         
@@ -458,27 +479,33 @@ class TokenSequence(object):
         
     @classmethod
     def from_tokenized_text(cls, tokenized_text: List[str], additional_tags=None, additional_tok2tags=None, 
-                            token_sep=" ", pad_token="<pad>", none_token="<none>", **kwargs):
+                            token_sep=" ", pad_token="<pad>", none_token="<none>", columnar: bool=False, fields: List[str]=None, **kwargs):
         """Build `TokenSequence` from tokenized text. 
         
         Parameters
         ----------
         tokenized_text: List[str]
             A list of tokenized text. 
+        columnar: bool
+            If True, build a `ColumnarTokenSequence`, with token features in `fields` precomputed. 
         """
         token_lens = [len(tok) for tok in tokenized_text]
         token_starts = [0] + numpy.cumsum(numpy.array(token_lens) + len(token_sep)).tolist()[:-1]
         token_ends = [s+l for s, l in zip(token_starts, token_lens)]
         
-        token_list = [Token(tok_text, start=s, end=e, **kwargs) for tok_text, s, e in zip(tokenized_text, token_starts, token_ends)]
-        tokens = cls(token_list, token_sep=token_sep, pad_token=pad_token, none_token=none_token)
+        if columnar:
+            tokens = ColumnarTokenSequence.from_token_spans(list(zip(tokenized_text, token_starts, token_ends)), fields=fields, 
+                                                            token_sep=token_sep, pad_token=pad_token, none_token=none_token, **kwargs)
+        else:
+            token_list = [Token(tok_text, start=s, end=e, **kwargs) for tok_text, s, e in zip(tokenized_text, token_starts, token_ends)]
+            tokens = cls(token_list, token_sep=token_sep, pad_token=pad_token, none_token=none_token)
         tokens.attach_additional_tags(additional_tags=additional_tags, additional_tok2tags=additional_tok2tags)
         return tokens
         
         
     @classmethod
     def from_raw_text(cls, raw_text: str, tokenize_callback=None, additional_tok2tags=None, 
-                      token_sep=" ", pad_token="<pad>", none_token="<none>", **kwargs):
+                      token_sep=" ", pad_token="<pad>", none_token="<none>", columnar: bool=False, fields: List[str]=None, **kwargs):
         """Build `TokenSequence` from raw text. 
         
         Parameters
@@ -489,28 +516,34 @@ class TokenSequence(object):
             (1) `None`, "space": split text by space. 
             (2) "char": split text into characters. 
             (3) spacy.language.Language, jieba.Tokenizer.cut, jieba.Tokenizer.tokenize: split text by given tokenize method. 
+        columnar: bool
+            If True, build a `ColumnarTokenSequence`, with token features in `fields` precomputed. 
         """
+        # token_spans: List of (text, start, end), with `start` and `end` being None if unavailable
         if tokenize_callback is None or (isinstance(tokenize_callback, str) and tokenize_callback.lower().startswith('space')):
-            # token_list = [Token(tok_text, **kwargs) for tok_text in raw_text.split()]
             space_spans = [space.span() for space in re.finditer("\s+", raw_text)]
-            token_spans = [(s, e) for s, e in zip([0] + [s[1] for s in space_spans], 
-                                                  [s[0] for s in space_spans] + [len(raw_text)]) if s<e]
-            token_list = [Token(raw_text[s:e], start=s, end=e, **kwargs) for s, e in token_spans]
+            token_spans = [(raw_text[s:e], s, e) for s, e in zip([0] + [s[1] for s in space_spans], 
+                                                                 [s[0] for s in space_spans] + [len(raw_text)]) if s<e]
         elif isinstance(tokenize_callback, str) and tokenize_callback.lower().startswith('char'):
-            token_list = [Token(tok_text, start=k, end=k+1, **kwargs) for k, tok_text in enumerate(raw_text)]
+            token_spans = [(tok_text, k, k+1) for k, tok_text in enumerate(raw_text)]
         elif isinstance(tokenize_callback, spacy.language.Language):
-            token_list = [Token(tok.text, start=tok.idx, end=tok.idx+len(tok.text), **kwargs) for tok in tokenize_callback(raw_text)]
+            token_spans = [(tok.text, tok.idx, tok.idx+len(tok.text)) for tok in tokenize_callback(raw_text)]
         elif hasattr(tokenize_callback, '__self__') and isinstance(tokenize_callback.__self__, jieba.Tokenizer):
             if tokenize_callback.__name__.startswith('tokenize'):
-                token_list = [Token(tok_text, start=tok_start, end=tok_end, **kwargs) for tok_text, tok_start, tok_end in tokenize_callback(raw_text)]
+                token_spans = [(tok_text, tok_start, tok_end) for tok_text, tok_start, tok_end in tokenize_callback(raw_text)]
             elif tokenize_callback.__name__.startswith('cut'):
-                token_list = [Token(tok_text, **kwargs) for tok_text in tokenize_callback(raw_text)]
+                token_spans = [(tok_text, None, None) for tok_text in tokenize_callback(raw_text)]
             else:
                 raise ValueError(f"Invalid method of `jieba.Tokenizer`: {tokenize_callback}")
         else:
             raise ValueError(f"Invalid `tokenize_callback`: {tokenize_callback}")
         
-        tokens = cls(token_list, token_sep=token_sep, pad_token=pad_token, none_token=none_token)
+        if columnar:
+            tokens = ColumnarTokenSequence.from_token_spans(token_spans, fields=fields, 
+                                                            token_sep=token_sep, pad_token=pad_token, none_token=none_token, **kwargs)
+        else:
+            token_list = [Token(tok_text, **kwargs) if s is None else Token(tok_text, start=s, end=e, **kwargs) for tok_text, s, e in token_spans]
+            tokens = cls(token_list, token_sep=token_sep, pad_token=pad_token, none_token=none_token)
         tokens.attach_additional_tags(additional_tok2tags=additional_tok2tags)
         return tokens
         
@@ -527,6 +560,226 @@ class TokenSequence(object):
 
 
 
+# The token features computable from `raw_text`, i.e., the properties of `Token`
+_token_feature_names = [name for name, attr in vars(Token).items() if isinstance(attr, property)]
+
+def _compute_token_features(raw_texts: List[str], name: str):
+    """Compute a token feature for a list of raw texts, once for each distinct raw text. 
+    """
+    tok = Token.__new__(Token)
+    feature_dict = {}
+    for raw_text in set(raw_texts):
+        tok.raw_text = raw_text
+        feature_dict[raw_text] = getattr(tok, name)
+    
+    if name == 'en_shape_features':
+        # Boolean features are stored as a (num_tokens, num_features) array
+        if len(raw_texts) == 0:
+            return numpy.zeros((0, len(Token._en_shape_feature_names)), dtype=bool)
+        return numpy.stack([feature_dict[raw_text] for raw_text in raw_texts])
+    else:
+        return [feature_dict[raw_text] for raw_text in raw_texts]
+
+
+
+def _columns_equal(column, other_column):
+    if len(column) != len(other_column):
+        return False
+    return all(numpy.array_equal(x, y) if isinstance(x, numpy.ndarray) else x == y for x, y in zip(column, other_column))
+
+
+
+class ColumnarTokenSequence(TokenSequence):
+    """A token sequence storing each token attribute as a column (i.e., a list or an array over all tokens), 
+    instead of a list of `Token` objects. The columns are accessed in the same way as `TokenSequence`, 
+    without re-building lists on each access. 
+    
+    The token features (e.g., `en_pattern`, `prefix_3`) requested in `fields` are computed on construction, 
+    once for each distinct raw text; the other features are computed and cached on the first access. 
+    Strings are interned, so that repeated tokens share memory. 
+    
+    Notes
+    -----
+    `token_list` and integer subscripts create `Token` objects on the fly; modifying these objects 
+    does NOT modify this sequence. 
+    """
+    def __init__(self, columns: dict, token_sep=" ", pad_token="<pad>", none_token="<none>"):
+        assert 'raw_text' in columns and 'text' in columns
+        self._column_names = []
+        self.token_sep = token_sep
+        self.pad_token = pad_token
+        self.none_token = none_token
+        assert len(self.token_sep) <= 1
+        
+        for name, column in columns.items():
+            self._set_column(name, column)
+        
+        
+    def _set_column(self, name: str, column):
+        if not isinstance(column, numpy.ndarray):
+            column = [sys.intern(x) if isinstance(x, str) else x for x in column]
+        if name not in self._column_names:
+            self._column_names.append(name)
+        setattr(self, name, column)
+        
+        
+    def __getattr__(self, name):
+        # NOTE: `__getattr__` is only invoked if the attribute wasn't found the usual ways. 
+        # Hence, the columns already built are directly returned without invoking this method. 
+        if name in _token_feature_names:
+            column = _compute_token_features(self.raw_text, name)
+            self._set_column(name, column)
+            return column
+        else:
+            raise AttributeError(f"{self.__class__.__name__} has no attribute {name}")
+        
+        
+    @property
+    def _data_column_names(self):
+        # The token features are determined by `raw_text`, and may be built or not
+        return [name for name in self._column_names if name not in _token_feature_names]
+        
+    def __eq__(self, other):
+        return (isinstance(other, ColumnarTokenSequence) and 
+                self._tokens_kwargs == other._tokens_kwargs and 
+                set(self._data_column_names) == set(other._data_column_names) and 
+                all(_columns_equal(getattr(self, name), getattr(other, name)) for name in self._data_column_names))
+        
+    def __len__(self):
+        return len(self.raw_text)
+        
+    def __repr__(self):
+        return "[" + ", ".join(self.raw_text) + "]"
+        
+    def __getstate__(self):
+        return self.__dict__.copy()
+        
+        
+    def reset_raw_text(self, raw_text: List[str]):
+        """Replace the `raw_text` column, with the `text` column unchanged. The cached token 
+        features are dropped and will be re-computed on the next access. 
+        """
+        assert len(raw_text) == len(self)
+        self._set_column('raw_text', raw_text)
+        for name in [name for name in self._column_names if name in _token_feature_names]:
+            self._column_names.remove(name)
+            delattr(self, name)
+        
+        
+    @property
+    def token_list(self):
+        return [self[i] for i in range(len(self))]
+        
+    def __getitem__(self, i):
+        if isinstance(i, int):
+            tok = Token.__new__(Token)
+            for name in self._column_names:
+                if name not in _token_feature_names:
+                    setattr(tok, name, getattr(self, name)[i])
+            return tok
+        elif isinstance(i, slice):
+            return ColumnarTokenSequence({name: getattr(self, name)[i] for name in self._column_names}, **self._tokens_kwargs)
+        else:
+            raise TypeError(f"Invalid subscript type of {i}")
+        
+    def __add__(self, other):
+        assert isinstance(other, TokenSequence)
+        assert other._tokens_kwargs == self._tokens_kwargs
+        columns = {}
+        for name in self._column_names:
+            this_column, other_column = getattr(self, name), getattr(other, name)
+            if isinstance(this_column, numpy.ndarray):
+                columns[name] = numpy.concatenate([this_column, numpy.asarray(other_column, dtype=this_column.dtype).reshape(-1, *this_column.shape[1:])])
+            else:
+                columns[name] = this_column + list(other_column)
+        return ColumnarTokenSequence(columns, **self._tokens_kwargs)
+        
+        
+    def build_pseudo_boundaries(self, sep_width: int=None):
+        if sep_width is None:
+            sep_width = len(self.token_sep)
+        
+        token_lens = numpy.array([len(raw_text) for raw_text in self.raw_text], dtype=int)
+        start = numpy.cumsum(token_lens + sep_width) - (token_lens + sep_width)
+        self._set_column('start', start.tolist())
+        self._set_column('end', (start + token_lens).tolist())
+        
+        
+    def build_softwords(self, tokenize_callback, **kwargs):
+        super().build_softwords(tokenize_callback, **kwargs)
+        self._set_column('softword', self.softword)
+        
+        
+    def build_softlexicons(self, tokenize_callback, **kwargs):
+        super().build_softlexicons(tokenize_callback, **kwargs)
+        self._set_column('softlexicon', self.softlexicon)
+        
+        
+    def attach_additional_tags(self, additional_tags: dict=None, additional_tok2tags: list=None):
+        if additional_tags is not None:
+            for tag_name, tags in additional_tags.items():
+                self._set_column(tag_name, list(tags)[:len(self)])
+        
+        if additional_tok2tags is not None:
+            for tag_name, tok2tag in additional_tok2tags:
+                self._set_column(tag_name, [tok2tag.get(text, tok2tag['<unk>']) for text in self.text])
+        
+        return self
+        
+        
+    @classmethod
+    def from_token_spans(cls, token_spans: List[tuple], fields: List[str]=None, 
+                         token_sep=" ", pad_token="<pad>", none_token="<none>", **kwargs):
+        """Build `ColumnarTokenSequence` from token spans. 
+        
+        Parameters
+        ----------
+        token_spans: List[tuple]
+            A list of (raw_text, start, end), with `start` and `end` being None if unavailable. 
+        fields: List[str]
+            The token features to precompute, e.g., `Token._basic_ohot_fields`. 
+        kwargs: 
+            The keyword arguments for text normalization (as those for `Token`), and the other 
+            attributes shared by all tokens. 
+        """
+        normalize_kwargs = {k: kwargs.pop(k) for k in _normalize_kwarg_names if k in kwargs}
+        
+        # Normalize each distinct raw text once
+        normalized = {raw_text: _normalize_text(raw_text, **normalize_kwargs) for raw_text in set(tok_text for tok_text, *_ in token_spans)}
+        columns = {'raw_text': [normalized[tok_text][0] for tok_text, *_ in token_spans], 
+                   'text': [normalized[tok_text][1] for tok_text, *_ in token_spans]}
+        if len(token_spans) > 0 and token_spans[0][1] is not None:
+            columns['start'] = [s for _, s, e in token_spans]
+            columns['end'] = [e for _, s, e in token_spans]
+        
+        for k, v in kwargs.items():
+            columns[k] = [v] * len(token_spans)
+        
+        for name in ([] if fields is None else fields):
+            if name in _token_feature_names:
+                columns[name] = _compute_token_features(columns['raw_text'], name)
+        
+        return cls(columns, token_sep=token_sep, pad_token=pad_token, none_token=none_token)
+        
+        
+    @classmethod
+    def from_token_sequence(cls, tokens: TokenSequence, fields: List[str]=None):
+        """Convert a `TokenSequence` to `ColumnarTokenSequence`. 
+        """
+        columns = {'raw_text': tokens.raw_text, 'text': tokens.text}
+        if len(tokens) > 0:
+            for name in tokens.token_list[0].__dict__:
+                if name not in columns:
+                    columns[name] = getattr(tokens, name)
+        
+        for name in ([] if fields is None else fields):
+            if name in _token_feature_names:
+                columns[name] = _compute_token_features(columns['raw_text'], name)
+        
+        return cls(columns, **tokens._tokens_kwargs)
+
+
+
 class LexiconTokenizer(object):
     def __init__(self, lexicon: Iterable[str], max_len: int=10, return_singleton: bool=False):
         self.lexicon = set(lexicon)
@@ -8,4 +8,4 @@ from .evaluation import (evaluate_text_classification,
                          evaluate_joint_extraction, 
                          evaluate_generation)
 from .options import OptionSampler
-from .utils import auto_device, LRLambda, count_params, collect_params, check_param_groups
+from .utils import auto_device, LRLambda, PhaseTimer, count_params, collect_params, check_param_groups
@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
+import os
 import time
+import random
+import contextlib
 import numpy
 import logging
 import torch
 
 from ..wrapper import Batch
-from ..dataset import Dataset
+from ..dataset import Dataset, LengthBucketBatchSampler
 from ..model.model import ModelBase
+from .utils import PhaseTimer
 
 logger = logging.getLogger(__name__)
 
@@ -15,9 +19,19 @@ class Trainer(object):
     """
     Parameters
     ----------
+    model: ModelBase
+        The model, optionally wrapped by `torch.nn.parallel.DistributedDataParallel` for multi-process 
+        data-parallel training (e.g., with the `gloo` backend on CPUs). In this case, the training loader 
+        should be built with `torch.utils.data.distributed.DistributedSampler`, and the logging, evaluation 
+        and saving are performed on the main rank only. 
     num_grad_acc_steps: int
         The "real" batch size is "nominal" `batch_size` * `num_grad_acc_steps`. 
     
+    Notes
+    -----
+    The losses are accumulated on device and only transferred to host at the logging intervals. 
+    If `timer` (a `PhaseTimer`) is set, the wall-clock time of each training phase is recorded. 
+    
     References
     ----------
     [1] https://pytorch.org/tutorials/recipes/recipes/amp_recipe.html
@@ -33,8 +47,14 @@ class Trainer(object):
                  grad_clip: float=None, 
                  use_amp: bool=False):
         self.model = model
-        if hasattr(self.model, 'decoder'):
-            self.num_metrics = self.model.decoder.num_metrics
+        # The unwrapped model, used for decoding and evaluation
+        if isinstance(model, torch.nn.parallel.DistributedDataParallel):
+            self.module = model.module
+        else:
+            self.module = model
+        
+        if hasattr(self.module, 'decoder'):
+            self.num_metrics = self.module.decoder.num_metrics
         else:
             self.num_metrics = 0
         
@@ -52,6 +72,68 @@ class Trainer(object):
         self.grad_clip = grad_clip
         self.use_amp = use_amp
         self.scaler = torch.cuda.amp.GradScaler(enabled=use_amp)
+        self.timer = None
+        
+        
+    def _phase(self, name: str):
+        if self.timer is None:
+            return contextlib.nullcontext()
+        else:
+            return self.timer.phase(name)
+        
+    @property
+    def is_main_rank(self):
+        return (not _is_distributed()) or torch.distributed.get_rank() == 0
+        
+    def state_dict(self):
+        return {'model': self.module.state_dict(), 
+                'optimizer': self.optimizer.state_dict() if self.optimizer is not None else None, 
+                'scheduler': self.scheduler.state_dict() if self.scheduler is not None else None, 
+                'scaler': self.scaler.state_dict(), 
+                'num_steps': self.num_steps}
+        
+    def load_state_dict(self, state_dict: dict):
+        self.module.load_state_dict(state_dict['model'])
+        if self.optimizer is not None:
+            self.optimizer.load_state_dict(state_dict['optimizer'])
+        if self.scheduler is not None:
+            self.scheduler.load_state_dict(state_dict['scheduler'])
+        self.scaler.load_state_dict(state_dict['scaler'])
+        self.num_steps = state_dict['num_steps']
+        
+        
+    def save_checkpoint(self, path: str, **progress):
+        """Save the full training checkpoint, including the states of model, optimizer, scheduler, 
+        gradient scaler, random number generators, and the training progress. 
+        
+        The checkpoint is first written to a temporary file and then renamed, so that an interrupted 
+        saving does not corrupt the existing checkpoint. 
+        
+        In distributed training, this should be called on all ranks: the random states of each rank are 
+        gathered into the checkpoint, which is written by the main rank only. 
+        """
+        rng_states = _gather_object(_get_rng_states())
+        if self.is_main_rank:
+            checkpoint = {'trainer': self.state_dict(), 'rng_states': rng_states, 'progress': progress}
+            torch.save(checkpoint, f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+        if _is_distributed():
+            # No rank reads the checkpoint before it is completely written
+            torch.distributed.barrier()
+        
+    def load_checkpoint(self, path: str):
+        """Load the full training checkpoint, and return the training progress. 
+        
+        Each rank restores its own random states. 
+        """
+        try:
+            checkpoint = torch.load(path, map_location=self.device, weights_only=False)
+        except TypeError:
+            # Earlier PyTorch without `weights_only`
+            checkpoint = torch.load(path, map_location=self.device)
+        self.load_state_dict(checkpoint['trainer'])
+        _set_rng_states(_rank_entry(checkpoint['rng_states']))
+        return checkpoint['progress']
         
         
     def forward_batch(self, batch: Batch):
@@ -64,13 +146,17 @@ class Trainer(object):
         A scalar Tensor of loss, or
         A Tuple of (loss, y_pred_1, y_pred_2, ...)
         """
-        losses, states = self.model(batch, return_states=True)
-        loss = losses.mean()
+        # Only the training forward goes through the DDP-wrapped model, which synchronizes the gradients
+        model = self.model if self.module.training else self.module
+        with self._phase('forward'):
+            losses, states = model(batch, return_states=True)
+            loss = losses.mean()
         
         if self.num_metrics == 0:
             return loss
         else:
-            return loss, *self.model.decoder._unsqueezed_decode(batch, **states)
+            with self._phase('decode'):
+                return loss, *self.module.decoder._unsqueezed_decode(batch, **states)
         
         
     def backward_batch(self, loss: torch.Tensor):
@@ -91,20 +177,22 @@ class Trainer(object):
         # then no negative pairs can be enumerated. 
         if loss.requires_grad:
             # Backward propagation
-            self.scaler.scale(loss).backward()
+            with self._phase('backward'):
+                self.scaler.scale(loss).backward()
         
         # `optimizer` follows the "real" steps
         self.num_steps += 1
         if self.num_steps % self.num_grad_acc_steps == 0:
-            if self.grad_clip is not None and self.grad_clip > 0:
-                self.scaler.unscale_(self.optimizer)
-                # torch.nn.utils.clip_grad_value_(self.model.parameters(), self.grad_clip)
-                torch.nn.utils.clip_grad_norm_(self.model.parameters(), self.grad_clip)
-            
-            # Update weights
-            self.scaler.step(self.optimizer)
-            self.scaler.update()
-            self.optimizer.zero_grad()
+            with self._phase('optimizer'):
+                if self.grad_clip is not None and self.grad_clip > 0:
+                    self.scaler.unscale_(self.optimizer)
+                    # torch.nn.utils.clip_grad_value_(self.model.parameters(), self.grad_clip)
+                    torch.nn.utils.clip_grad_norm_(self.model.parameters(), self.grad_clip)
+                
+                # Update weights
+                self.scaler.step(self.optimizer)
+                self.scaler.update()
+                self.optimizer.zero_grad()
         
         # `scheduler` follows the "nominal" steps
         # `scheduler.step()` before `optimizer.step()` will raise warnings
@@ -112,12 +200,25 @@ class Trainer(object):
             self.scheduler.step()
         
         
-    def predict(self, dataset: Dataset, batch_size: int=32, beam_size: int=1):
+    def predict(self, dataset: Dataset, batch_size: int=32, beam_size: int=1, length_bucketing: bool=False, max_tokens: int=None):
+        """
+        Parameters
+        ----------
+        length_bucketing: bool
+            If True, batch the examples sorted by length (and restore the original order for predictions). 
+        max_tokens: int
+            The maximum number of padded tokens in a batch, only applicable with `length_bucketing`. 
+        """
         assert self.num_metrics == 1 or beam_size <= 1
         
-        dataloader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=False, collate_fn=dataset.collate)
+        if length_bucketing:
+            batch_sampler = LengthBucketBatchSampler(dataset.seq_lens, batch_size=batch_size, max_tokens=max_tokens, shuffle=False)
+            order = [i for batch_indices in batch_sampler for i in batch_indices]
+            dataloader = torch.utils.data.DataLoader(dataset, batch_sampler=batch_sampler, collate_fn=dataset.collate)
+        else:
+            dataloader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=False, collate_fn=dataset.collate)
         
-        self.model.eval()
+        self.module.eval()
         set_y_pred = [[] for k in range(self.num_metrics)]
         with torch.no_grad():
             for batch in dataloader:
@@ -125,15 +226,19 @@ class Trainer(object):
                 
                 # `dataset` may not have ground-truths, so avoid computing loss here 
                 if beam_size <= 1:
-                    states = self.model.forward2states(batch)
-                    batch_y_pred = self.model.decoder._unsqueezed_decode(batch, **states)
+                    states = self.module.forward2states(batch)
+                    batch_y_pred = self.module.decoder._unsqueezed_decode(batch, **states)
                     for k in range(self.num_metrics):
                         set_y_pred[k].extend(batch_y_pred[k])
                 else:
                     # `num_metrics` must be 1
-                    batch_y_pred = self.model.beam_search(beam_size, batch)
+                    batch_y_pred = self.module.beam_search(beam_size, batch)
                     set_y_pred[0].extend(batch_y_pred)
         
+        if length_bucketing:
+            # Restore the original order
+            set_y_pred = [[y_pred for _, y_pred in sorted(zip(order, y_preds), key=lambda x: x[0])] for y_preds in set_y_pred]
+        
         if self.num_metrics == 1:
             return set_y_pred[0]
         else:
@@ -148,11 +253,12 @@ class Trainer(object):
         """
         self.model.train()
         
-        epoch_losses = []
+        epoch_loss = _RunningLoss()
         epoch_y_gold = [[] for k in range(self.num_metrics)]
         epoch_y_pred = [[] for k in range(self.num_metrics)]
         for batch in dataloader:
-            batch = batch.to(self.device, non_blocking=self.non_blocking)
+            with self._phase('to_device'):
+                batch = batch.to(self.device, non_blocking=self.non_blocking)
             with torch.cuda.amp.autocast(enabled=self.use_amp):
                 loss_with_possible_y_pred = self.forward_batch(batch)
             
@@ -160,26 +266,26 @@ class Trainer(object):
                 loss = loss_with_possible_y_pred
             else:
                 loss, *batch_y_pred = loss_with_possible_y_pred
-                batch_y_gold = self.model.decoder._unsqueezed_retrieve(batch)
+                batch_y_gold = self.module.decoder._unsqueezed_retrieve(batch)
                 
                 for k in range(self.num_metrics):
                     epoch_y_gold[k].extend(batch_y_gold[k])
                     epoch_y_pred[k].extend(batch_y_pred[k])
             
             self.backward_batch(loss)
-            epoch_losses.append(loss.item())
+            epoch_loss.update(loss)
         
         if self.num_metrics == 0:
-            return numpy.mean(epoch_losses)
+            return epoch_loss.mean()
         else:
-            return numpy.mean(epoch_losses), *self.model.decoder._unsqueezed_evaluate(epoch_y_gold, epoch_y_pred)
+            return epoch_loss.mean(), *self.module.decoder._unsqueezed_evaluate(epoch_y_gold, epoch_y_pred)
         
         
         
     def eval_epoch(self, dataloader: torch.utils.data.DataLoader):
-        self.model.eval()
+        self.module.eval()
         
-        epoch_losses = []
+        epoch_loss = _RunningLoss()
         epoch_y_gold = [[] for k in range(self.num_metrics)]
         epoch_y_pred = [[] for k in range(self.num_metrics)]
         with torch.no_grad():
@@ -191,21 +297,79 @@ class Trainer(object):
                     loss = loss_with_possible_y_pred
                 else:
                     loss, *batch_y_pred = loss_with_possible_y_pred
-                    batch_y_gold = self.model.decoder._unsqueezed_retrieve(batch)
+                    batch_y_gold = self.module.decoder._unsqueezed_retrieve(batch)
                     
                     for k in range(self.num_metrics):
                         epoch_y_gold[k].extend(batch_y_gold[k])
                         epoch_y_pred[k].extend(batch_y_pred[k])
                 
-                epoch_losses.append(loss.item())
+                epoch_loss.update(loss)
         
         if self.num_metrics == 0:
-            return numpy.mean(epoch_losses)
+            return epoch_loss.mean()
         else:
-            return numpy.mean(epoch_losses), *self.model.decoder._unsqueezed_evaluate(epoch_y_gold, epoch_y_pred)
+            return epoch_loss.mean(), *self.module.decoder._unsqueezed_evaluate(epoch_y_gold, epoch_y_pred)
     
     
     
+    def profile(self, dataloader: torch.utils.data.DataLoader, num_batches: int=10, trace_path: str=None):
+        """Profile the training on the first `num_batches` batches. 
+        
+        Notes
+        -----
+        The model weights are updated as in training. 
+        
+        Parameters
+        ----------
+        trace_path: str
+            If specified, additionally run with `torch.profiler` and export the Chrome trace to this path. 
+        
+        Returns
+        -------
+        report: dict
+            The wall-clock seconds of each phase (data loading, device transfer, forward, decoding, backward 
+            and optimizer step), the throughput in tokens/sec, and the peak memory in MB. 
+        """
+        self.model.train()
+        self.timer = PhaseTimer(self.device)
+        
+        if trace_path is None:
+            prof_context = contextlib.nullcontext()
+        else:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.device.type.startswith('cuda'):
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            prof_context = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True)
+        
+        try:
+            with prof_context as prof:
+                data_iter = iter(dataloader)
+                for _ in range(num_batches):
+                    with self._phase('data'):
+                        batch = next(data_iter, None)
+                    if batch is None:
+                        break
+                    
+                    with self._phase('to_device'):
+                        batch = batch.to(self.device, non_blocking=self.non_blocking)
+                    if hasattr(batch, 'seq_lens'):
+                        self.timer.add_tokens(batch.seq_lens.sum().item())
+                    
+                    with torch.cuda.amp.autocast(enabled=self.use_amp):
+                        loss_with_possible_y_pred = self.forward_batch(batch)
+                    loss = loss_with_possible_y_pred if self.num_metrics == 0 else loss_with_possible_y_pred[0]
+                    self.backward_batch(loss)
+            
+            if trace_path is not None:
+                prof.export_chrome_trace(trace_path)
+            report = self.timer.report()
+        finally:
+            self.timer = None
+        
+        logger.info("Profiling | " + " | ".join(f"{key}: {value:,.3f}" for key, value in report.items() if value is not None))
+        return report
+        
+        
     def train_steps(self, 
                     train_loader: torch.utils.data.DataLoader, 
                     dev_loader: torch.utils.data.DataLoader=None, 
@@ -214,7 +378,8 @@ class Trainer(object):
                     disp_every_steps: int=None, 
                     eval_every_steps: int=None, 
                     save_callback=None, 
-                    save_by_loss: bool=True):
+                    save_by_loss: bool=True, 
+                    checkpoint_path: str=None):
         """Train model by steps with optionally early-stop. 
 
         Parameters
@@ -235,6 +400,16 @@ class Trainer(object):
             The callback function to save model.
         save_by_loss: bool
             Whether to save by loss or other metrics. The metric must hold that it is better if higher, e.g., accuracy or F1. 
+        checkpoint_path: str
+            The file path to save the full training checkpoint by every `eval_every_steps` steps. 
+            If the file exists, the training automatically resumes from it. 
+        
+        Notes
+        -----
+        When resuming from the middle of an epoch, the data order of this epoch is replayed by restoring the 
+        random states at the epoch start, and the trained batches are skipped. This is exact if the sampler 
+        draws its randomness at the start of an epoch (e.g., `RandomSampler`, `DistributedSampler` and 
+        `LengthBucketBatchSampler`). 
         """
         max_steps = numpy.inf if max_steps is None else max_steps
         disp_every_steps = len(train_loader) if disp_every_steps is None else disp_every_steps
@@ -247,16 +422,49 @@ class Trainer(object):
         best_dev_loss = numpy.inf
         best_dev_metric = -numpy.inf
         
-        train_losses = []
+        train_loss = _RunningLoss()
         train_y_gold = [[] for k in range(self.num_metrics)]
         train_y_pred = [[] for k in range(self.num_metrics)]
         eidx, sidx = 0, 0
+        resuming = False
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            progress = self.load_checkpoint(checkpoint_path)
+            eidx, sidx = progress['eidx'], progress['sidx']
+            epoch_start_sidx, epoch_rng_states = progress['epoch_start_sidx'], _rank_entry(progress['epoch_rng_states'])
+            best_dev_loss, best_dev_metric = progress['best_dev_loss'], progress['best_dev_metric']
+            if self.is_main_rank:
+                logger.info(f"Resume training from {checkpoint_path} at epoch {eidx+1}, step {sidx+1}")
+            if sidx >= max_steps:
+                return
+            if sidx - epoch_start_sidx >= len(train_loader):
+                # The checkpoint is saved at the end of an epoch
+                eidx += 1
+            else:
+                resuming = sidx > epoch_start_sidx
+        
         done_training = False
         t0 = time.time()
         
         while eidx < num_epochs:
-            for batch in train_loader:
-                batch = batch.to(self.device, non_blocking=self.non_blocking)
+            if isinstance(getattr(train_loader, 'sampler', None), torch.utils.data.distributed.DistributedSampler):
+                train_loader.sampler.set_epoch(eidx)
+            
+            if resuming:
+                # Resume from the middle of an epoch, only once right after loading the checkpoint
+                resuming = False
+                ckpt_rng_states = _get_rng_states()
+                _set_rng_states(epoch_rng_states)
+                train_iter = iter(train_loader)
+                for _ in range(sidx - epoch_start_sidx):
+                    next(train_iter)
+                _set_rng_states(ckpt_rng_states)
+            else:
+                epoch_start_sidx, epoch_rng_states = sidx, _get_rng_states()
+                train_iter = iter(train_loader)
+            
+            for batch in train_iter:
+                with self._phase('to_device'):
+                    batch = batch.to(self.device, non_blocking=self.non_blocking)
                 with torch.cuda.amp.autocast(enabled=self.use_amp):
                     loss_with_possible_y_pred = self.forward_batch(batch)
                     
@@ -264,50 +472,56 @@ class Trainer(object):
                     loss = loss_with_possible_y_pred
                 else:
                     loss, *batch_y_pred = loss_with_possible_y_pred
-                    batch_y_gold = self.model.decoder._unsqueezed_retrieve(batch)
+                    batch_y_gold = self.module.decoder._unsqueezed_retrieve(batch)
                     
                     for k in range(self.num_metrics):
                         train_y_gold[k].extend(batch_y_gold[k])
                         train_y_pred[k].extend(batch_y_pred[k])
                     
                 self.backward_batch(loss)
-                train_losses.append(loss.item())
+                train_loss.update(loss)
                 
                 if (sidx+1) % disp_every_steps == 0:
                     elapsed_secs = int(time.time() - t0)
                     lrs = [group['lr'] for group in self.optimizer.param_groups]
-                    disp_running_info(eidx=eidx, sidx=sidx, lrs=lrs, 
-                                      elapsed_secs=elapsed_secs, 
-                                      loss=numpy.mean(train_losses),
-                                      metric=self.model.decoder._unsqueezed_evaluate(train_y_gold, train_y_pred) if self.num_metrics>0 else None,
-                                      partition='train')
-                    train_losses = []
+                    if self.is_main_rank:
+                        disp_running_info(eidx=eidx, sidx=sidx, lrs=lrs, 
+                                          elapsed_secs=elapsed_secs, 
+                                          loss=train_loss.mean(),
+                                          metric=self.module.decoder._unsqueezed_evaluate(train_y_gold, train_y_pred) if self.num_metrics>0 else None,
+                                          partition='train')
+                    train_loss = _RunningLoss()
                     train_y_gold = [[] for k in range(self.num_metrics)]
                     train_y_pred = [[] for k in range(self.num_metrics)]
                     t0 = time.time()
                 
                 if (sidx+1) % eval_every_steps == 0 and dev_loader is not None:
-                    loss_with_possible_metric = self.eval_epoch(dev_loader)
+                    # Evaluate on the main rank, and broadcast the results to keep the schedulers consistent
+                    loss_with_possible_metric = self.eval_epoch(dev_loader) if self.is_main_rank else None
+                    if _is_distributed():
+                        loss_with_possible_metric = _broadcast_object(loss_with_possible_metric)
+                    
                     if self.num_metrics == 0:
                         dev_loss = loss_with_possible_metric
                     else:
                         dev_loss, *dev_metric = loss_with_possible_metric
                     
                     elapsed_secs = int(time.time() - t0)
-                    disp_running_info(elapsed_secs=elapsed_secs, 
-                                      loss=dev_loss, 
-                                      metric=dev_metric if self.num_metrics>0 else None, 
-                                      partition='dev')
+                    if self.is_main_rank:
+                        disp_running_info(elapsed_secs=elapsed_secs, 
+                                          loss=dev_loss, 
+                                          metric=dev_metric if self.num_metrics>0 else None, 
+                                          partition='dev')
                     
                     if dev_loss < best_dev_loss:
                         best_dev_loss = dev_loss
-                        if (save_callback is not None) and save_by_loss:
-                            save_callback(self.model)
+                        if (save_callback is not None) and save_by_loss and self.is_main_rank:
+                            save_callback(self.module)
                     
                     if self.num_metrics > 0 and numpy.mean(dev_metric) > best_dev_metric:
                         best_dev_metric = numpy.mean(dev_metric)
-                        if (save_callback is not None) and (not save_by_loss):
-                            save_callback(self.model)
+                        if (save_callback is not None) and (not save_by_loss) and self.is_main_rank:
+                            save_callback(self.module)
                     
                     if self.scheduler is not None and not self.schedule_by_step:
                         if isinstance(self.scheduler, torch.optim.lr_scheduler.ReduceLROnPlateau):
@@ -326,8 +540,13 @@ class Trainer(object):
                 if (sidx+1) % eval_every_steps == 0 and dev_loader is None:
                     # Always save the model if `dev_loader` is None
                     # Save multiple models by accordlingly defining `save_callback`
-                    if save_callback is not None:
-                        save_callback(self.model)
+                    if save_callback is not None and self.is_main_rank:
+                        save_callback(self.module)
+                
+                if (sidx+1) % eval_every_steps == 0 and checkpoint_path is not None:
+                    self.save_checkpoint(checkpoint_path, eidx=eidx, sidx=sidx+1, 
+                                         epoch_start_sidx=epoch_start_sidx, epoch_rng_states=_gather_object(epoch_rng_states), 
+                                         best_dev_loss=best_dev_loss, best_dev_metric=best_dev_metric)
                 
                 if (sidx+1) >= max_steps:
                     done_training = True
@@ -340,6 +559,74 @@ class Trainer(object):
 
 
 
+class _RunningLoss(object):
+    """Accumulate the losses on device, to avoid a host synchronization per step. 
+    """
+    def __init__(self):
+        self.total = 0.0
+        self.count = 0
+        
+    def update(self, loss: torch.Tensor):
+        self.total = self.total + loss.detach().float()
+        self.count += 1
+        
+    def mean(self):
+        if self.count == 0:
+            return numpy.nan
+        return float(self.total) / self.count
+
+
+
+def _is_distributed():
+    return torch.distributed.is_available() and torch.distributed.is_initialized()
+
+
+def _broadcast_object(obj, src: int=0):
+    obj_list = [obj]
+    torch.distributed.broadcast_object_list(obj_list, src=src)
+    return obj_list[0]
+
+
+def _gather_object(obj):
+    """Gather the objects of all ranks into a list indexed by rank. 
+    """
+    if not _is_distributed():
+        return [obj]
+    obj_list = [None for _ in range(torch.distributed.get_world_size())]
+    torch.distributed.all_gather_object(obj_list, obj)
+    return obj_list
+
+
+def _rank_entry(obj_list):
+    """Pick the entry of the current rank from the gathered objects. 
+    """
+    if isinstance(obj_list, dict):
+        # A checkpoint saved by a single process without gathering
+        return obj_list
+    rank = torch.distributed.get_rank() if _is_distributed() else 0
+    if rank >= len(obj_list):
+        raise ValueError(f"The checkpoint is saved with {len(obj_list)} ranks, but resumed at rank {rank}")
+    return obj_list[rank]
+
+
+def _get_rng_states():
+    rng_states = {'random': random.getstate(), 
+                  'numpy': numpy.random.get_state(), 
+                  'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        rng_states['cuda'] = torch.cuda.get_rng_state_all()
+    return rng_states
+
+
+def _set_rng_states(rng_states: dict):
+    random.setstate(rng_states['random'])
+    numpy.random.set_state(rng_states['numpy'])
+    torch.set_rng_state(rng_states['torch'].cpu())
+    if 'cuda' in rng_states and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all([state.cpu() for state in rng_states['cuda']])
+
+
+
 def disp_running_info(eidx=None, sidx=None, lrs=None, elapsed_secs=None, loss=None, metric=None, partition='train'):
     disp_text = []
     if eidx is not None:
@@ -2,9 +2,16 @@
 from typing import Union, List
 import logging
 import subprocess
+import contextlib
+import time
 import torch
 import numpy
 import matplotlib
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
 
 logger = logging.getLogger(__name__)
 
@@ -163,3 +170,59 @@ def auto_device(min_memory: int=2048):
             logger.info(f"Cuda device `cuda:{selected_id}` with free memory {selected_mem} MiB "
                         f"successfully allocated, device `cuda:{selected_id}` returned")
             return torch.device('cuda', selected_id)
+
+
+
+class PhaseTimer(object):
+    """Wall-clock timer of training phases (e.g., data loading, forward, backward, optimizer step and decoding). 
+    
+    Parameters
+    ----------
+    device: torch.device
+        If on CUDA, the device is synchronized at the phase boundaries for accurate timing. 
+    """
+    def __init__(self, device: torch.device=None):
+        self.device = device
+        self.reset()
+        
+    def reset(self):
+        self.elapsed_secs = {}
+        self.num_tokens = 0
+        if self.device is not None and self.device.type.startswith('cuda'):
+            torch.cuda.reset_peak_memory_stats(self.device)
+        
+    def _synchronize(self):
+        if self.device is not None and self.device.type.startswith('cuda'):
+            torch.cuda.synchronize(self.device)
+        
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        self._synchronize()
+        t0 = time.perf_counter()
+        yield
+        self._synchronize()
+        self.elapsed_secs[name] = self.elapsed_secs.get(name, 0.0) + time.perf_counter() - t0
+        
+    def add_tokens(self, num_tokens: int):
+        self.num_tokens += num_tokens
+        
+    @property
+    def peak_memory(self):
+        """Peak memory in MB; the peak GPU memory allocated on CUDA, or the peak resident set size of this process on CPU. 
+        """
+        if self.device is not None and self.device.type.startswith('cuda'):
+            return torch.cuda.max_memory_allocated(self.device) / 1024**2
+        elif resource is not None:
+            # `ru_maxrss` is in KB on Linux
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        else:
+            return None
+        
+    def report(self):
+        total_secs = sum(self.elapsed_secs.values())
+        report = {f"{name}_secs": secs for name, secs in self.elapsed_secs.items()}
+        report['total_secs'] = total_secs
+        if self.num_tokens > 0 and total_secs > 0:
+            report['tokens_per_sec'] = self.num_tokens / total_secs
+        report['peak_memory_mb'] = self.peak_memory
+        return report
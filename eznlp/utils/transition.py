@@ -1,11 +1,49 @@
 # -*- coding: utf-8 -*-
 from typing import List
-import os
 import re
+import functools
 from collections import Counter
-import pandas
 
 from ..token import zh_char_re, zh_punct_re
+from .transition_tables import TRANSITION_TABLES
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_transitions(scheme: str):
+    """Compile the transition table of `scheme` into integer-indexed tables. 
+    
+    Returns
+    -------
+    idx2tag: List[str]
+        The (type-less) tags, e.g., ['B', 'I', 'O', 'E', 'S']. 
+    trans: dict
+        The mapping from (from_tag, to_tag) to {'legal': int, 'end_of_chunk': int, 'start_of_chunk': int}. 
+    legal, end_of_chunk, start_of_chunk: List[List[bool]]
+        ``legal[i][j]`` indicates whether the transition from tag ``i`` to tag ``j`` is legal. 
+    """
+    sheet_name = 'BIOES' if scheme in ('BMES', 'BILOU') else scheme
+    records = TRANSITION_TABLES[sheet_name]
+    
+    if scheme in ('BMES', 'BILOU'):
+        # Mapping from BIOES to BMES/BILOU
+        if scheme == 'BMES':
+            mapper = {'B': 'B', 'I': 'M', 'O': 'O', 'E': 'E', 'S': 'S'}
+        elif scheme == 'BILOU':
+            mapper = {'B': 'B', 'I': 'I', 'O': 'O', 'E': 'L', 'S': 'U'}
+        records = [(mapper[from_tag], mapper[to_tag], *flags) for from_tag, to_tag, *flags in records]
+    
+    idx2tag = list(dict.fromkeys(from_tag for from_tag, *_ in records))
+    tag2idx = {t: i for i, t in enumerate(idx2tag)}
+    
+    trans = {}
+    legal, end_of_chunk, start_of_chunk = ([[False for _ in idx2tag] for _ in idx2tag] for _ in range(3))
+    for from_tag, to_tag, is_legal, is_end, is_start in records:
+        trans[(from_tag, to_tag)] = {'legal': is_legal, 'end_of_chunk': is_end, 'start_of_chunk': is_start}
+        i, j = tag2idx[from_tag], tag2idx[to_tag]
+        legal[i][j], end_of_chunk[i][j], start_of_chunk[i][j] = bool(is_legal), bool(is_end), bool(is_start)
+    
+    return idx2tag, trans, legal, end_of_chunk, start_of_chunk
+
 
 
 class ChunksTagsTranslator(object):
@@ -27,25 +65,24 @@ class ChunksTagsTranslator(object):
     def __init__(self, scheme='BIOES', sep: str='-', breaking_for_types: bool=True):
         assert scheme in ('BIO1', 'BIO2', 'BIOES', 'BMES', 'BILOU', 'OntoNotes', 'wwm')
         self.scheme = scheme
-        
-        dirname = os.path.dirname(__file__)
-        sheet_name = 'BIOES' if scheme in ('BMES', 'BILOU') else scheme
-        trans = pandas.read_excel(f"{dirname}/transition.xlsx", sheet_name=sheet_name, 
-                                  usecols=['from_tag', 'to_tag', 'legal', 'end_of_chunk', 'start_of_chunk'])
-        
-        if scheme in ('BMES', 'BILOU'):
-            # Mapping from BIOES to BMES/BILOU
-            if scheme == 'BMES':
-                mapper = {'B': 'B', 'I': 'M', 'O': 'O', 'E': 'E', 'S': 'S'}
-            elif scheme == 'BILOU':
-                mapper = {'B': 'B', 'I': 'I', 'O': 'O', 'E': 'L', 'S': 'U'}
-            trans['from_tag'] = trans['from_tag'].map(mapper)
-            trans['to_tag'] = trans['to_tag'].map(mapper)
-            
-        trans = trans.set_index(['from_tag', 'to_tag'])
-        self.trans = {tr: trans.loc[tr].to_dict() for tr in trans.index.tolist()}
         self.sep = sep
         self.breaking_for_types = breaking_for_types
+        self._build_transitions()
+        
+    def _build_transitions(self):
+        # The compiled tables are shared across translators of the same scheme
+        self.idx2base_tag, self.trans, self._legal, self._end_of_chunk, self._start_of_chunk = _compile_transitions(self.scheme)
+        self.base_tag2idx = {t: i for i, t in enumerate(self.idx2base_tag)}
+        # Cache of tag -> (base_tag_id, type), to avoid repeated string splitting
+        self._encoded_tags = {}
+        self._encoded_vocabs = {}
+        
+    def __getstate__(self):
+        return {'scheme': self.scheme, 'sep': self.sep, 'breaking_for_types': self.breaking_for_types}
+        
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._build_transitions()
         
     def __repr__(self):
         return f"{self.__class__.__name__}(scheme={self.scheme})"
@@ -55,8 +92,69 @@ class ChunksTagsTranslator(object):
         """Check if the transitions between tags are legal. 
         """
         # TODO: also check types
-        padded_tags = ['O'] + [tag.split(self.sep, maxsplit=1)[0] for tag in tags] + ['O']
-        return all([self.trans[(prev_tag, this_tag)]['legal'] for prev_tag, this_tag in zip(padded_tags[:-1], padded_tags[1:])])
+        o_id = self.base_tag2idx['O']
+        padded_ids = [o_id] + [self._encode_tag(tag)[0] for tag in tags] + [o_id]
+        return all(self._legal[prev_id][this_id] for prev_id, this_id in zip(padded_ids[:-1], padded_ids[1:]))
+        
+        
+    def _split_tag(self, tag: str):
+        if tag in ('O', '<pad>'):
+            return 'O', 'O'
+        elif self.sep in tag:
+            return tuple(tag.split(self.sep, maxsplit=1))
+        else:
+            # Typically cascade-tags without types
+            return tag, '<pseudo-type>'
+        
+    def _split_ontonotes_tag(self, tag: str):
+        return "".join(re.findall('[\(\*\)]', tag)), re.sub('[\(\*\)]', '', tag)
+        
+    def _encode_tag(self, tag: str):
+        """Encode `tag` into (base_tag_id, type), with cache. 
+        """
+        encoded = self._encoded_tags.get(tag)
+        if encoded is None:
+            if self.scheme == 'OntoNotes':
+                base_tag, tag_type = self._split_ontonotes_tag(tag)
+            else:
+                base_tag, tag_type = self._split_tag(tag)
+            encoded = self._encoded_tags[tag] = (self.base_tag2idx[base_tag], tag_type)
+        return encoded
+        
+        
+    def build_transition_legality(self, idx2tag: List[str]):
+        """Build the legal transitions between tags, e.g., for constrained decoding in CRF. 
+        
+        Returns
+        -------
+        sos_legal: List[bool]
+            ``sos_legal[j]`` indicates whether a sequence can start with tag ``j``. 
+        legal: List[List[bool]]
+            ``legal[i][j]`` indicates whether tag ``i`` can be followed by tag ``j``. 
+        eos_legal: List[bool]
+            ``eos_legal[i]`` indicates whether a sequence can end with tag ``i``. 
+        """
+        if self.scheme == 'OntoNotes':
+            raise ValueError(f"Transition legality is not available for scheme {self.scheme}")
+        
+        split_tags = [self._split_tag(tag) for tag in idx2tag]
+        is_pad = [tag == '<pad>' for tag in idx2tag]
+        
+        sos_legal = [bool(self.trans[('O', this_tag)]['legal']) and not this_pad for (this_tag, _), this_pad in zip(split_tags, is_pad)]
+        eos_legal = [bool(self.trans[(prev_tag, 'O')]['legal']) and not prev_pad for (prev_tag, _), prev_pad in zip(split_tags, is_pad)]
+        
+        legal = []
+        for (prev_tag, prev_type), prev_pad in zip(split_tags, is_pad):
+            curr_legal = []
+            for (this_tag, this_type), this_pad in zip(split_tags, is_pad):
+                this_trans = self.trans[(prev_tag, this_tag)]
+                is_in_chunk = (prev_tag != 'O') and (this_tag != 'O') and (not this_trans['end_of_chunk']) and (not this_trans['start_of_chunk'])
+                # Tags inside a chunk should share the same type
+                is_legal = bool(this_trans['legal']) and not (is_in_chunk and self.breaking_for_types and this_type != prev_type)
+                curr_legal.append(is_legal and not (prev_pad or this_pad))
+            legal.append(curr_legal)
+        
+        return sos_legal, legal, eos_legal
         
         
     def chunks2group_by(self, chunks: List[tuple], seq_len: int):
@@ -138,78 +236,96 @@ class ChunksTagsTranslator(object):
             return type_counter.most_common(1)[0][0]
         
     def tags2chunks(self, tags: List[str]):
+        encoded = [self._encode_tag(tag) for tag in tags]
+        return self._encoded2chunks([base_id for base_id, _ in encoded], [tag_type for _, tag_type in encoded])
+        
+        
+    def tag_ids2chunks(self, tag_ids: List[int], idx2tag: List[str]):
+        """Translate tag ids (indexed by `idx2tag`) to chunks. 
+        
+        The encoding of `idx2tag` is built once and cached, so that decoding requires no string operations on tags. 
+        """
+        vocab_key = tuple(idx2tag)
+        encoded_vocab = self._encoded_vocabs.get(vocab_key)
+        if encoded_vocab is None:
+            pad_tag = '*' if self.scheme == 'OntoNotes' else 'O'
+            encoded = [self._encode_tag(pad_tag if tag == '<pad>' else tag) for tag in idx2tag]
+            encoded_vocab = self._encoded_vocabs[vocab_key] = ([base_id for base_id, _ in encoded], [tag_type for _, tag_type in encoded])
+        
+        vocab_base_ids, vocab_types = encoded_vocab
+        return self._encoded2chunks([vocab_base_ids[i] for i in tag_ids], [vocab_types[i] for i in tag_ids])
+        
+        
+    def _encoded2chunks(self, base_ids: List[int], types: List[str]):
         if self.scheme == 'OntoNotes':
-            return self.ontonotes_tags2chunks(tags)
+            return self._ontonotes_encoded2chunks(base_ids, types)
+        
+        end_of_chunk, start_of_chunk = self._end_of_chunk, self._start_of_chunk
+        o_id = self.base_tag2idx['O']
         
         chunks = []
-        prev_tag, prev_type = 'O', 'O'
+        prev_id, prev_type = o_id, 'O'
         chunk_start, chunk_types = -1, []
         
-        for k, tag in enumerate(tags):
-            if tag in ('O', '<pad>'):
-                this_tag, this_type = 'O', 'O'
-            else:
-                if self.sep in tag:
-                    this_tag, this_type = tag.split(self.sep, maxsplit=1)
-                else:
-                    # Typically cascade-tags without types
-                    this_tag, this_type = tag, '<pseudo-type>'
-                    
-            this_trans = self.trans[(prev_tag, this_tag)]
-            is_in_chunk = (prev_tag != 'O') and (this_tag != 'O') and (not this_trans['end_of_chunk']) and (not this_trans['start_of_chunk'])
+        for k, (this_id, this_type) in enumerate(zip(base_ids, types)):
+            is_end, is_start = end_of_chunk[prev_id][this_id], start_of_chunk[prev_id][this_id]
+            is_in_chunk = (prev_id != o_id) and (this_id != o_id) and (not is_end) and (not is_start)
             
             # Breaking because of different types, is holding only in case of `is_in_chunk` being True. 
             # In such case, the `prev_tag` must be `B` or `I` and 
             #               the `this_tag` must be `I` or `E`. 
             # The breaking operation is equivalent to treating `this_tag` as `B`. 
             if is_in_chunk and self.breaking_for_types and (this_type != prev_type):
-                this_trans = self.trans[(prev_tag, 'B')]
+                b_id = self.base_tag2idx['B']
+                is_end, is_start = end_of_chunk[prev_id][b_id], start_of_chunk[prev_id][b_id]
                 is_in_chunk = False
                 
-            if this_trans['end_of_chunk']:
+            if is_end:
                 chunks.append((self._vote_in_types(chunk_types), chunk_start, k))
                 chunk_types = []
                 
-            if this_trans['start_of_chunk']:
+            if is_start:
                 chunk_start = k
                 chunk_types = [this_type]
                 
             if is_in_chunk:
                 chunk_types.append(this_type)
                 
-            prev_tag, prev_type = this_tag, this_type
+            prev_id, prev_type = this_id, this_type
             
             
-        if prev_tag != 'O':
-            chunks.append((self._vote_in_types(chunk_types), chunk_start, len(tags)))
+        if prev_id != o_id:
+            chunks.append((self._vote_in_types(chunk_types), chunk_start, len(base_ids)))
             
         return chunks
         
         
     def ontonotes_tags2chunks(self, tags: List[str]):
+        encoded = [self._encode_tag(tag) for tag in tags]
+        return self._ontonotes_encoded2chunks([base_id for base_id, _ in encoded], [tag_type for _, tag_type in encoded])
+        
+        
+    def _ontonotes_encoded2chunks(self, base_ids: List[int], types: List[str]):
+        end_of_chunk, start_of_chunk = self._end_of_chunk, self._start_of_chunk
+        
         chunks = []
-        prev_tag = '*)'
+        prev_id = self.base_tag2idx['*)']
         chunk_start, chunk_type = -1, None
         
-        for k, tag in enumerate(tags):
-            this_tag = "".join(re.findall('[\(\*\)]', tag))
-            this_type = re.sub('[\(\*\)]', '', tag)
-            
-            this_trans = self.trans[(prev_tag, this_tag)]
-            
-            if this_trans['end_of_chunk'] and (chunk_type is not None):
+        for k, (this_id, this_type) in enumerate(zip(base_ids, types)):
+            if end_of_chunk[prev_id][this_id] and (chunk_type is not None):
                 chunks.append((chunk_type, chunk_start, k))
                 chunk_type = None
                 
-            if this_trans['start_of_chunk']:
+            if start_of_chunk[prev_id][this_id]:
                 chunk_start = k
                 chunk_type = this_type
                 
-            prev_tag = this_tag
+            prev_id = this_id
             
             
-        if self.trans[(prev_tag, '(*')]['end_of_chunk']:
-            chunks.append((chunk_type, chunk_start, len(tags)))
+        if end_of_chunk[prev_id][self.base_tag2idx['(*']]:
+            chunks.append((chunk_type, chunk_start, len(base_ids)))
             
         return chunks
 
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Transition tables between (type-less) tags, generated from `transition.xlsx`. 
+
+Each record is (from_tag, to_tag, legal, end_of_chunk, start_of_chunk). 
+"""
+TRANSITION_TABLES = {
+    'BIO1': [
+        ('B', 'B', 1, 1, 1), 
+        ('I', 'B', 1, 1, 1), 
+        ('O', 'B', 0, 0, 1), 
+        ('B', 'I', 1, 0, 0), 
+        ('I', 'I', 1, 0, 0), 
+        ('O', 'I', 1, 0, 1), 
+        ('B', 'O', 1, 1, 0), 
+        ('I', 'O', 1, 1, 0), 
+        ('O', 'O', 1, 0, 0), 
+    ], 
+    'BIO2': [
+        ('B', 'B', 1, 1, 1), 
+        ('I', 'B', 1, 1, 1), 
+        ('O', 'B', 1, 0, 1), 
+        ('B', 'I', 1, 0, 0), 
+        ('I', 'I', 1, 0, 0), 
+        ('O', 'I', 0, 0, 1), 
+        ('B', 'O', 1, 1, 0), 
+        ('I', 'O', 1, 1, 0), 
+        ('O', 'O', 1, 0, 0), 
+    ], 
+    'BIOES': [
+        ('B', 'B', 0, 1, 1), 
+        ('I', 'B', 0, 1, 1), 
+        ('O', 'B', 1, 0, 1), 
+        ('E', 'B', 1, 1, 1), 
+        ('S', 'B', 1, 1, 1), 
+        ('B', 'I', 1, 0, 0), 
+        ('I', 'I', 1, 0, 0), 
+        ('O', 'I', 0, 0, 1), 
+        ('E', 'I', 0, 1, 1), 
+        ('S', 'I', 0, 1, 1), 
+        ('B', 'O', 0, 1, 0), 
+        ('I', 'O', 0, 1, 0), 
+        ('O', 'O', 1, 0, 0), 
+        ('E', 'O', 1, 1, 0), 
+        ('S', 'O', 1, 1, 0), 
+        ('B', 'E', 1, 0, 0), 
+        ('I', 'E', 1, 0, 0), 
+        ('O', 'E', 0, 0, 1), 
+        ('E', 'E', 0, 1, 1), 
+        ('S', 'E', 0, 1, 1), 
+        ('B', 'S', 0, 1, 1), 
+        ('I', 'S', 0, 1, 1), 
+        ('O', 'S', 1, 0, 1), 
+        ('E', 'S', 1, 1, 1), 
+        ('S', 'S', 1, 1, 1), 
+    ], 
+    'OntoNotes': [
+        ('(*', '(*', 0, 1, 1), 
+        ('*)', '(*', 1, 1, 1), 
+        ('()', '(*', 1, 1, 1), 
+        ('*', '(*', 1, 0, 1), 
+        ('(*', '*)', 1, 0, 0), 
+        ('*)', '*)', 0, 1, 1), 
+        ('()', '*)', 0, 1, 1), 
+        ('*', '*)', 1, 0, 0), 
+        ('(*', '()', 0, 1, 1), 
+        ('*)', '()', 1, 1, 1), 
+        ('()', '()', 1, 1, 1), 
+        ('*', '()', 1, 0, 1), 
+        ('(*', '*', 1, 0, 0), 
+        ('*)', '*', 1, 1, 0), 
+        ('()', '*', 1, 1, 0), 
+        ('*', '*', 1, 0, 0), 
+    ], 
+    'wwm': [
+        ('ZH', 'ZH', 1, 0, 0), 
+        ('##ZH', 'ZH', 1, 0, 0), 
+        ('EN', 'ZH', 1, 1, 1), 
+        ('##EN', 'ZH', 1, 1, 1), 
+        ('ETC', 'ZH', 1, 1, 1), 
+        ('##ETC', 'ZH', 1, 1, 1), 
+        ('SP', 'ZH', 1, 1, 1), 
+        ('O', 'ZH', 1, 0, 1), 
+        ('ZH', '##ZH', 1, 0, 0), 
+        ('##ZH', '##ZH', 1, 0, 0), 
+        ('EN', '##ZH', 1, 0, 0), 
+        ('##EN', '##ZH', 1, 0, 0), 
+        ('ETC', '##ZH', 1, 0, 0), 
+        ('##ETC', '##ZH', 1, 0, 0), 
+        ('SP', '##ZH', 1, 1, 1), 
+        ('O', '##ZH', 0, 0, 1), 
+        ('ZH', 'EN', 1, 1, 1), 
+        ('##ZH', 'EN', 1, 1, 1), 
+        ('EN', 'EN', 1, 1, 1), 
+        ('##EN', 'EN', 1, 1, 1), 
+        ('ETC', 'EN', 1, 1, 1), 
+        ('##ETC', 'EN', 1, 1, 1), 
+        ('SP', 'EN', 1, 1, 1), 
+        ('O', 'EN', 1, 0, 1), 
+        ('ZH', '##EN', 1, 0, 0), 
+        ('##ZH', '##EN', 1, 0, 0), 
+        ('EN', '##EN', 1, 0, 0), 
+        ('##EN', '##EN', 1, 0, 0), 
+        ('ETC', '##EN', 1, 0, 0), 
+        ('##ETC', '##EN', 1, 0, 0), 
+        ('SP', '##EN', 1, 1, 1), 
+        ('O', '##EN', 0, 0, 1), 
+        ('ZH', 'ETC', 1, 1, 1), 
+        ('##ZH', 'ETC', 1, 1, 1), 
+        ('EN', 'ETC', 1, 1, 1), 
+        ('##EN', 'ETC', 1, 1, 1), 
+        ('ETC', 'ETC', 1, 1, 1), 
+        ('##ETC', 'ETC', 1, 1, 1), 
+        ('SP', 'ETC', 1, 1, 1), 
+        ('O', 'ETC', 1, 0, 1), 
+        ('ZH', '##ETC', 1, 0, 0), 
+        ('##ZH', '##ETC', 1, 0, 0), 
+        ('EN', '##ETC', 1, 0, 0), 
+        ('##EN', '##ETC', 1, 0, 0), 
+        ('ETC', '##ETC', 1, 0, 0), 
+        ('##ETC', '##ETC', 1, 0, 0), 
+        ('SP', '##ETC', 1, 1, 1), 
+        ('O', '##ETC', 0, 0, 1), 
+        ('ZH', 'SP', 1, 1, 1), 
+        ('##ZH', 'SP', 1, 1, 1), 
+        ('EN', 'SP', 1, 1, 1), 
+        ('##EN', 'SP', 1, 1, 1), 
+        ('ETC', 'SP', 1, 1, 1), 
+        ('##ETC', 'SP', 1, 1, 1), 
+        ('SP', 'SP', 1, 1, 1), 
+        ('O', 'SP', 1, 0, 1), 
+        ('ZH', 'O', 1, 1, 0), 
+        ('##ZH', 'O', 1, 1, 0), 
+        ('EN', 'O', 1, 1, 0), 
+        ('##EN', 'O', 1, 1, 0), 
+        ('ETC', 'O', 1, 1, 0), 
+        ('##ETC', 'O', 1, 1, 0), 
+        ('SP', 'O', 1, 1, 0), 
+        ('O', 'O', 0, 0, 0), 
+    ], 
+}
@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 from typing import Union, List
 import os
+import struct
+import itertools
+import functools
+import multiprocessing
 import tqdm
 import logging
+import numpy
 import torch
 
 logger = logging.getLogger(__name__)
@@ -13,53 +18,141 @@ def _parse_line(line: bytes):
     return w, [float(v) for v in vector]
 
 
-def _infer_shape(path: str, skiprows: List[int]):
-    vec_dim = None
-    with open(path, 'rb') as f:
-        for i, line in enumerate(f):
-            if i in skiprows:
-                continue
-            if vec_dim is None:
-                w, vector = _parse_line(line)
-                vec_dim = len(vector)
+def _parse_lines(lines: List[bytes], vec_dim: int, encoding: str, dtype: str):
+    """Parse a chunk of lines into words and a (num_words, vec_dim) array. 
+    """
+    words, vectors, bad_lines = [], [], []
+    for line in lines:
+        try:
+            w, vector = line.rstrip().split(b" ", maxsplit=1)
+            vector = numpy.array(vector.split(b" "), dtype=numpy.float64)
+            assert vector.shape[0] == vec_dim
+            words.append(w.decode(encoding))
+            vectors.append(vector)
+        except KeyboardInterrupt as e:
+            raise e
+        except:
+            bad_lines.append(line.rstrip())
     
-    return i+1, vec_dim
+    vectors = numpy.stack(vectors).astype(dtype) if len(vectors) > 0 else numpy.zeros((0, vec_dim), dtype=dtype)
+    return words, vectors, bad_lines
 
 
-def _load_from_file(path: str, encoding=None, skiprows: Union[int, List[int]]=None, verbose=False):
-    logger.info(f"Loading vectors from {path}")
+def _iter_line_chunks(f, skiprows: List[int], chunk_size: int):
+    chunk = []
+    for i, line in enumerate(f):
+        if i in skiprows or len(line.strip()) == 0:
+            continue
+        chunk.append(line)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def _iter_parsed_chunks(path: str, encoding=None, skiprows: Union[int, List[int]]=None, dtype: str='float32', 
+                        num_workers: int=0, chunk_size: int=10000):
+    """Parse the text file in a single pass; the chunks of lines are parsed in parallel if `num_workers` > 0. 
+    """
+    if encoding is None:
+        encoding = 'utf-8'
     if skiprows is None:
         skiprows = []
     elif isinstance(skiprows, int):
         skiprows = [skiprows]
     assert all(isinstance(row, int) for row in skiprows)
+    skiprows = set(skiprows)
     
-    words, vectors = [], []
-    num_lines, vec_dim = _infer_shape(path, skiprows)
     with open(path, 'rb') as f:
-        num_bad_lines = 0
-        for i, line in tqdm.tqdm(enumerate(f), total=num_lines, disable=not verbose, ncols=100, desc="Loading vectors"):
-            if i in skiprows:
-                continue
-            try:
-                w, vector = _parse_line(line)
-                words.append(w.decode(encoding))
-                assert len(vector) == vec_dim
-                vectors.append(vector)
-            except KeyboardInterrupt as e:
-                raise e
-            except:
-                num_bad_lines += 1
-                logger.warning(f"Bad line detected: {line.rstrip()}")
+        # Infer the vector dimension from the first valid line
+        line_chunks = _iter_line_chunks(f, skiprows, chunk_size)
+        first_chunk = next(line_chunks, [])
+        vec_dim = len(_parse_line(first_chunk[0])[1]) if len(first_chunk) > 0 else 0
+        line_chunks = itertools.chain([first_chunk], line_chunks)
+        
+        parse = functools.partial(_parse_lines, vec_dim=vec_dim, encoding=encoding, dtype=dtype)
+        if num_workers > 0:
+            with multiprocessing.Pool(num_workers) as pool:
+                # `imap` keeps the order of chunks
+                yield from pool.imap(parse, line_chunks)
+        else:
+            yield from map(parse, line_chunks)
+
+
+def _load_from_file(path: str, encoding=None, skiprows: Union[int, List[int]]=None, verbose=False, num_workers: int=0):
+    logger.info(f"Loading vectors from {path}")
+    words, vectors, num_bad_lines = [], [], 0
+    for chunk_words, chunk_vectors, bad_lines in tqdm.tqdm(_iter_parsed_chunks(path, encoding, skiprows, num_workers=num_workers), 
+                                                           disable=not verbose, ncols=100, desc="Loading vectors"):
+        words.extend(chunk_words)
+        vectors.append(chunk_vectors)
+        num_bad_lines += len(bad_lines)
+        for line in bad_lines:
+            logger.warning(f"Bad line detected: {line}")
     
     if num_bad_lines > 0:
         logger.warning(f"Totally {num_bad_lines} bad lines exist and were skipped")
     
-    vectors = torch.tensor(vectors)
+    vectors = torch.from_numpy(numpy.concatenate(vectors))
     return words, vectors
 
 
 
+# The binary format: a header of (magic, version, dtype, voc_dim, emb_dim), followed by a contiguous 
+# (voc_dim, emb_dim) matrix; the words are stored in a separate file, one word per line. 
+_BINARY_MAGIC = b"EZNLPVEC"
+_BINARY_VERSION = 1
+_BINARY_HEADER = struct.Struct("<8sIIQQ")
+_BINARY_DTYPES = ['float32', 'float16']
+
+
+def _write_binary_header(f, dtype: str, voc_dim: int, emb_dim: int):
+    f.seek(0)
+    f.write(_BINARY_HEADER.pack(_BINARY_MAGIC, _BINARY_VERSION, _BINARY_DTYPES.index(dtype), voc_dim, emb_dim))
+
+
+def convert_to_binary(path: str, encoding=None, skiprows: Union[int, List[int]]=None, dtype: str='float32', 
+                      num_workers: int=0, verbose=False):
+    """Convert the text-format vectors to the binary format (`{path}.bin` and `{path}.vocab`), 
+    in a single pass with constant memory. 
+    
+    Parameters
+    ----------
+    dtype: str
+        'float32' or 'float16'. 
+    num_workers: int
+        The number of processes to parse lines. 
+    """
+    if dtype not in _BINARY_DTYPES:
+        raise ValueError(f"Invalid `dtype`: {dtype}")
+    logger.info(f"Converting vectors from {path} to {path}.bin")
+    
+    voc_dim, emb_dim, num_bad_lines = 0, 0, 0
+    with open(f"{path}.bin.tmp", 'wb') as bin_f, open(f"{path}.vocab.tmp", 'w', encoding='utf-8', newline='') as vocab_f:
+        _write_binary_header(bin_f, dtype, 0, 0)
+        for chunk_words, chunk_vectors, bad_lines in tqdm.tqdm(_iter_parsed_chunks(path, encoding, skiprows, dtype=dtype, num_workers=num_workers), 
+                                                               disable=not verbose, ncols=100, desc="Converting vectors"):
+            bin_f.write(numpy.ascontiguousarray(chunk_vectors).tobytes())
+            vocab_f.writelines(f"{w}\n" for w in chunk_words)
+            voc_dim += len(chunk_words)
+            emb_dim = chunk_vectors.shape[1]
+            num_bad_lines += len(bad_lines)
+            for line in bad_lines:
+                logger.warning(f"Bad line detected: {line}")
+        
+        # Write back the header with the final shape
+        _write_binary_header(bin_f, dtype, voc_dim, emb_dim)
+    
+    if num_bad_lines > 0:
+        logger.warning(f"Totally {num_bad_lines} bad lines exist and were skipped")
+    
+    # Rename at last, so that an interrupted conversion never leaves a broken cache
+    os.replace(f"{path}.vocab.tmp", f"{path}.vocab")
+    os.replace(f"{path}.bin.tmp", f"{path}.bin")
+
+
+
 class Vectors(object):
     def __init__(self, itos: List[str], vectors: torch.FloatTensor, unk_init=None):
         if len(itos) != vectors.size(0):
@@ -86,16 +179,8 @@ class Vectors(object):
             return self.unk_init(self.emb_dim)
         
     def lookup(self, token: str):
-        tried_set = set()
-        # Backup tokens
-        for possible_token in [token, token.lower(), token.title(), token.upper()]:
-            if possible_token in tried_set:
-                continue
-            if possible_token in self.stoi:
-                return self.vectors[self.stoi[possible_token]]
-            else:
-                tried_set.add(possible_token)
-        return None
+        idx = self.lookup_index(token)
+        return self.vectors[idx] if idx is not None else None
         
     def __repr__(self):
         return f"{self.__class__.__name__}({self.voc_dim}, {self.emb_dim})"
@@ -111,24 +196,77 @@ class Vectors(object):
     def emb_dim(self):
         return self.vectors.size(1)
         
+    def lookup_index(self, token: str):
+        tried_set = set()
+        # Backup tokens
+        for possible_token in [token, token.lower(), token.title(), token.upper()]:
+            if possible_token in tried_set:
+                continue
+            if possible_token in self.stoi:
+                return self.stoi[possible_token]
+            else:
+                tried_set.add(possible_token)
+        return None
+        
+    def subset(self, tokens: List[str]):
+        """Return the `Vectors` with only the rows required by looking up `tokens`. 
+        
+        This only reads the required rows if `vectors` is memory-mapped. 
+        """
+        indices = sorted({idx for idx in map(self.lookup_index, tokens) if idx is not None})
+        return Vectors([self.itos[idx] for idx in indices], self.vectors[indices].float(), unk_init=self.unk_init)
+        
+    @staticmethod
+    def save_to_binary(path: str, itos: List[str], vectors: torch.FloatTensor, dtype: str='float32'):
+        logger.info(f"Saving vectors to {path}.bin")
+        with open(f"{path}.bin", 'wb') as f:
+            _write_binary_header(f, dtype, vectors.size(0), vectors.size(1))
+            f.write(vectors.cpu().numpy().astype(dtype).tobytes())
+        with open(f"{path}.vocab", 'w', encoding='utf-8', newline='') as f:
+            f.writelines(f"{w}\n" for w in itos)
+        
+    @staticmethod
+    def load_from_binary(path: str, mmap: bool=True):
+        logger.info(f"Loading vectors from {path}.bin")
+        with open(f"{path}.bin", 'rb') as f:
+            magic, version, dtype_code, voc_dim, emb_dim = _BINARY_HEADER.unpack(f.read(_BINARY_HEADER.size))
+        if magic != _BINARY_MAGIC or version != _BINARY_VERSION:
+            raise ValueError(f"Invalid binary vectors file: {path}.bin")
+        
+        dtype = _BINARY_DTYPES[dtype_code]
+        if mmap:
+            # Copy-on-write mode: pages are read lazily, and the file is never modified
+            vectors = numpy.memmap(f"{path}.bin", dtype=dtype, mode='c', offset=_BINARY_HEADER.size, shape=(voc_dim, emb_dim))
+        else:
+            vectors = numpy.fromfile(f"{path}.bin", dtype=dtype, offset=_BINARY_HEADER.size).reshape(voc_dim, emb_dim)
+        
+        with open(f"{path}.vocab", 'r', encoding='utf-8', newline='') as f:
+            itos = f.read().split("\n")[:voc_dim]
+        return itos, torch.from_numpy(vectors)
+        
     @staticmethod
     def save_to_cache(path: str, itos: List[str], vectors: torch.FloatTensor):
-        logger.info(f"Saving vectors to {path}.pt")
-        torch.save((itos, vectors), f"{path}.pt")
+        Vectors.save_to_binary(path, itos, vectors)
         
     @staticmethod
     def load_from_cache(path: str):
-        logger.info(f"Loading vectors from {path}.pt")
-        itos, vectors = torch.load(f"{path}.pt")
-        return itos, vectors
+        if os.path.exists(f"{path}.bin"):
+            return Vectors.load_from_binary(path)
+        else:
+            # Legacy cache by `torch.save`
+            logger.info(f"Loading vectors from {path}.pt")
+            itos, vectors = torch.load(f"{path}.pt")
+            return itos, vectors
+        
+    @staticmethod
+    def _exists_cache(path: str):
+        return os.path.exists(f"{path}.bin") or os.path.exists(f"{path}.pt")
         
     @classmethod
     def load(cls, path: str, encoding=None, **kwargs):
-        if os.path.exists(f"{path}.pt"):
-            itos, vectors = cls.load_from_cache(path)
-        else:
-            itos, vectors = _load_from_file(path, encoding, **kwargs)
-            cls.save_to_cache(path, itos, vectors)
+        if not cls._exists_cache(path):
+            convert_to_binary(path, encoding, **kwargs)
+        itos, vectors = cls.load_from_cache(path)
         return cls(itos, vectors)
 
 
@@ -138,18 +276,16 @@ class GloVe(Vectors):
     https://nlp.stanford.edu/projects/glove/
     """
     def __init__(self, path: str, encoding=None, **kwargs):
-        if os.path.exists(f"{path}.pt"):
-            itos, vectors = self.load_from_cache(path)
-        else:
-            itos, vectors = _load_from_file(path, encoding)
-            self.save_to_cache(path, itos, vectors)
+        if not self._exists_cache(path):
+            convert_to_binary(path, encoding)
+        itos, vectors = self.load_from_cache(path)
         
         super().__init__(itos, vectors, **kwargs)
 
 
 class Senna(Vectors):
     def __init__(self, path: str, **kwargs):
-        if os.path.exists(f"{path}.pt"):
+        if self._exists_cache(path):
             itos, vectors = self.load_from_cache(path)
         else:
             with open(f"{path}/hash/words.lst", 'r') as f:
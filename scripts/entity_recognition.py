@@ -23,7 +23,8 @@ from eznlp.model.bert_like import truecase_for_bert_like, merge_sentences_for_be
 from eznlp.training import Trainer, count_params, evaluate_entity_recognition
 
 from utils import add_base_arguments, parse_to_args
-from utils import load_data, dataset2language, load_pretrained, load_vectors, build_trainer, header_format, profile
+from utils import load_data, dataset2language, load_pretrained, load_vectors, build_train_loader, build_trainer, header_format
+from utils import init_distributed, is_main_rank, local_device, finalize_distributed
 
 
 def parse_arguments(parser: argparse.ArgumentParser):
@@ -50,6 +51,8 @@ def parse_arguments(parser: argparse.ArgumentParser):
                             help="whether to save predictions on the test split (typically in case without ground truth)")
     group_data.add_argument('--pipeline', default=False, action='store_true', 
                             help="whether to save predictions on all splits for pipeline modeling")
+    group_data.add_argument('--cache_dir', type=str, default=None, 
+                            help="directory to cache preprocessed examples (disabled if not specified)")
     
     group_decoder = parser.add_argument_group('decoder configurations')
     group_decoder.add_argument('--ck_decoder', type=str, default='sequence_tagging', 
@@ -71,6 +74,8 @@ def parse_arguments(parser: argparse.ArgumentParser):
                                help="aggregating mode")
     group_decoder.add_argument('--max_span_size', type=int, default=10, 
                                help="maximum span size")
+    group_decoder.add_argument('--bs_max_span_size', type=int, default=-1, 
+                               help="maximum span size for boundary selection (non-positive for unlimited)")
     group_decoder.add_argument('--size_emb_dim', type=int, default=25, 
                                help="span size embedding dim")
     group_decoder.add_argument('--inex_mkmmd_lambda', type=float, default=0.0, 
@@ -116,6 +121,8 @@ def parse_arguments(parser: argparse.ArgumentParser):
                                help="whether to share weights across span-bert encoders")
     group_decoder.add_argument('--sse_no_share_interm2', dest='sse_share_interm2', default=True, action='store_false', 
                                help="whether to share interm2 between span-bert and bert encoders")
+    group_decoder.add_argument('--sse_fused', default=False, action='store_true', 
+                               help="whether to encode spans of all sizes in a single pass")
     group_decoder.add_argument('--sse_init_agg_mode', type=str, default='max_pooling', 
                                help="initial aggregating mode for span-bert enocder")
     group_decoder.add_argument('--sse_init_drop_rate', type=float, default=0.2, 
@@ -195,6 +202,7 @@ def collect_IE_assembly_config(args: argparse.Namespace):
                                                        num_layers=None if args.sse_num_layers < 0 else args.sse_num_layers, 
                                                        share_weights_ext=args.sse_share_weights_ext, 
                                                        share_weights_int=args.sse_share_weights_int, 
+                                                       fused=args.sse_fused, 
                                                        init_agg_mode=args.sse_init_agg_mode, 
                                                        init_drop_rate=args.sse_init_drop_rate)
         else:
@@ -254,6 +262,7 @@ def build_ER_config(args: argparse.Namespace):
                                                         sb_epsilon=args.sb_epsilon, 
                                                         sb_size=args.sb_size,
                                                         sb_adj_factor=args.sb_adj_factor, 
+                                                        max_span_size=(args.bs_max_span_size if args.bs_max_span_size > 0 else None), 
                                                         size_emb_dim=args.size_emb_dim, 
                                                         # hid_drop_rates=drop_rates,
                                                         )
@@ -363,17 +372,19 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
                                      fromfile_prefix_chars='@')
     args = parse_arguments(parser)
+    init_distributed(args)
     
     # Use micro-seconds to ensure different timestamps while adopting multiprocessing
     timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
     save_path =  f"cache/{args.dataset}-ER/{timestamp}"
-    if not os.path.exists(save_path):
+    if is_main_rank() and not os.path.exists(save_path):
         os.makedirs(save_path)
     
-    handlers = [logging.FileHandler(f"{save_path}/training.log")]
+    # Log and save on the main process only in distributed training
+    handlers = [logging.FileHandler(f"{save_path}/training.log")] if is_main_rank() else []
     if args.log_terminal:
         handlers.append(logging.StreamHandler(sys.stdout))
-    logging.basicConfig(level=logging.INFO, 
+    logging.basicConfig(level=logging.INFO if is_main_rank() else logging.WARNING, 
                         format="[%(asctime)s %(levelname)s] %(message)s", 
                         datefmt="%Y-%m-%d %H:%M:%S", 
                         handlers=handlers)
@@ -385,7 +396,7 @@ if __name__ == '__main__':
     
     
     logger.info(header_format("Preparing", sep='-'))
-    device = auto_device()
+    device = local_device(auto_device(), args)
     if device.type.startswith('cuda'):
         torch.cuda.set_device(device)
         temp = torch.randn(100).to(device)
@@ -396,20 +407,25 @@ if __name__ == '__main__':
     train_data, dev_data, test_data = process_IE_data(train_data, dev_data, test_data, args, config)
     
     if not args.train_with_dev:
-        train_set = Dataset(train_data, config, training=True)
+        train_set = Dataset(train_data, config, training=True, cache_dir=args.cache_dir)
         train_set.build_vocabs_and_dims(dev_data, test_data)
-        dev_set   = Dataset(dev_data,  train_set.config, training=False)
-        test_set  = Dataset(test_data, train_set.config, training=False)
+        dev_set   = Dataset(dev_data,  train_set.config, training=False, cache_dir=args.cache_dir)
+        test_set  = Dataset(test_data, train_set.config, training=False, cache_dir=args.cache_dir)
+        if args.cache_dir is not None:
+            dev_set.build_cache()
+            test_set.build_cache()
         
-        train_loader = torch.utils.data.DataLoader(train_set, batch_size=args.batch_size, shuffle=True,  collate_fn=train_set.collate)
+        train_loader = build_train_loader(train_set, args)
         dev_loader   = torch.utils.data.DataLoader(dev_set,   batch_size=args.batch_size, shuffle=False, collate_fn=dev_set.collate)
     else:
-        train_set = Dataset(train_data + dev_data, config, training=True)
+        train_set = Dataset(train_data + dev_data, config, training=True, cache_dir=args.cache_dir)
         train_set.build_vocabs_and_dims(test_data)
         dev_set   = Dataset([],        train_set.config, training=False)
-        test_set  = Dataset(test_data, train_set.config, training=False)
+        test_set  = Dataset(test_data, train_set.config, training=False, cache_dir=args.cache_dir)
+        if args.cache_dir is not None:
+            test_set.build_cache()
         
-        train_loader = torch.utils.data.DataLoader(train_set, batch_size=args.batch_size, shuffle=True,  collate_fn=train_set.collate)
+        train_loader = build_train_loader(train_set, args)
         dev_loader   = None
     
     logger.info(train_set.summary)
@@ -428,14 +444,16 @@ if __name__ == '__main__':
         pdb.set_trace()
     
     if args.profile:
-        prof = profile(trainer, train_loader)
+        prof_report = trainer.profile(train_loader, num_batches=10, trace_path=f"{save_path}/profile-trace.json")
         pdb.set_trace()
     
-    torch.save(config, f"{save_path}/{config.name}-config.pth")
+    if is_main_rank():
+        torch.save(config, f"{save_path}/{config.name}-config.pth")
     def save_callback(model):
         torch.save(model, f"{save_path}/{config.name}.pth")
     trainer.train_steps(train_loader=train_loader, dev_loader=dev_loader, num_epochs=args.num_epochs, 
-                        save_callback=save_callback, save_by_loss=False)
+                        save_callback=save_callback, save_by_loss=False, checkpoint_path=args.checkpoint_path)
+    finalize_distributed(args)
     
     # Save the final version
     # torch.save(model, f"{save_path}/{config.name}.fv.pth")
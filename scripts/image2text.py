@@ -17,7 +17,8 @@ from eznlp.model import Image2TextConfig
 from eznlp.training import Trainer, count_params, evaluate_generation
 
 from utils import add_base_arguments, parse_to_args
-from utils import load_data, dataset2language, load_vectors, build_trainer, header_format
+from utils import load_data, dataset2language, load_vectors, build_train_loader, build_trainer, header_format
+from utils import init_distributed, is_main_rank, local_device, finalize_distributed
 
 
 
@@ -99,17 +100,19 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
                                      fromfile_prefix_chars='@')
     args = parse_arguments(parser)
+    init_distributed(args)
     
     # Use micro-seconds to ensure different timestamps while adopting multiprocessing
     timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
     save_path =  f"cache/{args.dataset}-I2T/{timestamp}"
-    if not os.path.exists(save_path):
+    if is_main_rank() and not os.path.exists(save_path):
         os.makedirs(save_path)
     
-    handlers = [logging.FileHandler(f"{save_path}/training.log")]
+    # Log and save on the main process only in distributed training
+    handlers = [logging.FileHandler(f"{save_path}/training.log")] if is_main_rank() else []
     if args.log_terminal:
         handlers.append(logging.StreamHandler(sys.stdout))
-    logging.basicConfig(level=logging.INFO, 
+    logging.basicConfig(level=logging.INFO if is_main_rank() else logging.WARNING, 
                         format="[%(asctime)s %(levelname)s] %(message)s", 
                         datefmt="%Y-%m-%d %H:%M:%S", 
                         handlers=handlers)
@@ -121,7 +124,7 @@ if __name__ == '__main__':
     
     
     logger.info(header_format("Preparing", sep='-'))
-    device = auto_device()
+    device = local_device(auto_device(), args)
     if device.type.startswith('cuda'):
         torch.cuda.set_device(device)
         temp = torch.randn(100).to(device)
@@ -138,7 +141,7 @@ if __name__ == '__main__':
     test_set  = GenerationDataset(test_data, config=train_set.config, training=False)
     
     logger.info(train_set.summary)
-    train_loader = torch.utils.data.DataLoader(train_set, batch_size=args.batch_size, shuffle=True,  num_workers=4, collate_fn=train_set.collate)
+    train_loader = build_train_loader(train_set, args, num_workers=4)
     dev_loader   = torch.utils.data.DataLoader(dev_set,   batch_size=args.batch_size, shuffle=False, num_workers=4, collate_fn=dev_set.collate)
     
     
@@ -151,11 +154,13 @@ if __name__ == '__main__':
     if args.pdb: 
         pdb.set_trace()
     
-    torch.save(config, f"{save_path}/{config.name}-config.pth")
+    if is_main_rank():
+        torch.save(config, f"{save_path}/{config.name}-config.pth")
     def save_callback(model):
         torch.save(model, f"{save_path}/{config.name}.pth")
     trainer.train_steps(train_loader=train_loader, dev_loader=dev_loader, num_epochs=args.num_epochs, 
-                        save_callback=save_callback, save_by_loss=False)
+                        save_callback=save_callback, save_by_loss=False, checkpoint_path=args.checkpoint_path)
+    finalize_distributed(args)
     
     
     logger.info(header_format("Evaluating", sep='-'))
@@ -20,7 +20,8 @@ from eznlp.model import ExtractorConfig
 from eznlp.training import Trainer, count_params, evaluate_joint_extraction
 
 from utils import add_base_arguments, parse_to_args
-from utils import load_data, dataset2language, load_pretrained, build_trainer, header_format
+from utils import load_data, dataset2language, load_pretrained, build_train_loader, build_trainer, header_format
+from utils import init_distributed, is_main_rank, local_device, finalize_distributed
 from entity_recognition import collect_IE_assembly_config, process_IE_data
 
 
@@ -60,6 +61,8 @@ def parse_arguments(parser: argparse.ArgumentParser):
                                help="maximum span size")
     group_decoder.add_argument('--max_size_id', type=int, default=9, 
                                help="maximum span size ID")
+    group_decoder.add_argument('--bs_max_span_size', type=int, default=-1, 
+                               help="maximum span size for boundary selection (non-positive for unlimited)")
     group_decoder.add_argument('--size_emb_dim', type=int, default=25, 
                                help="span size embedding dim")
     group_decoder.add_argument('--label_emb_dim', type=int, default=25, 
@@ -119,6 +122,7 @@ def build_joint_config(args: argparse.Namespace):
                                                            neg_sampling_surr_rate=args.neg_sampling_surr_rate, 
                                                            neg_sampling_surr_size=args.neg_sampling_surr_size, 
                                                            sb_epsilon=args.sb_epsilon,
+                                                           max_span_size=(args.bs_max_span_size if args.bs_max_span_size > 0 else None), 
                                                            size_emb_dim=args.size_emb_dim, 
                                                            #hid_drop_rates=drop_rates,
                                                            )
@@ -156,17 +160,19 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
                                      fromfile_prefix_chars='@')
     args = parse_arguments(parser)
+    init_distributed(args)
     
     # Use micro-seconds to ensure different timestamps while adopting multiprocessing
     timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
     save_path =  f"cache/{args.dataset}-Joint/{timestamp}"
-    if not os.path.exists(save_path):
+    if is_main_rank() and not os.path.exists(save_path):
         os.makedirs(save_path)
     
-    handlers = [logging.FileHandler(f"{save_path}/training.log")]
+    # Log and save on the main process only in distributed training
+    handlers = [logging.FileHandler(f"{save_path}/training.log")] if is_main_rank() else []
     if args.log_terminal:
         handlers.append(logging.StreamHandler(sys.stdout))
-    logging.basicConfig(level=logging.INFO, 
+    logging.basicConfig(level=logging.INFO if is_main_rank() else logging.WARNING, 
                         format="[%(asctime)s %(levelname)s] %(message)s", 
                         datefmt="%Y-%m-%d %H:%M:%S", 
                         handlers=handlers)
@@ -178,7 +184,7 @@ if __name__ == '__main__':
     
     
     logger.info(header_format("Preparing", sep='-'))
-    device = auto_device()
+    device = local_device(auto_device(), args)
     if device.type.startswith('cuda'):
         torch.cuda.set_device(device)
     
@@ -193,7 +199,7 @@ if __name__ == '__main__':
         dev_set   = Dataset(dev_data,  train_set.config, training=False)
         test_set  = Dataset(test_data, train_set.config, training=False)
         
-        train_loader = torch.utils.data.DataLoader(train_set, batch_size=args.batch_size, shuffle=True,  collate_fn=train_set.collate)
+        train_loader = build_train_loader(train_set, args)
         dev_loader   = torch.utils.data.DataLoader(dev_set,   batch_size=args.batch_size, shuffle=False, collate_fn=dev_set.collate)
     else:
         train_set = Dataset(train_data + dev_data, config, training=True)
@@ -201,7 +207,7 @@ if __name__ == '__main__':
         dev_set   = Dataset([],        train_set.config, training=False)
         test_set  = Dataset(test_data, train_set.config, training=False)
         
-        train_loader = torch.utils.data.DataLoader(train_set, batch_size=args.batch_size, shuffle=True,  collate_fn=train_set.collate)
+        train_loader = build_train_loader(train_set, args)
         dev_loader   = None
     
     logger.info(train_set.summary)
@@ -215,11 +221,13 @@ if __name__ == '__main__':
     if args.pdb: 
         pdb.set_trace()
     
-    torch.save(config, f"{save_path}/{config.name}-config.pth")
+    if is_main_rank():
+        torch.save(config, f"{save_path}/{config.name}-config.pth")
     def save_callback(model):
         torch.save(model, f"{save_path}/{config.name}.pth")
     trainer.train_steps(train_loader=train_loader, dev_loader=dev_loader, num_epochs=args.num_epochs, 
-                        save_callback=save_callback, save_by_loss=False)
+                        save_callback=save_callback, save_by_loss=False, checkpoint_path=args.checkpoint_path)
+    finalize_distributed(args)
     
     
     logger.info(header_format("Evaluating", sep='-'))
@@ -164,7 +164,8 @@ if __name__ == '__main__':
         pdb.set_trace()
     
     trainer.train_steps(train_loader=train_loader, num_epochs=args.num_epochs, 
-                        disp_every_steps=args.disp_every_steps, eval_every_steps=args.disp_every_steps*100)
+                        disp_every_steps=args.disp_every_steps, eval_every_steps=args.disp_every_steps*100, 
+                        checkpoint_path=args.checkpoint_path)
     if isinstance(model, torch.nn.parallel.DistributedDataParallel):
         model = model.module
     if is_main_rank:
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 import argparse
 import logging
 import re
@@ -7,7 +8,6 @@ import json
 import spacy
 import jieba
 import random
-import time
 import numpy
 import sklearn.model_selection
 import torch
@@ -19,6 +19,7 @@ from eznlp.token import Full2Half
 from eznlp.io import TabularIO, CategoryFolderIO, ConllIO, JsonIO, TextClsIO, KarpathyIO, BratIO, Src2TrgIO
 from eznlp.io import PostIO
 from eznlp.vectors import Vectors, GloVe
+from eznlp.dataset import LengthBucketBatchSampler
 from eznlp.training import Trainer, LRLambda, collect_params, check_param_groups
 from eznlp.metrics import precision_recall_f1_report
 
@@ -45,6 +46,10 @@ def add_base_arguments(parser: argparse.ArgumentParser):
                              help="number of epochs")
     group_train.add_argument('--batch_size', type=int, default=64, 
                              help="batch size")
+    group_train.add_argument('--length_bucketing', default=False, action='store_true', 
+                             help="whether to batch training examples of similar lengths")
+    group_train.add_argument('--max_tokens', type=int, default=None, 
+                             help="maximum number of padded tokens per batch (only applicable with `length_bucketing`)")
     group_train.add_argument('--grad_clip', type=float, default=5.0, 
                              help="gradient clip (negative values are set to `None`)")
     
@@ -58,6 +63,10 @@ def add_base_arguments(parser: argparse.ArgumentParser):
                              help='scheduler', choices=['None', 'ReduceLROnPlateau', 'LinearDecayWithWarmup', 'PowerDecayWithWarmup'])
     group_train.add_argument('--num_grad_acc_steps', type=int, default=1, 
                              help="number of gradient accumulation steps")
+    group_train.add_argument('--ddp', default=False, action='store_true', 
+                             help="whether to use distributed data-parallel training (launched by `torchrun`, with the `gloo` backend)")
+    group_train.add_argument('--checkpoint_path', type=str, default=None, 
+                             help="path of the full training checkpoint, from which the training automatically resumes if existing")
     
     group_model = parser.add_argument_group('model configurations')
     group_model.add_argument('--emb_dim', type=int, default=100, 
@@ -645,6 +654,55 @@ def header_format(content: str, sep='=', width=100):
 
 
 
+def init_distributed(args: argparse.Namespace):
+    """Initialize the process group for distributed data-parallel training. 
+    
+    The processes should be launched by `torchrun`, which sets the environment variables 
+    `RANK`, `LOCAL_RANK` and `WORLD_SIZE`. 
+    """
+    if args.ddp:
+        torch.distributed.init_process_group(backend='gloo')
+
+
+def is_main_rank():
+    return (not (torch.distributed.is_available() and torch.distributed.is_initialized())) or torch.distributed.get_rank() == 0
+
+
+def local_device(device: torch.device, args: argparse.Namespace):
+    # Each process uses the cuda device of its local rank in distributed training
+    if args.ddp and device.type.startswith('cuda'):
+        return torch.device('cuda', int(os.environ['LOCAL_RANK']))
+    return device
+
+
+def finalize_distributed(args: argparse.Namespace):
+    """Destroy the process group after distributed training, and exit the non-main processes, 
+    so that evaluation runs on the main process only. 
+    """
+    if args.ddp:
+        main_rank = is_main_rank()
+        torch.distributed.destroy_process_group()
+        if not main_rank:
+            sys.exit(0)
+
+
+
+def build_train_loader(train_set, args: argparse.Namespace, num_workers: int=0):
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        # Multi-process data-parallel training, e.g., launched by `torchrun` with the `gloo` backend
+        assert not args.length_bucketing, "`length_bucketing` is not supported in distributed training"
+        train_sampler = torch.utils.data.distributed.DistributedSampler(train_set, shuffle=True)
+        return torch.utils.data.DataLoader(train_set, batch_size=args.batch_size, sampler=train_sampler, num_workers=num_workers, collate_fn=train_set.collate)
+    elif args.length_bucketing:
+        # Buckets of 100 batches, shuffled before bucketing and after batching
+        batch_sampler = LengthBucketBatchSampler(train_set.seq_lens, batch_size=args.batch_size, max_tokens=args.max_tokens, 
+                                                 shuffle=True, bucket_size=args.batch_size*100)
+        return torch.utils.data.DataLoader(train_set, batch_sampler=batch_sampler, num_workers=num_workers, collate_fn=train_set.collate)
+    else:
+        return torch.utils.data.DataLoader(train_set, batch_size=args.batch_size, shuffle=True, num_workers=num_workers, collate_fn=train_set.collate)
+
+
+
 def build_trainer(model, device, num_train_batches: int, args: argparse.Namespace):
     param_groups = [{'params': model.pretrained_parameters(), 'lr': args.finetune_lr}]
     param_groups.append({'params': collect_params(model, param_groups), 'lr': args.lr})
@@ -666,22 +724,9 @@ def build_trainer(model, device, num_train_batches: int, args: argparse.Namespac
     else:
         scheduler = None
     
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        # Some modules (e.g., optional size embeddings) may not be used in every forward
+        model = torch.nn.parallel.DistributedDataParallel(model, find_unused_parameters=True)
+    
     return Trainer(model, optimizer=optimizer, scheduler=scheduler, schedule_by_step=schedule_by_step, num_grad_acc_steps=args.num_grad_acc_steps,
                    device=device, grad_clip=args.grad_clip, use_amp=args.use_amp)
-
-
-
-def profile(trainer, dataloader):
-    # raise "out of memory" error if use_cuda=Ture
-    with torch.autograd.profiler.profile(use_cuda=False) as prof:
-        t0 = time.time()
-        prof_loader = [batch for _, batch in zip(range(10), dataloader)]
-        logger.info(f"Data loading time: {time.time()-t0:.3f}s")
-        t0 = time.time()
-        trainer.train_epoch(prof_loader)
-        logger.info(f"Model training time: {time.time()-t0:.3f}s")
-    
-    sort_by = "cuda_time_total" if trainer.device.type.startswith('cuda') else "cpu_time_total"
-    prof_table = prof.key_averages().table(sort_by=sort_by, row_limit=10)
-    logger.info(f"\n{prof_table}")
-    return prof
@@ -16,6 +16,7 @@ from eznlp.model.bert_like import (truecase_for_bert_like,
                                    subtokenize_for_bert_like, 
                                    merge_enchars_for_bert_like, 
                                    _tokenized2nested, 
+                                   _tokenize_words, 
                                    _tokenizer2sub_prefix)
 from eznlp.training import count_params
 from eznlp.io import TabularIO
@@ -155,6 +156,24 @@ def test_subtokenize_for_bert_like_with_data(bert_like_with_tokenizer, conll2003
 
 
 
+@pytest.mark.parametrize("arch", ['bert', 'roberta'])
+def test_tokenize_words_with_fast_tokenizer(arch, conll2003_demo):
+    if arch == 'bert':
+        tokenizer = transformers.BertTokenizer.from_pretrained("assets/transformers/bert-base-cased")
+        fast_tokenizer = transformers.BertTokenizerFast.from_pretrained("assets/transformers/bert-base-cased")
+    else:
+        tokenizer = transformers.RobertaTokenizer.from_pretrained("assets/transformers/roberta-base", add_prefix_space=True)
+        fast_tokenizer = transformers.RobertaTokenizerFast.from_pretrained("assets/transformers/roberta-base", add_prefix_space=True)
+    
+    words = [word for entry in conll2003_demo for word in entry['tokens'].raw_text]
+    nested_sub_tokens = _tokenize_words(words, fast_tokenizer)
+    assert nested_sub_tokens == [tuple(tokenizer.tokenize(word)) for word in words]
+    # Cached results
+    assert _tokenize_words(words, fast_tokenizer) == nested_sub_tokens
+    assert [list(sub_tokens) for sub_tokens in _tokenize_words(words, tokenizer)] == [tokenizer.tokenize(word) for word in words]
+
+
+
 def test_merge_enchars_for_bert_like():
     tokenizer = transformers.BertTokenizer.from_pretrained("assets/transformers/bert-base-chinese", do_lower_case=True)
     sub_prefix = _tokenizer2sub_prefix(tokenizer)
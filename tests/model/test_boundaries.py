@@ -2,9 +2,9 @@
 import pytest
 import torch
 
-from eznlp.model import BoundarySelectionDecoderConfig, SpecificSpanRelClsDecoderConfig
+from eznlp.model import BoundarySelectionDecoderConfig, SpanClassificationDecoderConfig, SpecificSpanRelClsDecoderConfig
 from eznlp.model.decoder.boundaries import _spans_from_upper_triangular, _spans_from_diagonals, _span_pairs_from_diagonals
-from eznlp.model.decoder.boundaries import _span2diagonal, _diagonal2span
+from eznlp.model.decoder.boundaries import _span2diagonal, _diagonal2span, _diagonal_span_index
 
 
 @pytest.mark.parametrize("sb_epsilon", [0.0, 0.1])
@@ -79,6 +79,34 @@ def test_boundaries_obj_for_boundary_smoothing(sb_epsilon, sb_size):
 
 
 
+@pytest.mark.parametrize("sb_epsilon", [0.0, 0.1])
+@pytest.mark.parametrize("sl_epsilon", [0.0, 0.1])
+@pytest.mark.parametrize("max_span_size", [2, 4])
+def test_boundaries_obj_in_diagonal_format(sb_epsilon, sl_epsilon, max_span_size):
+    entry = {'tokens': list("abcdef"), 
+             'chunks': [('EntA', 0, 1), ('EntA', 0, 4), ('EntB', 0, 5), ('EntA', 3, 5), ('EntA', 4, 5)]}
+    config = SpanClassificationDecoderConfig(sb_epsilon=sb_epsilon, sl_epsilon=sl_epsilon, max_span_size=max_span_size)
+    config.build_vocab([entry])
+    boundaries_obj = config.exemplify(entry)['boundaries_obj']
+    
+    num_tokens = len(entry['tokens'])
+    num_spans = (num_tokens*2 - (max_span_size-1)) * max_span_size // 2
+    assert boundaries_obj.diagonal_label_ids.size(0) == num_spans
+    
+    if sb_epsilon == 0 and sl_epsilon == 0:
+        assert not hasattr(boundaries_obj, 'soft_span_ids')
+        labels_retr = [config.idx2label[i] for i in boundaries_obj.diagonal_label_ids.tolist()]
+    else:
+        # Only the spans with positive probabilities on non-`<none>` labels are stored
+        assert boundaries_obj.soft_label_ids.size(0) == boundaries_obj.soft_span_ids.size(0) < num_spans
+        assert (boundaries_obj.diagonal_label_ids.sum(dim=-1) - 1).abs().max().item() < 1e-6
+        labels_retr = [config.idx2label[i] for i in boundaries_obj.diagonal_label_ids.argmax(dim=-1).tolist()]
+    
+    chunks_retr = [(label, start, end) for label, (start, end) in zip(labels_retr, _spans_from_diagonals(num_tokens, max_span_size)) if label != config.none_label]
+    assert set(chunks_retr) == set(ck for ck in entry['chunks'] if ck[2]-ck[1] <= max_span_size)
+
+
+
 @pytest.mark.parametrize("neg_sampling_rate", [1.0, 0.5, 0.0])
 @pytest.mark.parametrize("neg_sampling_surr_rate", [0.0, 0.5, 1.0])
 @pytest.mark.parametrize("nested_sampling_rate", [1.0, 0.5, 0.0])
@@ -129,6 +157,9 @@ def test_diag_boundaries_pair_obj(training, EAR_data_demo):
     assert dbp_obj.dbp2label_id.size() == (num_spans, num_spans)
     
     assert dbp_obj.dbp2label_id.sum() == sum(config.label2idx[label] for label, *_ in relations)
+    # The labels built in chunks of head spans are consistent with the dense ones
+    chunked_label_ids = [dbp_obj.head_chunk_label_ids(start, min(start+5, num_spans)) for start in range(0, num_spans, 5)]
+    assert (torch.cat(chunked_label_ids, dim=0) == dbp_obj.dbp2label_id).all().item()
     assert all(dbp_obj.dbp2label_id[_span2diagonal(h_start, h_end, num_tokens), _span2diagonal(t_start, t_end, num_tokens)] == config.label2idx[label] 
                    for label, (_, h_start, h_end), (_, t_start, t_end) in relations)
     
@@ -146,6 +177,29 @@ def test_diag_boundaries_pair_obj(training, EAR_data_demo):
 
 
 
+@pytest.mark.parametrize("neg_sampling_rate", [0.0, 0.5])
+def test_diag_boundaries_pair_obj_sampling(neg_sampling_rate, EAR_data_demo):
+    entry = EAR_data_demo[0]
+    relations = entry['relations']
+    config = SpecificSpanRelClsDecoderConfig(max_span_size=3, neg_sampling_rate=neg_sampling_rate)
+    config.build_vocab(EAR_data_demo)
+    dbp_obj = config.exemplify(entry, training=True)['dbp_obj']
+    
+    num_spans = dbp_obj.num_spans
+    assert dbp_obj.pos_pair_ids.size(0) == len(relations)
+    pos_pairs = set(map(tuple, dbp_obj.pos_pair_ids.tolist()))
+    neg_pairs = set(map(tuple, dbp_obj.neg_pair_ids.tolist()))
+    assert len(pos_pairs & neg_pairs) == 0
+    assert abs(len(neg_pairs) - num_spans**2*neg_sampling_rate) < num_spans**2*0.1
+    
+    # The dense representations are consistent with the sparse ones
+    sampled_pair_ids = dbp_obj.sampled_pair_ids
+    assert dbp_obj.non_mask.sum().item() == sampled_pair_ids.size(0) == len(relations) + len(neg_pairs)
+    assert (dbp_obj.dbp2label_id[sampled_pair_ids[:, 0], sampled_pair_ids[:, 1]] == dbp_obj.sampled_label_ids).all().item()
+    assert dbp_obj.dbp2label_id.sum() == dbp_obj.sampled_label_ids.sum()
+
+
+
 @pytest.mark.parametrize("seq_len", [1, 5, 10, 100])
 def test_spans_from_upper_triangular(seq_len):
     assert len(list(_spans_from_upper_triangular(seq_len))) == (seq_len+1)*seq_len // 2
@@ -168,3 +222,17 @@ def test_span2diagonal(seq_len):
     num_spans = (seq_len+1)*seq_len // 2
     assert [_span2diagonal(start, end, seq_len) for start, end in _spans_from_diagonals(seq_len)] == list(range(num_spans))
     assert [_diagonal2span(k, seq_len) for k in range(num_spans)] == list(_spans_from_diagonals(seq_len))
+
+
+@pytest.mark.parametrize("seq_len, max_span_size", [(5, 1), (5, 5), (10, 3), (10, 10)])
+@pytest.mark.parametrize("curr_len", [1, 3, 5])
+def test_diagonal_span_index(seq_len, max_span_size, curr_len):
+    span_starts, span_sizes, span_token_ids, span_token_mask = _diagonal_span_index(seq_len, max_span_size)
+    assert span_token_ids.size() == span_token_mask.size() == (seq_len*max_span_size, max_span_size)
+    
+    span_non_pad = (span_starts + span_sizes <= curr_len)
+    spans_retr = [(start, start+size) for start, size in zip(span_starts[span_non_pad].tolist(), span_sizes[span_non_pad].tolist())]
+    assert spans_retr == list(_spans_from_diagonals(curr_len, max_span_size))
+    
+    for (start, end), token_ids, token_mask in zip(spans_retr, span_token_ids[span_non_pad], span_token_mask[span_non_pad]):
+        assert token_ids[~token_mask].tolist() == list(range(start, end))
@@ -5,6 +5,7 @@ import torch
 from eznlp.dataset import Dataset
 from eznlp.model import EncoderConfig, BertLikeConfig, BoundarySelectionDecoderConfig, ExtractorConfig
 from eznlp.model.bert_like import subtokenize_for_bert_like
+from eznlp.model.decoder.boundaries import _diagonal_span_boundaries
 from eznlp.training import Trainer
 
 
@@ -70,6 +71,22 @@ class TestModel(object):
         self._assert_trainable()
         
         
+    @pytest.mark.parametrize("max_span_size", [None, 5])
+    def test_model_with_banded_scores(self, max_span_size, conll2004_demo, device):
+        self.config = ExtractorConfig(decoder=BoundarySelectionDecoderConfig(max_span_size=max_span_size))
+        self._setup_case(conll2004_demo, device)
+        self._assert_batch_consistency()
+        self._assert_trainable()
+        
+        self.model.eval()
+        batch = self.dataset.collate([self.dataset[i] for i in range(4)]).to(self.device)
+        states = self.model.forward2states(batch)
+        scores = self.model.decoder.compute_scores(batch, **states)
+        diagonal_scores = self.model.decoder.compute_diagonal_scores(batch, **states)
+        span_starts, span_ends = _diagonal_span_boundaries(scores.size(1), max_span_size, device=self.device)
+        assert (scores[:, span_starts, span_ends-1] - diagonal_scores).abs().max().item() < 1e-4
+        
+        
     def test_model_wo_prod(self, conll2004_demo, device):
         self.config = ExtractorConfig(decoder=BoundarySelectionDecoderConfig(use_prod=False))
         self._setup_case(conll2004_demo, device)
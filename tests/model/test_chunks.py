@@ -103,3 +103,51 @@ def test_chunk_singles_obj(training, pipeline, EAR_data_demo):
         else:
             assert set(cs_obj.chunks) == set(chunks_pred)
             assert cs_obj.cs2label_id.size() == (3, config.voc_dim)
+
+
+
+@pytest.mark.parametrize("training", [True, False])
+def test_chunk_pairs_build_batch(training, EAR_data_demo):
+    from eznlp.model.decoder.chunks import ChunkPairs
+    config = SpanRelClassificationDecoderConfig()
+    config.build_vocab(EAR_data_demo)
+    
+    chunks_pred = [('EntA', 0, 1), ('EntB', 1, 2), ('EntA', 2, 3)]
+    # Entries with different numbers of predicted chunks, so that the targets are padded in the batch
+    batch_chunks_pred = [chunks_pred[:k] for k in (0, 1, 3)]
+    cp_objs_single = [config.exemplify(EAR_data_demo[0], training=training)['cp_obj'] for chunks_pred in batch_chunks_pred]
+    cp_objs_batch = [config.exemplify(EAR_data_demo[0], training=training)['cp_obj'] for chunks_pred in batch_chunks_pred]
+    for cp_obj_single, cp_obj_batch, chunks_pred in zip(cp_objs_single, cp_objs_batch, batch_chunks_pred):
+        cp_obj_single.chunks_pred = chunks_pred
+        cp_obj_single.build(config)
+        cp_obj_batch.chunks_pred = chunks_pred
+        assert cp_obj_batch.chunks == cp_obj_single.chunks
+    ChunkPairs.build_batch(cp_objs_batch, config)
+    
+    for cp_obj_single, cp_obj_batch in zip(cp_objs_single, cp_objs_batch):
+        for name in ['span_starts', 'span_ends', 'span_size_ids', 'ck_label_ids', 'cp2label_id']:
+            assert (getattr(cp_obj_batch, name) == getattr(cp_obj_single, name)).all().item()
+
+
+
+@pytest.mark.parametrize("training", [True, False])
+def test_chunk_singles_build_batch(training, EAR_data_demo):
+    from eznlp.model.decoder.chunks import ChunkSingles
+    config = SpanAttrClassificationDecoderConfig()
+    config.build_vocab(EAR_data_demo)
+    
+    chunks_pred = [('EntA', 0, 1), ('EntB', 1, 2), ('EntA', 2, 3)]
+    # Entries with different numbers of predicted chunks, so that the targets are padded in the batch
+    batch_chunks_pred = [chunks_pred[:k] for k in (0, 1, 3)]
+    cs_objs_single = [config.exemplify(EAR_data_demo[0], training=training)['cs_obj'] for chunks_pred in batch_chunks_pred]
+    cs_objs_batch = [config.exemplify(EAR_data_demo[0], training=training)['cs_obj'] for chunks_pred in batch_chunks_pred]
+    for cs_obj_single, cs_obj_batch, chunks_pred in zip(cs_objs_single, cs_objs_batch, batch_chunks_pred):
+        cs_obj_single.chunks_pred = chunks_pred
+        cs_obj_single.build(config)
+        cs_obj_batch.chunks_pred = chunks_pred
+        assert cs_obj_batch.chunks == cs_obj_single.chunks
+    ChunkSingles.build_batch(cs_objs_batch, config)
+    
+    for cs_obj_single, cs_obj_batch in zip(cs_objs_single, cs_objs_batch):
+        for name in ['span_size_ids', 'ck_label_ids', 'cs2label_id']:
+            assert (getattr(cs_obj_batch, name) == getattr(cs_obj_single, name)).all().item()
@@ -3,6 +3,7 @@ import pytest
 import os
 import torch
 
+from eznlp.token import TokenSequence
 from eznlp.model import ELMoConfig
 from eznlp.training import count_params
 
@@ -26,6 +27,35 @@ def test_trainble_config(mix_layers, use_gamma, freeze, elmo):
 
 
 
+def test_representations_cache(elmo, tmp_path):
+    batch_tokenized_text = [["I", "like", "it", "."], 
+                            ["Do", "you", "love", "me", "?"], 
+                            ["Sure", "!"]]
+    data = [{'tokens': TokenSequence.from_tokenized_text(tokenized_text)} for tokenized_text in batch_tokenized_text]
+    
+    elmo_config = ELMoConfig(elmo=elmo)
+    elmo_embedder = elmo_config.instantiate()
+    elmo_embedder.eval()
+    batch_elmo_ins = elmo_config.batchify([elmo_config.exemplify(entry['tokens']) for entry in data])
+    expected = elmo_embedder(**batch_elmo_ins)
+    
+    cached_config = ELMoConfig(elmo=elmo, cache_path=str(tmp_path / "elmo"))
+    cached_config.build_representations_cache(data)
+    batch_cached_ins = cached_config.batchify([cached_config.exemplify(entry['tokens']) for entry in data])
+    assert 'layer_outputs' in batch_cached_ins
+    assert (elmo_embedder(**batch_cached_ins) - expected).abs().max().item() < 1e-4
+    
+    # Fall back to computing on-the-fly if any text is not cached
+    tokens = TokenSequence.from_tokenized_text(["Not", "cached"])
+    assert 'char_ids' in cached_config.batchify([cached_config.exemplify(entry['tokens']) for entry in data] + [cached_config.exemplify(tokens)])
+    
+    # A store built with different settings is not re-used
+    other_config = ELMoConfig(elmo=elmo, cache_path=str(tmp_path / "elmo"), cache_dtype='float16')
+    with pytest.raises(ValueError):
+        other_config.build_representations_cache(data)
+
+
+
 def test_serialization(elmo):
     config = ELMoConfig(elmo=elmo)
     
@@ -51,6 +51,36 @@ def test_trainble_config(freeze, use_gamma, flair_lm):
 
 
 
+@pytest.mark.parametrize("agg_mode", ['last', 'mean'])
+def test_representations_cache(agg_mode, flair_lm, tmp_path):
+    batch_tokenized_text = [["I", "like", "it", "."], 
+                            ["Do", "you", "love", "me", "?"], 
+                            ["Sure", "!"]]
+    data = [{'tokens': TokenSequence.from_tokenized_text(tokenized_text)} for tokenized_text in batch_tokenized_text]
+    
+    flair_config = FlairConfig(flair_lm=flair_lm, agg_mode=agg_mode, use_gamma=True)
+    flair_embedder = flair_config.instantiate()
+    flair_embedder.eval()
+    batch_flair_ins = flair_config.batchify([flair_config.exemplify(entry['tokens']) for entry in data])
+    expected = flair_embedder(**batch_flair_ins)
+    
+    cached_config = FlairConfig(flair_lm=flair_lm, agg_mode=agg_mode, use_gamma=True, cache_path=str(tmp_path / "flair"))
+    cached_config.build_representations_cache(data)
+    batch_cached_ins = cached_config.batchify([cached_config.exemplify(entry['tokens']) for entry in data])
+    assert 'flair_hidden' in batch_cached_ins
+    assert (flair_embedder(**batch_cached_ins) - expected).abs().max().item() < 1e-5
+    
+    # Fall back to computing on-the-fly if any text is not cached
+    tokens = TokenSequence.from_tokenized_text(["Not", "cached"])
+    assert 'char_ids' in cached_config.batchify([cached_config.exemplify(entry['tokens']) for entry in data] + [cached_config.exemplify(tokens)])
+    
+    # A store built with different settings is not re-used
+    other_config = FlairConfig(flair_lm=flair_lm, agg_mode='mean' if agg_mode == 'last' else 'last', cache_path=str(tmp_path / "flair"))
+    with pytest.raises(ValueError):
+        other_config.build_representations_cache(data)
+
+
+
 def test_serialization(flair_fw_lm):
     config = FlairConfig(flair_lm=flair_fw_lm)
     
@@ -87,6 +87,33 @@ class TestModel(object):
         self._assert_trainable()
         
         
+    @pytest.mark.parametrize("ck_decoder", ['sequence_tagging', 'span_classification', 'boundary_selection'])
+    def test_ck_forward_and_decode(self, ck_decoder, conll2004_demo, device):
+        if ck_decoder.lower() == 'sequence_tagging':
+            ck_decoder_config = SequenceTaggingDecoderConfig(use_crf=True)
+        elif ck_decoder.lower() == 'span_classification':
+            ck_decoder_config = SpanClassificationDecoderConfig()
+        elif ck_decoder.lower() == 'boundary_selection':
+            ck_decoder_config = BoundarySelectionDecoderConfig()
+        self.config = ExtractorConfig(decoder=JointExtractionDecoderConfig(ck_decoder=ck_decoder_config))
+        self._setup_case(conll2004_demo, device)
+        self.model.eval()
+        
+        batch = self.dataset.collate([self.dataset[i] for i in range(4)]).to(self.device)
+        states = self.model.forward2states(batch)
+        ck_decoder = self.model.decoder.ck_decoder
+        losses, chunks_pred = ck_decoder.forward_and_decode(batch, **states)
+        assert (losses - ck_decoder(batch, **states)).abs().max().item() < 1e-6
+        assert chunks_pred == ck_decoder.decode(batch, **states)
+        # The cached scores are consumed by the first following `decode`
+        assert '_scores_cache' not in ck_decoder.__dict__
+        
+        # The cached scores are detached from the autograd graph
+        ck_decoder.forward_and_decode(batch, **states)
+        if '_scores_cache' in ck_decoder.__dict__:
+            assert all(not scores.requires_grad for scores in ck_decoder._scores_cache[2])
+        
+        
     def test_model_with_bert_like(self, conll2004_demo, bert_with_tokenizer, device):
         bert, tokenizer = bert_with_tokenizer
         self.config = ExtractorConfig(ohots=None, 
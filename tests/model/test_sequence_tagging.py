@@ -113,6 +113,17 @@ class TestModel(object):
         self._assert_batch_consistency()
         self._assert_trainable()
         
+    @pytest.mark.parametrize("scheme", ['BIO1', 'BIO2', 'BIOES'])
+    def test_model_with_constrained_decoding(self, scheme, conll2003_demo, device):
+        self.config = ExtractorConfig(decoder=SequenceTaggingDecoderConfig(scheme=scheme, constrained_decoding=True))
+        self._setup_case(conll2003_demo, device)
+        self._assert_batch_consistency()
+        
+        batch = self.dataset.collate([self.dataset[i] for i in range(4)]).to(self.device)
+        states = self.model.forward2states(batch)
+        batch_tags = self.model.decoder.decode_tags(batch, **states)
+        assert all(self.model.decoder.translator.check_transitions_legal(tags) for tags in batch_tags)
+        
         
     @pytest.mark.parametrize("freeze", [False, True])
     def test_model_with_pretrained_vector(self, freeze, glove100, conll2003_demo, device):
@@ -26,6 +26,24 @@ def test_span_bert_like(bert_like_with_tokenizer):
 
 
 
+@pytest.mark.parametrize("init_agg_mode", ['max_pooling', 'conv'])
+def test_span_bert_like_fused(init_agg_mode, bert_like_with_tokenizer):
+    bert_like, tokenizer = bert_like_with_tokenizer
+    config = SpanBertLikeConfig(bert_like=bert_like, max_span_size=5, init_agg_mode=init_agg_mode)
+    span_bert_like = config.instantiate()
+    span_bert_like.eval()
+    
+    x_ids = torch.randint(0, 1000, size=(4, 10))
+    bert_outs = bert_like(x_ids, output_hidden_states=True)
+    all_last_query_states = span_bert_like(bert_outs['hidden_states'])
+    span_bert_like.fused = True
+    all_last_query_states_fused = span_bert_like(bert_outs['hidden_states'])
+    
+    assert list(all_last_query_states_fused.keys()) == list(all_last_query_states.keys())
+    assert all((all_last_query_states_fused[k] - all_last_query_states[k]).abs().max().item() < 1e-4 for k in range(2, 6))
+
+
+
 @pytest.mark.parametrize("share_weights_int", [False, True])
 @pytest.mark.parametrize("freeze", [False, True])
 def test_trainble_config(share_weights_int, freeze, bert_like_with_tokenizer):
@@ -61,6 +61,14 @@ class TestModel(object):
         self._assert_trainable()
         
         
+    @pytest.mark.parametrize("agg_mode", ['mean_pooling', 'multiplicative_attention'])
+    def test_model_with_max_pair_distance(self, agg_mode, conll2004_demo, device):
+        self.config = ExtractorConfig(decoder=SpanRelClassificationDecoderConfig(agg_mode=agg_mode, max_pair_distance=5))
+        self._setup_case(conll2004_demo, device)
+        self._assert_batch_consistency()
+        self._assert_trainable()
+        
+        
     def test_model_with_bert_like(self, conll2004_demo, bert_with_tokenizer, device):
         bert, tokenizer = bert_with_tokenizer
         self.config = ExtractorConfig('span_rel_classification', ohots=None, 
@@ -6,6 +6,7 @@ from eznlp.dataset import Dataset
 from eznlp.model import EncoderConfig, BertLikeConfig, SpanBertLikeConfig
 from eznlp.model import SpecificSpanRelClsDecoderConfig, SpecificSpanSparseRelClsDecoderConfig
 from eznlp.model import SpecificSpanExtractorConfig
+from eznlp.model.decoder.specific_span_sparse_rel_classification import _flatten_specific_span_hidden, _collect_context_from_specific_span_hidden
 from eznlp.training import Trainer
 
 
@@ -102,3 +103,72 @@ class TestModel(object):
         trainer = Trainer(self.model, device=device)
         set_chunks_pred = trainer.predict(dataset_wo_gold)
         assert len(set_chunks_pred) == len(data_wo_gold)
+        
+        
+    def test_sparse_filter_by_labels(self, conll2004_demo, bert_with_tokenizer, device):
+        bert, tokenizer = bert_with_tokenizer
+        self.config = SpecificSpanExtractorConfig(decoder='specific_span_sparse_rel', 
+                                                  bert_like=BertLikeConfig(tokenizer=tokenizer, bert_like=bert, freeze=False, output_hidden_states=True), 
+                                                  span_bert_like=SpanBertLikeConfig(bert_like=bert), 
+                                                  intermediate2=None)
+        self._setup_case(conll2004_demo, device)
+        self.model.eval()
+        decoder = self.model.decoder
+        assert '_rht_non_mask' not in {name.split('.')[-1] for name in self.model.state_dict()}
+        
+        batch = self.dataset.collate([self.dataset[i] for i in range(4)]).to(self.device)
+        losses, states = self.model(batch, return_states=True)
+        pred_filtered = self.model.decode(batch, **states)
+        
+        decoder.filter_by_labels = False
+        pred_unfiltered = self.model.decode(batch, **states)
+        decoder.filter_by_labels = True
+        # The mask filtering is consistent with the filtering by `existing_rht_labels`
+        assert pred_filtered == [[(label, head, tail) for label, head, tail in relations if (label, head[0], tail[0]) in decoder.existing_rht_labels] 
+                                     for relations in pred_unfiltered]
+        
+        # The mask is re-built for the models saved by earlier versions
+        del decoder._rht_non_mask
+        assert self.model.decode(batch, **states) == pred_filtered
+
+
+
+def test_collect_context_from_specific_span_hidden():
+    BATCH_SIZE = 4
+    MAX_LEN = 20
+    HID_DIM = 16
+    MAX_SPAN_SIZE = 5
+    
+    all_hidden = [torch.randn(BATCH_SIZE, MAX_LEN-k, HID_DIM) for k in range(MAX_SPAN_SIZE)]
+    flat_hidden, flat_offsets, flat_steps = _flatten_specific_span_hidden(all_hidden)
+    
+    batch_ids = torch.randint(0, BATCH_SIZE, size=(100, ))
+    starts = torch.randint(0, MAX_LEN-1, size=(100, ))
+    ends = (starts + torch.randint(1, MAX_LEN, size=(100, ))).clamp(max=MAX_LEN)
+    contexts = _collect_context_from_specific_span_hidden(batch_ids, starts, ends, flat_hidden, flat_offsets, flat_steps)
+    
+    for i, start, end, ctx in zip(batch_ids.tolist(), starts.tolist(), ends.tolist(), contexts):
+        if end - start <= MAX_SPAN_SIZE:
+            ctx_gold = all_hidden[end-start-1][i, start]
+        else:
+            ctx_gold = (all_hidden[MAX_SPAN_SIZE-1][i, start] + all_hidden[MAX_SPAN_SIZE-1][i, end-MAX_SPAN_SIZE]) / 2
+        assert (ctx - ctx_gold).abs().max().item() < 1e-6
+
+
+
+def test_all_pairs_loss_in_chunks(EAR_data_demo, monkeypatch):
+    config = SpecificSpanRelClsDecoderConfig(max_span_size=3)
+    config.in_dim = 32
+    config.build_vocab(EAR_data_demo)
+    decoder = config.instantiate()
+    decoder.eval()
+    
+    dbp_obj = config.exemplify({**EAR_data_demo[0], 'chunks_pred': []}, training=False)['dbp_obj']
+    affined_head = torch.randn(dbp_obj.num_spans, config.affine.out_dim)
+    affined_tail = torch.randn(dbp_obj.num_spans, config.affine.out_dim)
+    loss_dense = decoder.criterion(decoder._score_all_pairs(affined_head, affined_tail).flatten(end_dim=1), dbp_obj.dbp2label_id.flatten(end_dim=1))
+    
+    # Each chunk contains a single head span
+    monkeypatch.setattr("eznlp.model.decoder.specific_span_rel_classification.SCORE_CHUNK_NUMEL", 1)
+    loss_chunked = decoder._all_pairs_loss(affined_head, affined_tail, dbp_obj)
+    assert (loss_chunked - loss_dense).abs().item() < 1e-4 * loss_dense.abs().item()
@@ -124,6 +124,24 @@ class TestModel(object):
         assert beam1_res == greedy_res
         
         
+    @pytest.mark.parametrize("arch", ['LSTM', 'Gehring', 'Transformer'])
+    @pytest.mark.parametrize("beam_size", [2, 4])
+    def test_batched_beam_search(self, arch, beam_size, multi30k_demo, device):
+        self.config = Text2TextConfig(encoder=EncoderConfig(arch=arch, use_emb2init_hid=True), decoder=GeneratorConfig(arch=arch, use_emb2init_hid=True))
+        self._setup_case(multi30k_demo, device)
+        
+        self.model.eval()
+        batch = [self.dataset[i] for i in range(4)]
+        batch = self.dataset.collate(batch).to(self.device)
+        beam_res = self.model.beam_search(beam_size, batch)
+        
+        beam_res_single = []
+        for i in range(4):
+            single_batch = self.dataset.collate([self.dataset[i]]).to(self.device)
+            beam_res_single.extend(self.model.beam_search(beam_size, single_batch))
+        assert beam_res == beam_res_single
+        
+        
     @pytest.mark.parametrize("arch", ['LSTM', 'Gehring', 'Transformer'])
     def test_prediction_without_gold(self, arch, multi30k_demo, device):
         self.config = Text2TextConfig(encoder=EncoderConfig(arch=arch, use_emb2init_hid=True), 
@@ -3,7 +3,7 @@ import pytest
 import torch
 
 from eznlp.nn.functional import seq_lens2mask
-from eznlp.nn import SequenceAttention
+from eznlp.nn import SequenceAttention, TransformerDecoderBlock
 
 
 @pytest.mark.parametrize("num_heads", [1, 5])
@@ -24,3 +24,83 @@ def test_sequence_attention(num_heads, scoring, nonlinearity):
     assert (atten_weight[mask] == 0).all().item()
     assert atten_values.size(0) == BATCH_SIZE
     assert atten_values.size(1) == HID_DIM
+
+
+
+@pytest.mark.parametrize("num_heads", [1, 4])
+def test_transformer_decoder_block_incremental(num_heads):
+    BATCH_SIZE = 10
+    TRG_LEN = 8
+    SRC_LEN = 12
+    HID_DIM = 32
+    
+    x = torch.randn(BATCH_SIZE, TRG_LEN, HID_DIM)
+    src_x = torch.randn(BATCH_SIZE, SRC_LEN, HID_DIM)
+    src_seq_lens = torch.randint(0, SRC_LEN, size=(BATCH_SIZE, )) + 1
+    src_mask = seq_lens2mask(src_seq_lens, max_len=SRC_LEN)
+    
+    block = TransformerDecoderBlock(hid_dim=HID_DIM, ff_dim=64, num_heads=num_heads)
+    block.eval()
+    
+    cache = block.init_cache(src_x)
+    for t in range(1, TRG_LEN+1):
+        hidden_t = block(x[:, :t], src_x, src_mask=src_mask, last_step=True)
+        hidden_t_incr, cache = block.forward_step(x[:, t-1:t], cache, src_mask=src_mask)
+        assert (hidden_t_incr - hidden_t).abs().max().item() < 1e-5
+
+
+
+@pytest.mark.parametrize("num_heads", [1, 4])
+def test_transformer_decoder_block_incremental_training(num_heads):
+    BATCH_SIZE = 10
+    TRG_LEN = 8
+    SRC_LEN = 12
+    HID_DIM = 32
+    
+    x = torch.randn(BATCH_SIZE, TRG_LEN, HID_DIM)
+    src_x = torch.randn(BATCH_SIZE, SRC_LEN, HID_DIM)
+    src_seq_lens = torch.randint(0, SRC_LEN, size=(BATCH_SIZE, )) + 1
+    src_mask = seq_lens2mask(src_seq_lens, max_len=SRC_LEN)
+    
+    block = TransformerDecoderBlock(hid_dim=HID_DIM, ff_dim=64, num_heads=num_heads, drop_rate=0.5)
+    block.train()
+    
+    # The dropout is placed as in `forward`
+    cache = block.init_cache(src_x)
+    for t in range(1, TRG_LEN+1):
+        torch.manual_seed(t)
+        hidden_t = block(x[:, :t], src_x, src_mask=src_mask, last_step=True)
+        torch.manual_seed(t)
+        hidden_t_incr, cache = block.forward_step(x[:, t-1:t], cache, src_mask=src_mask)
+        assert (hidden_t_incr - hidden_t).abs().max().item() < 1e-6
+
+
+
+@pytest.mark.parametrize("num_heads", [1, 4])
+@pytest.mark.parametrize("backend", ['sdpa', 'chunked'])
+@pytest.mark.parametrize("mask_dim", [2, 3])
+def test_scaled_dot_attention_backends(num_heads, backend, mask_dim):
+    BATCH_SIZE = 10
+    QUERY_LEN = 30
+    MAX_LEN = 20
+    HID_DIM = 32
+    
+    x = torch.randn(BATCH_SIZE, MAX_LEN, HID_DIM)
+    query = torch.randn(BATCH_SIZE, QUERY_LEN, HID_DIM)
+    seq_lens = torch.randint(0, MAX_LEN, size=(BATCH_SIZE, )) + 1
+    mask = seq_lens2mask(seq_lens, max_len=MAX_LEN)
+    if mask_dim == 3:
+        mask = mask.unsqueeze(1).expand(-1, QUERY_LEN, -1)
+    
+    naive_attention = SequenceAttention(HID_DIM, num_heads=num_heads, scoring='scaled_dot', external_query=True)
+    attention = SequenceAttention(HID_DIM, num_heads=num_heads, scoring='scaled_dot', external_query=True, backend=backend, query_chunk_size=8)
+    naive_attention.eval()
+    attention.eval()
+    
+    values_gold, weight_gold = naive_attention(x, mask, query=query, return_atten_weight=True)
+    values, weight = attention(x, mask, query=query, return_atten_weight=True)
+    assert (values - values_gold).abs().max().item() < 1e-5
+    assert (weight - weight_gold).abs().max().item() < 1e-5
+    
+    values = attention(x, mask, query=query)
+    assert (values - values_gold).abs().max().item() < 1e-5
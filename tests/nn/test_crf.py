@@ -1,24 +1,26 @@
 # -*- coding: utf-8 -*-
+import pytest
 import torch
 import torchcrf
 
 from eznlp.nn import CRF
 
 
-def test_crf():
+@pytest.mark.parametrize("step", [1, 20, 33])
+@pytest.mark.parametrize("partition_mode", ['sequential', 'scan'])
+def test_crf(step, partition_mode):
     batch_size = 10
-    step = 20
     tag_dim = 5
     emissions = torch.randn(batch_size, step, tag_dim)
     tag_ids = torch.randint(0, tag_dim, (batch_size, step))
-    seq_lens = torch.randint(1, step, (batch_size, ))
+    seq_lens = torch.randint(1, step+1, (batch_size, ))
     mask = (torch.arange(step).unsqueeze(0).expand(batch_size, -1) >= seq_lens.unsqueeze(-1))
     
     benchmark_crf = torchcrf.CRF(tag_dim, batch_first=True)
     benchmark_llh = benchmark_crf(emissions, tag_ids, (~mask).type(torch.uint8), reduction='none')
     benchmark_best_paths = benchmark_crf.decode(emissions, (~mask).type(torch.uint8))
     
-    crf = CRF(tag_dim, batch_first=True)
+    crf = CRF(tag_dim, batch_first=True, partition_mode=partition_mode)
     crf.sos_transitions.data = benchmark_crf.start_transitions.data
     crf.eos_transitions.data = benchmark_crf.end_transitions.data
     crf.transitions.data = benchmark_crf.transitions.data
@@ -28,4 +30,75 @@ def test_crf():
     
     assert (benchmark_llh + losses).abs().max() < 1e-4
     assert best_paths == benchmark_best_paths
-    
\ No newline at end of file
+
+
+
+def test_crf_scan_long_sequence():
+    batch_size = 4
+    step = 512
+    tag_dim = 73
+    emissions = torch.randn(batch_size, step, tag_dim)
+    tag_ids = torch.randint(0, tag_dim, (batch_size, step))
+    seq_lens = torch.randint(1, step+1, (batch_size, ))
+    mask = (torch.arange(step).unsqueeze(0).expand(batch_size, -1) >= seq_lens.unsqueeze(-1))
+    
+    crf = CRF(tag_dim, batch_first=True)
+    losses = crf(emissions, tag_ids, mask)
+    
+    crf.partition_mode = 'scan'
+    emissions.requires_grad_()
+    scan_losses = crf(emissions, tag_ids, mask)
+    assert ((scan_losses - losses).abs() / losses.abs()).max().item() < 1e-4
+    
+    scan_losses.sum().backward()
+    assert torch.isfinite(emissions.grad).all().item()
+    assert torch.isfinite(crf.transitions.grad).all().item()
+
+
+
+def test_crf_nbest():
+    batch_size = 10
+    step = 20
+    tag_dim = 5
+    emissions = torch.randn(batch_size, step, tag_dim)
+    seq_lens = torch.randint(1, step, (batch_size, ))
+    mask = (torch.arange(step).unsqueeze(0).expand(batch_size, -1) >= seq_lens.unsqueeze(-1))
+    
+    crf = CRF(tag_dim, batch_first=True)
+    best_paths = crf.decode(emissions, mask)
+    nbest_paths = crf.decode(emissions, mask, nbest=3)
+    assert [paths[0] for paths in nbest_paths] == best_paths
+    
+    padded_best_paths, best_seq_lens = crf.decode(emissions, mask, return_padded=True)
+    assert padded_best_paths.size() == (batch_size, step)
+    assert (best_seq_lens == seq_lens).all().item()
+    
+    # The N-best paths are distinct, and ordered by scores: high -> low
+    tag_ids = torch.nn.utils.rnn.pad_sequence([torch.tensor(paths[k]) for paths in nbest_paths for k in range(3)], batch_first=True)
+    tag_ids = torch.cat([tag_ids, tag_ids.new_zeros(tag_ids.size(0), step-tag_ids.size(1))], dim=1)
+    losses = crf(emissions.repeat_interleave(3, dim=0), tag_ids, mask.repeat_interleave(3, dim=0)).view(batch_size, 3)
+    for paths, curr_losses, slen in zip(nbest_paths, losses, seq_lens.tolist()):
+        if tag_dim**slen >= 3:
+            assert len(set(tuple(path) for path in paths)) == 3
+            assert (curr_losses[1:] - curr_losses[:-1] >= -1e-4).all().item()
+
+
+def test_crf_constrained_decoding():
+    batch_size = 10
+    step = 20
+    tag_dim = 5
+    emissions = torch.randn(batch_size, step, tag_dim)
+    seq_lens = torch.randint(1, step, (batch_size, ))
+    mask = (torch.arange(step).unsqueeze(0).expand(batch_size, -1) >= seq_lens.unsqueeze(-1))
+    
+    # Tag 0 cannot start or end a sequence; tag `i` cannot be followed by tag `i+1`
+    sos_legal = torch.arange(tag_dim) != 0
+    legal = (torch.arange(tag_dim).unsqueeze(-1) + 1 != torch.arange(tag_dim))
+    eos_legal = torch.arange(tag_dim) != 0
+    
+    crf = CRF(tag_dim, batch_first=True)
+    crf.set_transition_constraints(sos_legal, legal, eos_legal)
+    best_paths = crf.decode(emissions, mask)
+    for path in best_paths:
+        assert path[0] != 0 and path[-1] != 0
+        assert all(legal[prev_tag, this_tag].item() for prev_tag, this_tag in zip(path[:-1], path[1:]))
@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
+import pytest
 import torch
 
-from eznlp.nn.functional import seq_lens2mask, mask2seq_lens
+from eznlp.nn.functional import seq_lens2mask, mask2seq_lens, sequence_pooling, range_pooling
 
 
 def test_seq_lens2mask():
@@ -18,3 +19,15 @@ def test_seq_lens2mask():
     seq_lens_retr = mask2seq_lens(mask)
     assert (seq_lens_retr == seq_lens).all().item()
 
+
+
+@pytest.mark.parametrize("mode", ['mean', 'max', 'min'])
+def test_range_pooling(mode):
+    x = torch.randn(4, 37, 10)
+    batch_ids = torch.randint(0, 4, size=(100, ))
+    starts = torch.randint(0, 37, size=(100, ))
+    ends = starts + 1 + (torch.rand(100) * (37-starts)).long()
+    
+    pooled = range_pooling(x, batch_ids, starts, ends, mode=mode)
+    pooled_gold = torch.stack([sequence_pooling(x[i, s:e].unsqueeze(0), mode=mode).squeeze(0) for i, s, e in zip(batch_ids.tolist(), starts.tolist(), ends.tolist())])
+    assert (pooled - pooled_gold).abs().max().item() < 1e-4
@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 import pytest
+import random
+import hashlib
 import torch
 
 from eznlp.token import Token
-from eznlp.dataset import Dataset
+from eznlp.dataset import Dataset, ExampleCache, LengthBucketBatchSampler, _update_fingerprint
 from eznlp.config import ConfigDict
 from eznlp.model import OneHotConfig, MultiHotConfig, ExtractorConfig
 
@@ -42,4 +44,85 @@ def test_batches(conll2003_demo, device):
     dataloader = torch.utils.data.DataLoader(dataset, batch_size=4, shuffle=True, collate_fn=dataset.collate)
     for batch in dataloader:
         batch.to(device)
-        
\ No newline at end of file
+        
+
+
+@pytest.mark.parametrize("training", [True, False])
+def test_dataset_cache(training, conll2003_demo, tmp_path):
+    config = ExtractorConfig('span_classification')
+    config.decoder.neg_sampling_rate = 0.5
+    dataset = Dataset(conll2003_demo, config, training=training)
+    dataset.build_vocabs_and_dims()
+    cached_dataset = Dataset(conll2003_demo, config, training=training, cache_dir=str(tmp_path))
+    assert cached_dataset.fingerprint == dataset.fingerprint
+    
+    cached_dataset.build_cache(shard_size=32)
+    assert cached_dataset._cache.exists
+    assert len(list(tmp_path.glob("*/shard-*.pt"))) == (len(dataset) + 31) // 32
+    
+    # Re-building an existing cache (e.g., by a concurrent process) keeps the complete one
+    ExampleCache(str(tmp_path), cached_dataset.fingerprint, shard_size=32).build(cached_dataset._exemplify(i) for i in range(len(dataset)))
+    assert len(list(tmp_path.glob("*/shard-*.pt"))) == (len(dataset) + 31) // 32
+    assert len(list(tmp_path.glob("*.tmp-*"))) == 0
+    
+    for i in [0, 1, 33, len(dataset)-1]:
+        example, cached_example = dataset[i], cached_dataset[i]
+        assert cached_example.keys() == example.keys()
+        assert (cached_example['ohots']['text'] == example['ohots']['text']).all().item()
+        if not training:
+            assert (cached_example['boundaries_obj'].diagonal_label_ids == example['boundaries_obj'].diagonal_label_ids).all().item()
+    
+    # The cached objects are never handed out, and hence never modified in place (e.g., moved to device)
+    assert cached_dataset[1]['boundaries_obj'] is not cached_dataset[1]['boundaries_obj']
+    
+    # Negative sampling remains on the fly in training
+    if training:
+        assert not all((cached_dataset[0]['boundaries_obj'].diagonal_non_mask == cached_dataset[0]['boundaries_obj'].diagonal_non_mask).all().item() for _ in range(10))
+    
+    # Changes in configurations lead to different caches
+    config.decoder.max_span_size = 5
+    assert Dataset(conll2003_demo, config, training=training).fingerprint != dataset.fingerprint
+
+
+
+def test_fingerprint_of_callables():
+    def _fingerprint(obj):
+        hasher = hashlib.sha1()
+        _update_fingerprint(hasher, obj)
+        return hasher.hexdigest()
+    
+    # Callables are hashed by names, instead of `repr` with memory addresses
+    assert _fingerprint({'transform': lambda x: x}) == _fingerprint({'transform': lambda x: x})
+    assert _fingerprint({'transform': str.lower}) == _fingerprint({'transform': str.lower})
+    assert _fingerprint({'transform': str.lower}) != _fingerprint({'transform': str.upper})
+    assert _fingerprint({'module': torch.nn.Dropout}) == _fingerprint({'module': torch.nn.Dropout})
+
+
+
+@pytest.mark.parametrize("batch_size, max_tokens", [(8, None), (None, 200), (8, 200)])
+@pytest.mark.parametrize("shuffle, bucket_size", [(False, None), (True, 32)])
+def test_length_bucket_batch_sampler(batch_size, max_tokens, shuffle, bucket_size, conll2003_demo):
+    dataset = Dataset(conll2003_demo, ExtractorConfig('sequence_tagging'))
+    dataset.build_vocabs_and_dims()
+    seq_lens = dataset.seq_lens
+    
+    batch_sampler = LengthBucketBatchSampler(seq_lens, batch_size=batch_size, max_tokens=max_tokens, shuffle=shuffle, bucket_size=bucket_size)
+    random_state = random.getstate()
+    num_batches = len(batch_sampler)
+    # `len` does not consume the random state
+    assert random.getstate() == random_state
+    batches = list(batch_sampler)
+    assert len(batches) == num_batches
+    assert sorted(i for batch_indices in batches for i in batch_indices) == list(range(len(dataset)))
+    for batch_indices in batches:
+        assert batch_size is None or len(batch_indices) <= batch_size
+        assert max_tokens is None or len(batch_indices) == 1 or len(batch_indices) * max(seq_lens[i] for i in batch_indices) <= max_tokens
+    
+    num_padded = sum(len(batch_indices) * max(seq_lens[i] for i in batch_indices) for batch_indices in batches)
+    num_padded_unsorted = sum(len(seq_lens[k:k+8]) * max(seq_lens[k:k+8]) for k in range(0, len(seq_lens), 8))
+    if batch_size is not None and max_tokens is None and not shuffle:
+        assert num_padded <= num_padded_unsorted
+    
+    dataloader = torch.utils.data.DataLoader(dataset, batch_sampler=batch_sampler, collate_fn=dataset.collate)
+    for batch in dataloader:
+        assert batch.seq_lens.size(0) == batch.mask.size(0)
@@ -1,10 +1,11 @@
 # -*- coding: utf-8 -*-
 import pytest
 import pickle
+import numpy
 
 from eznlp.token import Full2Half
 from eznlp.token import zh_punct_re, zh_char_re
-from eznlp.token import Token, TokenSequence, LexiconTokenizer
+from eznlp.token import Token, TokenSequence, ColumnarTokenSequence, LexiconTokenizer
 
 
 def test_full2half():
@@ -251,6 +252,56 @@ class TestTokenSequence(object):
         assert tokens_loaded.raw_text == tokens.raw_text
         assert tokens_loaded.token_sep == tokens.token_sep
         assert tokens_loaded.pad_token == tokens.pad_token
+        
+        
+    def test_columnar(self):
+        tokenized_text = "This is a -3.14 demo . This is it".split()
+        tokens = TokenSequence.from_tokenized_text(tokenized_text, additional_tags={'pos': list("ABCDEFGHI")}, 
+                                                   case_mode='Lower', number_mode='Marks')
+        columnar_tokens = TokenSequence.from_tokenized_text(tokenized_text, additional_tags={'pos': list("ABCDEFGHI")}, 
+                                                            case_mode='Lower', number_mode='Marks', 
+                                                            columnar=True, fields=Token._basic_ohot_fields+Token._basic_mhot_fields)
+        assert isinstance(columnar_tokens, ColumnarTokenSequence)
+        assert len(columnar_tokens) == len(tokens)
+        for field in ['raw_text', 'start', 'end', 'pos', 'bigram', 'trigram'] + Token._basic_ohot_fields:
+            assert list(getattr(columnar_tokens, field)) == getattr(tokens, field)
+        assert (columnar_tokens.en_shape_features == numpy.stack(tokens.en_shape_features)).all()
+        
+        # Interned strings
+        assert columnar_tokens.raw_text[0] is columnar_tokens.raw_text[6]
+        
+        assert columnar_tokens[3] == tokens[3]
+        assert columnar_tokens[2:5].text == tokens[2:5].text
+        assert columnar_tokens[:4] + columnar_tokens[4:] == columnar_tokens
+        assert (columnar_tokens[:4] + tokens[4:]).text == tokens.text
+        assert ColumnarTokenSequence.from_token_sequence(tokens) == columnar_tokens
+        
+        columnar_tokens_loaded = pickle.loads(pickle.dumps(columnar_tokens))
+        assert columnar_tokens_loaded == columnar_tokens
+        assert columnar_tokens_loaded.en_pattern == columnar_tokens.en_pattern
+        
+        columnar_tokens.reset_raw_text([tok.upper() for tok in tokenized_text])
+        assert columnar_tokens.en_pattern_sum[0] == "A"
+        assert columnar_tokens.text == tokens.text
+        
+        
+    def test_columnar_built_columns(self):
+        tokenizer = LexiconTokenizer(["北京", "天安", "天安门", "安门"], return_singleton=True)
+        tokens = TokenSequence.from_tokenized_text(list("我爱北京天安门"), token_sep="")
+        columnar_tokens = TokenSequence.from_tokenized_text(list("我爱北京天安门"), token_sep="", columnar=True)
+        for curr_tokens in [tokens, columnar_tokens]:
+            curr_tokens.build_pseudo_boundaries(sep_width=1)
+            curr_tokens.build_softwords(tokenizer.tokenize)
+            curr_tokens.build_softlexicons(tokenizer.tokenize)
+        
+        # The built columns are preserved in slicing and concatenation
+        for curr_columnar_tokens, curr_tokens in [(columnar_tokens, tokens), (columnar_tokens[2:5], tokens[2:5])]:
+            assert list(curr_columnar_tokens.start) == curr_tokens.start
+            assert list(curr_columnar_tokens.end) == curr_tokens.end
+            assert all((x == y).all() for x, y in zip(curr_columnar_tokens.softword, curr_tokens.softword))
+            assert curr_columnar_tokens.softlexicon == curr_tokens.softlexicon
+        assert columnar_tokens[:3] + columnar_tokens[3:] == columnar_tokens
+        assert TokenSequence.from_tokenized_text(list("我爱北京天安门"), token_sep="", columnar=True) != columnar_tokens
 
 
 
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import pytest
+import torch
+
+from eznlp.vectors import Vectors, GloVe, convert_to_binary, _load_from_file
+from eznlp.nn.init import reinit_embedding_by_pretrained_
+
+
+@pytest.fixture
+def vectors_path(tmp_path):
+    torch.manual_seed(0)
+    words = ["the", "The", "of", "apple", "Paris", "中国", " "]
+    vectors = torch.randn(len(words), 8)
+    path = str(tmp_path / "vectors.txt")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"{len(words)} 8\n")
+        for w, vec in zip(words, vectors.tolist()):
+            f.write(" ".join([w] + [f"{v:.6f}" for v in vec]) + "\n")
+    return path
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+@pytest.mark.parametrize("dtype", ['float32', 'float16'])
+def test_binary_vectors(num_workers, dtype, vectors_path):
+    itos, vectors = _load_from_file(vectors_path, encoding='utf-8', skiprows=0)
+    convert_to_binary(vectors_path, encoding='utf-8', skiprows=0, dtype=dtype, num_workers=num_workers)
+    itos_bin, vectors_bin = Vectors.load_from_binary(vectors_path)
+    
+    assert itos_bin == itos
+    assert vectors_bin.dtype == getattr(torch, dtype)
+    assert (vectors_bin.float() - vectors).abs().max().item() < 1e-2
+    
+    loaded = Vectors.load(vectors_path)
+    assert loaded.itos == itos
+    glove = GloVe(vectors_path)
+    assert glove.itos == itos
+    
+    
+def test_vectors_subset_and_reinit(vectors_path):
+    vectors = Vectors.load(vectors_path, encoding='utf-8', skiprows=0)
+    itos = ["<pad>", "the", "paris", "banana", "中国"]
+    
+    sub_vectors = vectors.subset(itos)
+    assert sub_vectors.itos == ["the", "Paris", "中国"]
+    assert (sub_vectors.lookup("paris") == vectors.lookup("paris")).all().item()
+    
+    embedding = torch.nn.Embedding(len(itos), vectors.emb_dim, padding_idx=0)
+    oov = reinit_embedding_by_pretrained_(embedding, itos, vectors)
+    assert oov == ["<pad>", "banana"]
+    assert (embedding.weight[1] == vectors["the"]).all().item()
+    assert (embedding.weight[2] == vectors["Paris"]).all().item()
+    assert (embedding.weight[3] == 0).all().item()
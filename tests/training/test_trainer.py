@@ -58,3 +58,100 @@ def test_gradient_accumulation(conll2003_demo, device):
     assert trainer1.num_steps / trainer1.num_grad_acc_steps == trainer2.num_steps / trainer2.num_grad_acc_steps
     assert all((p1 - p2).abs().max().item() < 1e-4 for p1, p2 in zip(model1.parameters(), model2.parameters()))
     assert all((p1 - pb).abs().max().item() > 1e-4 for p1, pb in zip(model1.parameters(), params_backup))
+
+
+
+def test_predict_with_length_bucketing(conll2003_demo, device):
+    config = ExtractorConfig('sequence_tagging')
+    dataset = Dataset(conll2003_demo, config, training=False)
+    dataset.build_vocabs_and_dims()
+    model = config.instantiate().to(device)
+    
+    trainer = Trainer(model, device=device)
+    set_chunks_pred = trainer.predict(dataset, batch_size=4)
+    set_chunks_pred_bucketed = trainer.predict(dataset, batch_size=4, length_bucketing=True, max_tokens=100)
+    assert set_chunks_pred_bucketed == set_chunks_pred
+
+
+
+@pytest.mark.parametrize("num_interrupted_steps", [4, 5])
+def test_checkpoint_resume(num_interrupted_steps, conll2003_demo, device, tmp_path):
+    # Note: set dropout rate as 0 for consistency
+    config = ExtractorConfig(intermediate2=EncoderConfig(in_drop_rates=(0.0, 0.0, 0.0), hid_drop_rate=0.0), 
+                             decoder=SequenceTaggingDecoderConfig(in_drop_rates=(0.0, 0.0, 0.0)))
+    dataset = Dataset(conll2003_demo[:8], config)
+    dataset.build_vocabs_and_dims()
+    dataloader = torch.utils.data.DataLoader(dataset, batch_size=2, shuffle=True, collate_fn=dataset.collate)
+    
+    seed = random.randint(0, 1000)
+    torch.manual_seed(seed)
+    model1 = config.instantiate().to(device)
+    torch.manual_seed(seed)
+    model2 = config.instantiate().to(device)
+    
+    torch.manual_seed(seed)
+    optimizer1 = torch.optim.AdamW(model1.parameters())
+    trainer1 = Trainer(model1, optimizer=optimizer1, device=device)
+    trainer1.train_steps(train_loader=dataloader, num_epochs=3)
+    assert trainer1.num_steps == 3*len(dataloader)
+    
+    # Train for 4 steps (i.e., interrupted at the end of the 1st epoch) or 5 steps (i.e., interrupted 
+    # in the middle of the 2nd epoch), and then resume from the checkpoint
+    torch.manual_seed(seed)
+    checkpoint_path = f"{tmp_path}/checkpoint.pth"
+    optimizer2 = torch.optim.AdamW(model2.parameters())
+    trainer2 = Trainer(model2, optimizer=optimizer2, device=device)
+    trainer2.train_steps(train_loader=dataloader, num_epochs=3, max_steps=num_interrupted_steps, disp_every_steps=1, eval_every_steps=1, checkpoint_path=checkpoint_path)
+    assert trainer2.num_steps == num_interrupted_steps
+    
+    model3 = config.instantiate().to(device)
+    optimizer3 = torch.optim.AdamW(model3.parameters())
+    trainer3 = Trainer(model3, optimizer=optimizer3, device=device)
+    trainer3.train_steps(train_loader=dataloader, num_epochs=3, disp_every_steps=1, eval_every_steps=1, checkpoint_path=checkpoint_path)
+    
+    assert trainer3.num_steps == trainer1.num_steps
+    assert all((p1 - p3).abs().max().item() < 1e-4 for p1, p3 in zip(model1.parameters(), model3.parameters()))
+
+
+
+def test_distributed_train_steps(conll2003_demo, tmp_path):
+    if not torch.distributed.is_available():
+        pytest.skip("test requires `torch.distributed`")
+    
+    torch.distributed.init_process_group(backend='gloo', init_method=f"file://{tmp_path}/ddp_store", rank=0, world_size=1)
+    try:
+        config = ExtractorConfig('sequence_tagging')
+        dataset = Dataset(conll2003_demo, config)
+        dataset.build_vocabs_and_dims()
+        model = torch.nn.parallel.DistributedDataParallel(config.instantiate(), find_unused_parameters=True)
+        
+        optimizer = torch.optim.AdamW(model.parameters())
+        trainer = Trainer(model, optimizer=optimizer, device=torch.device('cpu'))
+        assert trainer.is_main_rank and trainer.num_metrics == 1
+        
+        sampler = torch.utils.data.distributed.DistributedSampler(dataset, shuffle=True)
+        dataloader = torch.utils.data.DataLoader(dataset, batch_size=4, sampler=sampler, collate_fn=dataset.collate)
+        trainer.train_steps(train_loader=dataloader, dev_loader=dataloader, num_epochs=2, disp_every_steps=2, eval_every_steps=4)
+        
+        set_chunks_pred = trainer.predict(dataset, batch_size=4)
+        assert len(set_chunks_pred) == len(dataset)
+    finally:
+        torch.distributed.destroy_process_group()
+
+
+
+def test_profile(conll2003_demo, device, tmp_path):
+    config = ExtractorConfig('sequence_tagging')
+    dataset = Dataset(conll2003_demo, config)
+    dataset.build_vocabs_and_dims()
+    model = config.instantiate().to(device)
+    
+    optimizer = torch.optim.AdamW(model.parameters())
+    trainer = Trainer(model, optimizer=optimizer, device=device)
+    dataloader = torch.utils.data.DataLoader(dataset, batch_size=4, shuffle=True, collate_fn=dataset.collate)
+    report = trainer.profile(dataloader, num_batches=3, trace_path=f"{tmp_path}/trace.json")
+    
+    assert all(f"{phase}_secs" in report for phase in ['data', 'to_device', 'forward', 'decode', 'backward', 'optimizer'])
+    assert abs(sum(secs for key, secs in report.items() if key.endswith('_secs') and key != 'total_secs') - report['total_secs']) < 1e-6
+    assert report['tokens_per_sec'] > 0
+    assert trainer.timer is None
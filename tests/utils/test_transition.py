@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 import pytest
+import os
+import pickle
+import eznlp.utils
 
 from eznlp.utils import ChunksTagsTranslator
 
@@ -69,3 +72,32 @@ def test_translation_between_schemes2(from_scheme, from_tags, to_scheme, to_tags
     chunks = from_translator.tags2chunks(from_tags)
     from_tags_translated = to_translator.chunks2tags(chunks, len(from_tags))
     assert from_tags_translated == to_tags
+
+
+@pytest.mark.parametrize("scheme", ['BIO1', 'BIO2', 'BIOES', 'BMES', 'BILOU', 'OntoNotes', 'wwm'])
+def test_transition_tables(scheme):
+    pandas = pytest.importorskip('pandas')
+    sheet_name = 'BIOES' if scheme in ('BMES', 'BILOU') else scheme
+    trans = pandas.read_excel(f"{os.path.dirname(eznlp.utils.__file__)}/transition.xlsx", sheet_name=sheet_name, 
+                              usecols=['from_tag', 'to_tag', 'legal', 'end_of_chunk', 'start_of_chunk'])
+    
+    translator = ChunksTagsTranslator(scheme=scheme)
+    mapper = dict(zip(['B', 'I', 'O', 'E', 'S'], translator.idx2base_tag)) if scheme in ('BMES', 'BILOU') else {}
+    assert len(translator.trans) == len(trans)
+    for _, row in trans.iterrows():
+        assert translator.trans[(mapper.get(row['from_tag'], row['from_tag']), mapper.get(row['to_tag'], row['to_tag']))] == \
+            {'legal': row['legal'], 'end_of_chunk': row['end_of_chunk'], 'start_of_chunk': row['start_of_chunk']}
+
+
+@pytest.mark.parametrize("scheme, tags", 
+                         [('BIO1',  ['O', 'I-EntA', 'I-EntA', 'B-EntA', 'B-EntB', 'O', 'I-EntC', 'I-EntC']), 
+                          ('BIOES', ['B-EntA', 'I-EntA', 'E-EntA', 'S-EntA', 'S-EntB', 'O', 'B-EntC', 'I-EntB']), 
+                          ('OntoNotes', ['(EntA*', '*', '*)', '(EntA)', '(EntB)', '*', '(EntC*', '*)'])])
+def test_tag_ids2chunks(scheme, tags):
+    translator = ChunksTagsTranslator(scheme=scheme)
+    idx2tag = ['<pad>'] + sorted(set(tags))
+    tag_ids = [idx2tag.index(tag) for tag in tags]
+    assert translator.tag_ids2chunks(tag_ids, idx2tag) == translator.tags2chunks(tags)
+    
+    translator_loaded = pickle.loads(pickle.dumps(translator))
+    assert translator_loaded.tags2chunks(tags) == translator.tags2chunks(tags)